@@ -1,12 +1,81 @@
 
 import datetime
 import os
+import tempfile
 from flask import Flask
 
 webapp = Flask(__name__)
 webapp.config["SECRET_KEY"] = b']\r7\x1f\xe20\xfc\xe8%\x15\xbd' #os.urandom(11)
 webapp.config["PERMANENT_SESSION_LIFETIME"] = datetime.timedelta(hours=24)
 webapp.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+# aligned subtitles cache used by the view page
+webapp.config['SEGMENT_CACHE_SIZE'] = 256
+webapp.config['SEGMENT_CACHE_TTL'] = 3600
+# segments range endpoint returns at most this many segments
+webapp.config['SEGMENTS_MAX_RANGE'] = 500
+# browsers keep subtitle tracks of an unchanged transcript this long
+webapp.config['SUBTITLE_MAX_AGE'] = 86400
+# text objects needed by the view page are fetched in parallel
+webapp.config['S3_FETCH_WORKERS'] = 16
+webapp.config['S3_FETCH_TIMEOUT'] = 10
+# shared AWS clients, pool must fit request threads plus fetch workers
+webapp.config['AWS_MAX_POOL_CONNECTIONS'] = 50
+webapp.config['AWS_CONNECT_TIMEOUT'] = 5
+webapp.config['AWS_READ_TIMEOUT'] = 10
+webapp.config['AWS_RETRY_MODE'] = 'standard'
+webapp.config['AWS_MAX_ATTEMPTS'] = 3
+webapp.config['AWS_TCP_KEEPALIVE'] = True
+# switched off with AWS_PREWARM=0 when the app runs against local stand-ins
+webapp.config['AWS_PREWARM'] = os.environ.get('AWS_PREWARM', '1') != '0'
+# records of uploaded files are written by a background queue journaled here
+webapp.config['POST_UPLOAD_JOURNAL'] = os.environ.get(
+    'POST_UPLOAD_JOURNAL', os.path.join(tempfile.gettempdir(), 'a3_post_upload.sqlite'))
+webapp.config['POST_UPLOAD_WORKERS'] = 4
+webapp.config['POST_UPLOAD_MAX_ATTEMPTS'] = 8
+webapp.config['POST_UPLOAD_RETRY_DELAY'] = 0.5
+# keys a throttled table leaves unprocessed in a batch read are read again
+# after exponential backoff, a file still unread is left out of the status
+webapp.config['BATCH_READ_MAX_ATTEMPTS'] = 5
+webapp.config['BATCH_READ_RETRY_DELAY'] = 0.05
+# dashboard lists files page by page
+webapp.config['DASHBOARD_PAGE_SIZE'] = 25
+webapp.config['DASHBOARD_MAX_PAGE_SIZE'] = 100
+# pending files are watched with long poll requests holding a worker thread
+webapp.config['STATUS_LONG_POLL_TIMEOUT'] = 25
+webapp.config['STATUS_POLL_INTERVAL'] = 3
+
+# every request is timed, a sample of them and all slow ones are logged
+webapp.config['SLOW_REQUEST_SECONDS'] = 1.0
+webapp.config['REQUEST_LOG_SAMPLE_RATE'] = 0.01
+
+# text responses are compressed with brotli (if installed) or gzip, compressed
+# bodies of responses with an ETag are kept for repeated requests
+webapp.config['COMPRESS_MIN_BYTES'] = 1024
+webapp.config['COMPRESS_GZIP_LEVEL'] = 6
+webapp.config['COMPRESS_BROTLI_QUALITY'] = 5
+webapp.config['COMPRESSED_CACHE_SIZE'] = 256
+webapp.config['COMPRESSED_CACHE_TTL'] = 3600
+
+from app import metrics
+metrics.init_app(webapp)
+
+from app import compression
+compression.init_app(webapp)
+
+from app import aws
+aws.configure(webapp.config)
 
 from app import main
+
+if webapp.config['AWS_PREWARM']:
+    aws.prewarm(clients=['s3'], resources=['dynamodb'])
+
+
+def start_background_tasks():
+    '''Starts the post upload queue, tasks left in the journal by a previous
+    run are applied now. Called by the server entry points (wsgi.py, run.py)
+    and not on import, so scripts importing the package do not lease tasks
+    from the shared journal'''
+    main.post_upload_queue.start()
+
 # from app import hello_v2
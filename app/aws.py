@@ -0,0 +1,87 @@
+'''Shared AWS clients and resources for the web app. Clients are thread safe
+and shared by all threads, resources are not, so every thread gets its own.
+Everything is created from a single session with the same tuned config,
+calls of every client are recorded in app.metrics'''
+
+import threading
+import boto3
+from botocore.config import Config
+
+from .metrics import instrument_client
+
+_session = boto3.session.Session()
+_config = Config()
+_clients = {}
+_overrides = {}
+_local = threading.local()
+_lock = threading.Lock()
+
+
+def configure(config):
+    '''Builds botocore config from the app config. Must be called before
+    the first client is created, existing clients are dropped'''
+    global _config
+    with _lock:
+        _config = Config(
+            max_pool_connections=config['AWS_MAX_POOL_CONNECTIONS'],
+            connect_timeout=config['AWS_CONNECT_TIMEOUT'],
+            read_timeout=config['AWS_READ_TIMEOUT'],
+            retries={'mode': config['AWS_RETRY_MODE'], 'max_attempts': config['AWS_MAX_ATTEMPTS']},
+            tcp_keepalive=config['AWS_TCP_KEEPALIVE'],
+        )
+        _clients.clear()
+    _local.__dict__.clear()
+
+
+def override(service, client=None, resource=None):
+    '''Replaces client and/or resource of a service for every thread, used
+    to run the app against local stand-ins (see benchmarks/local_aws.py)'''
+    with _lock:
+        if client is not None:
+            _overrides[('client', service)] = client
+        if resource is not None:
+            _overrides[('resource', service)] = resource
+
+
+def client(service):
+    '''Returns the shared client of the service'''
+    if _overrides:
+        svc_client = _overrides.get(('client', service))
+        if svc_client is not None:
+            return svc_client
+    svc_client = _clients.get(service)
+    if svc_client is None:
+        # session is not thread safe, clients are created one at a time
+        with _lock:
+            svc_client = _clients.get(service)
+            if svc_client is None:
+                svc_client = instrument_client(_session.client(service, config=_config))
+                _clients[service] = svc_client
+    return svc_client
+
+
+def resource(service):
+    '''Returns the resource of the service owned by the current thread'''
+    if _overrides:
+        svc_resource = _overrides.get(('resource', service))
+        if svc_resource is not None:
+            return svc_resource
+    resources = _local.__dict__.setdefault('resources', {})
+    svc_resource = resources.get(service)
+    if svc_resource is None:
+        with _lock:
+            svc_resource = _session.resource(service, config=_config)
+        instrument_client(svc_resource.meta.client)
+        resources[service] = svc_resource
+    return svc_resource
+
+
+def prewarm(clients=(), resources=()):
+    '''Resolves credentials and creates clients ahead of the first request,
+    so it does not pay for credential, model and endpoint loading'''
+    with _lock:
+        _session.get_credentials()
+    for service in clients:
+        client(service)
+    for service in resources:
+        resource(service)
@@ -0,0 +1,81 @@
+'''Process-wide LRU cache with a time to live, used for the aligned subtitle
+segments served by the view page and for compressed response bodies'''
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    '''LRU cache whose entries expire ttl seconds after they were stored.
+    Keys are tuples; entries of one file share leading elements, so they
+    can be dropped together with invalidate. Keys used by the app:
+
+        segments           (user, filename, dstlang, version, parts)
+        compressed bodies  (user, request path, ETag, encoding)
+
+    version identifies the transcript the segments were computed from and
+    parts the number of parts of a language that is not complete yet, so
+    a finished transcript keeps its entry until it expires, gets evicted
+    or is invalidated because the file was uploaded again.
+    '''
+
+    def __init__(self, max_entries=256, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        '''Returns the cached value for the key or None if there is no
+        valid entry. Counts the lookup as a hit or a miss'''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        '''Stores the value, evicting least recently used entries
+        when the cache is full'''
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *prefix):
+        '''Drops every entry whose key starts with the given elements, e.g.
+        invalidate(user, filename) drops all segments of the user's file.
+        Must be called whenever the file gets uploaded again and will be
+        reprocessed. Returns the number of dropped entries'''
+        with self._lock:
+            stale = [k for k in self._entries if k[:len(prefix)] == prefix]
+            for key in stale:
+                del self._entries[key]
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        '''Returns a dictionary with hit/miss counters and the current size'''
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+            }
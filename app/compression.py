@@ -0,0 +1,69 @@
+'''Compression of text responses negotiated with Accept-Encoding. Brotli is
+offered when the brotli package is installed, gzip otherwise. Compressed
+bodies of responses with an ETag are cached, so a transcript requested again
+is not compressed again'''
+
+import gzip
+
+from flask import request, session
+
+from .cache import TTLCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript")
+
+
+def available_encodings():
+    '''Returns encodings the app can produce, preferred first'''
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def compress(data, encoding, gzip_level=6, brotli_quality=5):
+    if encoding == "br":
+        return brotli.compress(data, quality=brotli_quality)
+    # mtime 0 makes the same body compress to the same bytes
+    return gzip.compress(data, compresslevel=gzip_level, mtime=0)
+
+
+def compressible(response):
+    return (response.status_code == 200 and not response.direct_passthrough and not response.is_streamed
+            and "Content-Encoding" not in response.headers
+            and (response.mimetype or "").startswith(COMPRESSIBLE_TYPES))
+
+
+def init_app(app):
+    '''Compresses responses of at least COMPRESS_MIN_BYTES. Must be called
+    after metrics.init_app, so response sizes are recorded compressed'''
+    cache = TTLCache(app.config['COMPRESSED_CACHE_SIZE'], app.config['COMPRESSED_CACHE_TTL'])
+    app.extensions["compressed_cache"] = cache
+
+    @app.after_request
+    def compress_response(response):
+        if not compressible(response):
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = request.accept_encodings.best_match(available_encodings())
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < app.config['COMPRESS_MIN_BYTES']:
+            return response
+        etag, _ = response.get_etag()
+        # bodies of other users or arguments may share the ETag
+        key = (session.get("username"), request.full_path, etag, encoding) if etag else None
+        body = cache.get(key) if key is not None else None
+        if body is None:
+            body = compress(data, encoding, app.config['COMPRESS_GZIP_LEVEL'],
+                            app.config['COMPRESS_BROTLI_QUALITY'])
+            if key is not None:
+                cache.put(key, body)
+        response.set_data(body)
+        response.headers["Content-Encoding"] = encoding
+        if etag:
+            # the same ETag names every encoding of the body, so it is weak
+            response.set_etag(etag, weak=True)
+        return response
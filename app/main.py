@@ -1,19 +1,46 @@
 '''Module contains all views and functions for database access '''
 import os, sys
+import base64
+import datetime
+import gzip
+import hashlib
+import json
+import time
 from flask import render_template, url_for, redirect, request, session, g, jsonify
 
 from werkzeug.utils import secure_filename
 from . import webapp
 from .utils import password_hash, gen_salt, valid_password, valid_login_name, valid_file_ext
 from .utils import upload_file_s3, set_file_public_read_s3
+from .cache import TTLCache
+from .segment_index import SegmentIndex
+from .post_upload import PostUploadQueue
+from .metrics import registry, Gauges
+from . import aws
+from .subtitles import generate_json_updated, subtitle_doc_key, subtitle_part_key, legacy_object_keys
+from .subtitles import decode_subtitle_doc
+from .subtitles import generate_subtitles, SUBTITLE_FORMATS
 
 import functools
-import boto3
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from boto3.dynamodb.conditions import Key
 from botocore.exceptions import ClientError
 
 #files table will hav the following attributes
 # user, filename, srclang, dstlang, timing_file, src_file, dst_file
 # timing_file, src_file, dst_file will be updated only when they become available
+# version is set together with available and holds the ETag of the transcript
+# subtitle_doc holds the version of precomputed subtitle document, files
+# processed before it existed only have the three loose text objects
+# dstlangs lists all destination languages (dstlang is the first of them),
+# available_langs is a set of languages whose subtitles are ready
+# upload_id is the id of the post upload task that created the record
+# parts_<lang> counts the leading parts of a language the translate lambda has
+# written before the whole subtitle document, they can be shown already
+# content_hash is the ETag of the uploaded mp3, the lambdas look it up in the
+# content_index table to reuse the transcript and subtitles of the same content
+# modified is the time (epoch seconds) subtitles of the file last changed
 
 def login_required(func):
     '''A decorator for URL endpoints that should be accessed
@@ -63,8 +90,11 @@ lang_code_mapping = {
         "fr": "French"
         }
 
-dynamodb = boto3.resource('dynamodb')
-s3 = boto3.resource('s3')
+# texts are read with the shared s3 client, its pool has a connection per worker
+fetch_pool = ThreadPoolExecutor(max_workers=webapp.config['S3_FETCH_WORKERS'])
+
+# finished transcripts never change, so aligned segments are computed once
+segment_cache = TTLCache(webapp.config['SEGMENT_CACHE_SIZE'], webapp.config['SEGMENT_CACHE_TTL'])
 
 
 def create_presigned_post(bucket_name, object_name,
@@ -83,7 +113,7 @@ def create_presigned_post(bucket_name, object_name,
     """
 
     # Generate a presigned S3 POST URL
-    s3_client = boto3.client('s3')
+    s3_client = aws.client('s3')
     try:
         response = s3_client.generate_presigned_post(bucket_name,
                                                      object_name,
@@ -133,7 +163,7 @@ def login_submit():
 
     if valid_login_name(lgn) and valid_password(pswd):
         # Access databse and check that user exists
-        table = dynamodb.Table("auth")
+        table = aws.resource('dynamodb').Table("auth")
         resp = table.get_item(
             Key={"login_name": lgn}
         )
@@ -193,7 +223,7 @@ def register_submit():
     #session['username'] = lgn
     if valid_login_name(lgn) and valid_password(pswd):
         # Make sure that provided username doesn't exist
-        table = dynamodb.Table("auth")
+        table = aws.resource('dynamodb').Table("auth")
         resp = table.get_item(
             Key={"login_name": lgn}
         )
@@ -210,7 +240,7 @@ def register_submit():
     salt = gen_salt()
     hashed_pass = password_hash(pswd, salt)
     
-    table = dynamodb.Table("auth")
+    table = aws.resource('dynamodb').Table("auth")
     resp = table.put_item(
         Item={
             'login_name': lgn,
@@ -240,42 +270,181 @@ def upload():
 
 @webapp.route('/test_redirect')
 def test_redirect():
-    '''This function is invoked after S3 redirect. It creates a record in the database,
-    lambda will then act on the record and will know which language
-    to translate from and to'''
+    '''This function is invoked after S3 redirect. It queues creation of a record
+    in the database, lambda will then act on the record and will know which
+    language to translate from and to'''
 
     src_lang = request.args.get('src')
-    dst_lang = request.args.get('dst')
+    # several destination languages come as comma separated list
+    dst_langs = [lang for lang in request.args.get('dst', '').split(",")
+                 if lang in lang_code_mapping and lang != src_lang]
     s3_key = request.args.get('key')
     usr = session.get('username')
+    # the lambda cannot transcribe a language it does not know
+    if src_lang not in lang_code_mapping:
+        session["error"] = "Unknown source language"
+        return redirect(url_for("dashboard"))
+    if not dst_langs:
+        session["error"] = "At least one destination language different from the source is needed"
+        return redirect(url_for("dashboard"))
 
     # separate filename and folder name
     folder_name, file_name = s3_key.split('/')
-    
-    # now populate the table 
-    table = dynamodb.Table("files")
-    resp = table.put_item(
-        Item={
-            'user': usr,
-            'filename': file_name,
-            'srclang': src_lang,
-            'dstlang': dst_lang
-        }
-    )
-    #print(resp)
-    #print(src_lang, dst_lang, file_name, file=sys.stderr)
-    session["message"] = "File successfully uploaded"
 
-    # also need to make uploaded mp3 file public
-    s3.ObjectAcl(BUCKET_MP3, s3_key).put(ACL='public-read')
+    # file with the same name is going to be reprocessed, forget old subtitles
+    segment_cache.invalidate(usr, file_name)
+
+    # the files record and the public ACL are written in the background
+    post_upload_queue.enqueue("{}/{}".format(usr, file_name), {
+        "user": usr,
+        "filename": file_name,
+        "srclang": src_lang,
+        "dstlangs": dst_langs,
+        "key": s3_key,
+    })
+    session["message"] = "File successfully uploaded"
 
     return redirect(url_for("dashboard"))
 
 
+def register_upload(task):
+    """Post upload task: creates the files record, which starts processing
+    of the file, and makes the uploaded mp3 public. Safe to run again, the
+    record carries the task id and is not rewritten once it was created"""
+    # S3 computes the ETag from the content, uploads of the same mp3 share it
+    head = aws.client('s3').head_object(Bucket=BUCKET_MP3, Key=task["key"])
+    content_hash = head["ETag"].strip('"')
+    table = aws.resource('dynamodb').Table("files")
+    try:
+        table.put_item(
+            Item={
+                'user': task["user"],
+                'filename': task["filename"],
+                'srclang': task["srclang"],
+                'dstlang': task["dstlangs"][0],
+                'dstlangs': task["dstlangs"],
+                'upload_id': task["task_id"],
+                'content_hash': content_hash,
+                # long recordings are split into parallel Transcribe jobs
+                'size': head["ContentLength"],
+            },
+            # a retry must not reset the availability set by the lambda
+            ConditionExpression="attribute_not_exists(upload_id) OR upload_id <> :id",
+            ExpressionAttributeValues={":id": task["task_id"]},
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+
+    set_file_public_read_s3(BUCKET_MP3, task["key"])
+
+
+post_upload_queue = PostUploadQueue(
+    webapp.config['POST_UPLOAD_JOURNAL'], register_upload,
+    workers=webapp.config['POST_UPLOAD_WORKERS'],
+    max_attempts=webapp.config['POST_UPLOAD_MAX_ATTEMPTS'],
+    retry_delay=webapp.config['POST_UPLOAD_RETRY_DELAY'],
+)
+
+
+registry.register(Gauges("a3_post_upload", "Post upload queue", post_upload_queue.stats))
+registry.register(Gauges("a3_segment_cache", "Segment cache", segment_cache.stats))
+
+
+@webapp.route('/metrics', methods=['GET'])
+def metrics():
+    """Request and AWS call metrics of this worker process in the
+    Prometheus text format"""
+    return webapp.response_class(registry.render(), mimetype="text/plain; version=0.0.4")
+
+
+@webapp.route('/metrics/post_upload', methods=['GET'])
+def post_upload_stats():
+    """Depth, counters and latency of the post upload queue"""
+    return jsonify(post_upload_queue.stats())
+
+
+# only the attributes shown in the dashboard table are read
+FILES_LIST_ATTRIBUTES = ["filename", "srclang", "dstlang", "dstlangs", "available", "available_langs"] + [
+    "parts_" + lang for lang in lang_code_mapping]
+
+
+def encode_cursor(last_key):
+    """Turns LastEvaluatedKey of a query into an opaque string for the client"""
+    if not last_key:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(last_key).encode()).decode()
+
+
+def decode_cursor(cursor, usr):
+    """Returns ExclusiveStartKey for the cursor, None if the cursor is not
+    valid or belongs to another user"""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        return None
+    if not isinstance(key, dict) or key.get("user") != usr or not isinstance(key.get("filename"), str):
+        return None
+    return {"user": usr, "filename": key["filename"]}
+
+
+def page_size_arg():
+    """Reads page_size request argument, limited by DASHBOARD_MAX_PAGE_SIZE"""
+    page_size = request.args.get('page_size', webapp.config['DASHBOARD_PAGE_SIZE'], type=int)
+    return max(1, min(page_size, webapp.config['DASHBOARD_MAX_PAGE_SIZE']))
+
+
+def files_projection():
+    """Returns ProjectionExpression and ExpressionAttributeNames reading only
+    the attributes shown in the dashboard table"""
+    names = {"#a{}".format(i): attr for i, attr in enumerate(FILES_LIST_ATTRIBUTES)}
+    return ", ".join(names), names
+
+
+def file_json(item):
+    """Describes a files item the way dashboard scripts render it"""
+    languages = item_languages(item)
+    return {
+        "filename": item["filename"],
+        "srclang": item["srclang"],
+        "available": "available" in item,
+        "viewable": bool(viewable_languages(item)),
+        "url": url_for('view', filename=item["filename"]),
+        "languages": [{"lang": lang, "available": available, "parts": item_parts(item, lang),
+                       "url": url_for('view', filename=item["filename"], lang=lang)}
+                      for lang, available in languages],
+    }
+
+
+def list_files_page(usr, cursor=None, page_size=None):
+    """Returns one page of user's files and the cursor of the next page
+    (None when there are no more files)"""
+    projection, names = files_projection()
+    query_args = {
+        "KeyConditionExpression": Key('user').eq(usr),
+        "ProjectionExpression": projection,
+        "ExpressionAttributeNames": names,
+        "Limit": page_size or webapp.config['DASHBOARD_PAGE_SIZE'],
+    }
+    start_key = decode_cursor(cursor, usr) if cursor else None
+    if start_key is not None:
+        query_args["ExclusiveStartKey"] = start_key
+
+    table = aws.resource('dynamodb').Table("files")
+    response = table.query(**query_args)
+    items = response.get("Items", [])
+    for item in items:
+        item["languages"] = [(lang, available, item_parts(item, lang)) for lang, available in item_languages(item)]
+        item["pending"] = not all(available for lang, available, parts in item["languages"])
+        item["viewable"] = bool(viewable_languages(item))
+    return items, encode_cursor(response.get("LastEvaluatedKey"))
+
+
 @webapp.route('/dashboard', methods=['GET'])
 @login_required
 def dashboard():
-    '''Displays a table of all file uploaded by the user'''
+    '''Displays a table with the first page of files uploaded by the user,
+    the rest is loaded by the page from the files endpoint'''
     error = session.get("error")
     session.pop("error", None)
     message = session.get("message")
@@ -283,132 +452,349 @@ def dashboard():
 
     usr = session.get('username')
 
-    # list all files that are owned by the user
-    key_condition = boto3.dynamodb.conditions.Key('user')
-    table = dynamodb.Table("files")
-    response = table.query(
-        #IndexName="user",
-        KeyConditionExpression=key_condition.eq(usr)
-    )
-    print(response, file=sys.stderr)
-    items = []
-    if "Items" in response:
-        items = response["Items"]
-    
-    return render_template('dashboard.html', username=usr, items=items, error=error, message=message)
+    # list files that are owned by the user
+    page_size = page_size_arg()
+    items, next_cursor = list_files_page(usr, request.args.get('cursor'), page_size)
 
+    return render_template('dashboard.html', username=usr, items=items, error=error, message=message,
+                           next_cursor=next_cursor, page_size=page_size)
 
-def get_text_from_s3_file(bucket, key):
-    """Downloads a text file from S3 and returns the content"""
-    tmp_path = "/tmp/temp_a3.txt"
-    s3.meta.client.download_file(bucket, key, tmp_path)
-    with open(tmp_path, "r") as f:
-        text = f.read()
-    return text
-
-def generate_json(text_src, text_dst, text_timings):
-    """Generate json from two textfiles and a timing file"""
-    sentences_src = text_src.split("[1]")
-    sentences_dst = text_dst.split("[1]")
-    timings = text_timings.split(",")
-    data = []
-    
-    for src, dst, timing in zip(sentences_src, sentences_dst, timings):
-        if len(timing) == 0 or len(src) == 0 or len(dst) == 0:
-            continue
-        print(dst, file=sys.stderr)
-        start_time, end_time = timing.split("-")
-        elem = {"start": start_time, "end": end_time, "text_src": src, "text_dst": dst}
-        data.append(elem)
-    print(len(sentences_dst), len(sentences_src), len(timings), file=sys.stderr)
-
-    return data
-
-def generate_json_updated(text_src, text_dst, text_timings):
-    # split timing file 
-    # text_src.find(anchor)
-    timings = text_timings.split(",")
-    num_sentences = len(timings)
-    last_sentence_src_pos = 0
-    last_sentence_dst_pos = 0
-    sentence_start_time = 0
-    #sentence_end_time = 0
-    new_sentence = True
-    data = []
-    for i in range(num_sentences):
-        if timings[i] == "":
-            continue
-
-        anchor = "[{}]".format(i)
-        anchor_pos_src = text_src.find(anchor)
-        anchor_pos_dst = text_dst.find(anchor)
-        start_time, end_time = timings[i].split("-")
-        #print(text_src.find("[3]"))
-        if anchor_pos_src == -1 or anchor_pos_dst == -1:
-            print("coudnt find anchor ", anchor, anchor_pos_src, anchor_pos_dst)
-            if new_sentence:
-                sentence_start_time = start_time
-                new_sentence = False
-        else:
-            sentence_src = text_src[last_sentence_src_pos: anchor_pos_src]
-            sentence_dst = text_dst[last_sentence_dst_pos: anchor_pos_dst]
-            last_sentence_src_pos = anchor_pos_src
-            last_sentence_dst_pos = anchor_pos_dst
-            if new_sentence:
-                sentence_start_time = start_time
-
-            #sentence_end_time = end_time
-            new_sentence = True
-            elem = {"start": sentence_start_time, "end": end_time, "text_src": sentence_src, "text_dst": sentence_dst}
-            data.append(elem)
-    print(data, file=sys.stderr)
-    return data
 
+@webapp.route('/files', methods=['GET'])
+@login_required
+def list_files():
+    '''Returns a page of user's files as json, cursor argument is the
+    next_cursor value returned with the previous page'''
+    usr = session.get('username')
+    items, next_cursor = list_files_page(usr, request.args.get('cursor'), page_size_arg())
+    files = [file_json(item) for item in items]
+    return jsonify({"files": files, "next_cursor": next_cursor})
+
+
+def get_files_status(usr, filenames):
+    """Reads availability of the given files of the user with one batch read.
+    Returns dictionary from filename to the same description as file_json,
+    files the table kept leaving unprocessed are missing from it"""
+    if not filenames:
+        return {}
+    projection, names = files_projection()
+    request_items = {"files": {
+        "Keys": [{"user": usr, "filename": name} for name in filenames],
+        "ProjectionExpression": projection,
+        "ExpressionAttributeNames": names,
+    }}
+    status = {}
+    for attempt in range(webapp.config['BATCH_READ_MAX_ATTEMPTS']):
+        if attempt:
+            time.sleep(webapp.config['BATCH_READ_RETRY_DELAY'] * 2 ** (attempt - 1))
+        response = aws.resource('dynamodb').batch_get_item(RequestItems=request_items)
+        for item in response["Responses"].get("files", []):
+            status[item["filename"]] = file_json(item)
+        request_items = response.get("UnprocessedKeys")
+        if not request_items:
+            break
+    else:
+        logging.warning("Status of %d files left unread", len(request_items["files"]["Keys"]))
+    return status
 
-@webapp.route('/view/<filename>', methods=['GET'])
+
+def status_response(status):
+    """Makes json response with an ETag derived from the content"""
+    body = json.dumps({"files": status}, sort_keys=True)
+    response = webapp.response_class(body, mimetype="application/json")
+    response.set_etag(hashlib.sha1(body.encode()).hexdigest())
+    # browser must revalidate, unchanged status then costs a 304 without body
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def status_filenames_arg():
+    """Reads comma separated list of filenames, BatchGetItem reads at most 100 keys"""
+    names = [name for name in request.args.get('files', '').split(",") if name]
+    return list(dict.fromkeys(names))[:100]
+
+
+@webapp.route('/status', methods=['GET'])
 @login_required
-def view(filename):
-    """Displays the  """
+def files_status():
+    '''Returns processing status of the files listed in files argument.
+    Supports conditional requests, so unchanged status is answered with 304'''
+    usr = session.get('username')
+    status = get_files_status(usr, status_filenames_arg())
+    return status_response(status).make_conditional(request)
+
+
+@webapp.route('/status/wait', methods=['GET'])
+@login_required
+def files_status_wait():
+    '''Long poll version of files_status. Holds the request until status of
+    the files differs from the one identified by If-None-Match header, or
+    until STATUS_LONG_POLL_TIMEOUT seconds pass and 304 is returned'''
     usr = session.get('username')
+    filenames = status_filenames_arg()
+    deadline = time.monotonic() + webapp.config['STATUS_LONG_POLL_TIMEOUT']
+    while True:
+        response = status_response(get_files_status(usr, filenames))
+        etag, _ = response.get_etag()
+        # compressed responses carry the weak form of the ETag
+        if not request.if_none_match.contains_weak(etag) or time.monotonic() >= deadline:
+            return response.make_conditional(request)
+        time.sleep(webapp.config['STATUS_POLL_INTERVAL'])
+
+
+def get_text_from_s3_file(bucket, key):
+    """Reads a text file from S3 straight into memory and returns the content.
+    Subtitle documents are stored gzip compressed"""
+    resp = aws.client('s3').get_object(Bucket=bucket, Key=key)
+    data = resp["Body"].read()
+    if resp.get("ContentEncoding") == "gzip":
+        data = gzip.decompress(data)
+    return data.decode("utf-8")
+
+
+def get_texts_from_s3(bucket, keys, timeout=None):
+    """Fetches several text files from S3 concurrently. Returns the contents
+    in the same order as the keys. Raises TimeoutError if any of the objects
+    takes longer than timeout seconds to arrive"""
+    if timeout is None:
+        timeout = webapp.config['S3_FETCH_TIMEOUT']
+    futures = [fetch_pool.submit(get_text_from_s3_file, bucket, key) for key in keys]
+    try:
+        return [future.result(timeout=timeout) for future in futures]
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def item_languages(item):
+    """Returns list of (language code, available) pairs for all destination
+    languages of a files item. Items created before multiple languages were
+    supported only have dstlang"""
+    dstlangs = item.get("dstlangs") or [item["dstlang"]]
+    if "available_langs" in item:
+        done = item["available_langs"]
+    elif "available" in item:
+        done = [item["dstlang"]]
+    else:
+        done = []
+    return [(lang, lang in done) for lang in dstlangs]
+
+
+def item_parts(item, lang):
+    """Returns the number of parts of a language that can be shown before
+    its subtitles are complete"""
+    return int(item.get("parts_" + lang, 0))
+
+
+def viewable_languages(item):
+    """Returns destination languages that can be shown, complete ones first
+    and then those with some parts ready"""
+    languages = item_languages(item)
+    return ([lang for lang, available in languages if available] +
+            [lang for lang, available in languages if not available and item_parts(item, lang)])
+
+
+def load_segments(usr, item, dstlang):
+    """Returns SegmentIndex of the file for one destination language, made
+    of the parts ready so far while the language is not complete. Segments
+    are served from cache when the same transcript was seen before"""
+    filename = item["filename"]
     filename_noext = filename.split(".")[0]
+    parts = 0 if dict(item_languages(item)).get(dstlang) else item_parts(item, dstlang)
+    cache_key = (usr, filename, dstlang, item.get("version", ""), parts)
+    index = segment_cache.get(cache_key)
+    if index is not None:
+        return index
+
+    if parts:
+        docs = get_texts_from_s3(BUCKET_TRANSLATE, [subtitle_part_key(usr, filename_noext, dstlang, part)
+                                                    for part in range(parts)])
+        data = [segment for doc in docs for segment in decode_subtitle_doc(doc)]
+    elif "subtitle_doc" in item:
+        # aligned segments were precomputed by the translate lambda
+        doc = get_text_from_s3_file(BUCKET_TRANSLATE, subtitle_doc_key(usr, filename_noext, dstlang))
+        data = decode_subtitle_doc(doc)
+    else:
+        # download texts for the source, destination languages and timings file
+        src_text, dst_text, timings_text = get_texts_from_s3(
+            BUCKET_TRANSLATE, legacy_object_keys(usr, filename_noext, item["srclang"], dstlang))
+        data = generate_json_updated(src_text, dst_text, timings_text)
+    index = SegmentIndex(data)
+    segment_cache.put(cache_key, index)
+    return index
+
+
+def item_modified(item):
+    """Returns the time subtitles of the item last changed, None for files
+    processed before it was recorded"""
+    if "modified" not in item:
+        return None
+    return datetime.datetime.fromtimestamp(int(item["modified"]), datetime.timezone.utc)
+
+
+def subtitles_response(item, lang, representation, make_body, mimetype):
+    """Makes a response with data derived from the subtitles of a language.
+    The ETag is made of the transcript version, the parts shown so far and
+    the representation (format and arguments), Last-Modified is the time of
+    the last change. A client that has the current data gets 304 without
+    the subtitles being read. URLs with the current version in v argument
+    are cached once the language is complete"""
+    version = item.get("version", "")
+    complete = dict(item_languages(item))[lang]
+    parts = 0 if complete else item_parts(item, lang)
+    etag = hashlib.sha1("{}/{}/{}/{}".format(version, lang, representation, parts).encode()).hexdigest()
+    modified = item_modified(item)
+    since = request.if_modified_since
+    if request.if_none_match:
+        unchanged = request.if_none_match.contains_weak(etag)
+    else:
+        unchanged = modified is not None and since is not None and modified <= (
+            since if since.tzinfo else since.replace(tzinfo=datetime.timezone.utc))
+    if unchanged:
+        response = webapp.response_class(status=304)
+    else:
+        response = webapp.response_class(make_body(), mimetype=mimetype)
+    response.set_etag(etag)
+    if modified is not None:
+        response.last_modified = modified
+    if complete and version and request.args.get('v') == version:
+        response.headers["Cache-Control"] = "private, max-age={}".format(webapp.config['SUBTITLE_MAX_AGE'])
+    else:
+        response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
 
-    # deteremine which language file need to be downloaded
-    table = dynamodb.Table("files")
+def get_file_item(usr, filename):
+    """Reads the files item of the user, returns None if it doesn't exist"""
+    table = aws.resource('dynamodb').Table("files")
     resp = table.get_item(
         Key={"user": usr, "filename": filename}
     )
-    #print(resp, file=sys.stderr)
-    if "Item" not in resp:
+    return resp.get("Item")
+
+
+def choose_language(item, requested):
+    """Returns requested destination language if it can be shown, otherwise
+    the first complete language or one with parts ready. None if nothing
+    is ready yet"""
+    ready = viewable_languages(item)
+    if requested in ready:
+        return requested
+    return ready[0] if ready else None
+
+
+@webapp.route('/view/<filename>', methods=['GET'])
+@login_required
+def view(filename):
+    """Displays the player with subtitles in source and one of the
+    destination languages, selected with lang argument. Subtitles are
+    loaded by the browser as WebVTT text tracks"""
+    usr = session.get('username')
+
+    item = get_file_item(usr, filename)
+    if item is None:
         return "something went wrong"
-    else:
-        srclang = resp["Item"]["srclang"]
-        dstlang = resp["Item"]["dstlang"]
-    
-    item = resp["Item"]
+
+    dstlang = choose_language(item, request.args.get('lang'))
+    if dstlang is None:
+        return "something went wrong"
+
+    # languages the user can switch to without reloading the page
+    languages = [(lang, lang_code_mapping[lang]) for lang in viewable_languages(item)]
+    # the player adds segments of an incomplete language as they are translated
+    complete = dict(item_languages(item))[dstlang]
+
+    srclang = item["srclang"]
     item["srclang"] = lang_code_mapping[item["srclang"]]
-    item["dstlang"] = lang_code_mapping[item["dstlang"]]
+    item["dstlang"] = lang_code_mapping[dstlang]
 
     # get the url for mp3 file
     mp3_url = "{}/{}/{}".format(BUCKET_MP3_URL, usr, filename)
 
-    # download texts for the source, destination languages and timings file
-    src_object_name = "{}/{}.{}".format(usr, filename_noext, srclang)
-    dst_object_name = "{}/{}.{}".format(usr, filename_noext, dstlang)
-    timings_object_name = "{}/{}.time".format(usr, filename_noext)
-    print(src_object_name, timings_object_name, file=sys.stderr)
+    return render_template('view.html', mp3_url=mp3_url, item=item, languages=languages,
+                           srclang=srclang, dstlang=dstlang, version=item.get("version", ""),
+                           complete=complete)
+
+
+def file_language_arg(filename):
+    """Reads the files item and chooses the language for lang argument.
+    Returns (item, dstlang) or (None, error response)"""
+    usr = session.get('username')
+    item = get_file_item(usr, filename)
+    if item is None:
+        return None, (jsonify({"error": "File not found"}), 404)
+    dstlang = choose_language(item, request.args.get('lang'))
+    if dstlang is None:
+        return None, (jsonify({"error": "File is still processing"}), 404)
+    return item, dstlang
+
+
+def segment_index_arg(filename):
+    """Loads SegmentIndex of the file for lang argument. Returns (dstlang,
+    index) or (None, error response)"""
+    item, dstlang = file_language_arg(filename)
+    if item is None:
+        return None, dstlang
+    return dstlang, load_segments(session.get('username'), item, dstlang)
+
+
+@webapp.route('/view/<filename>/segments/at', methods=['GET'])
+@login_required
+def view_segment_at(filename):
+    """Returns the segment playing at time t (seconds) for seeking, index
+    and segment are null between segments"""
+    t = request.args.get('t', type=float)
+    if t is None:
+        return jsonify({"error": "Time argument t is required"}), 400
+    dstlang, index = segment_index_arg(filename)
+    if dstlang is None:
+        return index
+    idx = index.index_at(t)
+    return jsonify({"lang": dstlang, "index": idx, "count": len(index),
+                    "segment": index.segment(idx) if idx is not None else None})
+
+
+@webapp.route('/view/<filename>/segments/range', methods=['GET'])
+@login_required
+def view_segment_range(filename):
+    """Returns the segments overlapping the time range from start to end
+    (seconds), at most limit of them, for slicing long transcripts"""
+    start = request.args.get('start', 0.0, type=float)
+    end = request.args.get('end', float("inf"), type=float)
+    limit = max(1, min(request.args.get('limit', webapp.config['SEGMENTS_MAX_RANGE'], type=int),
+                       webapp.config['SEGMENTS_MAX_RANGE']))
+    item, dstlang = file_language_arg(filename)
+    if item is None:
+        return dstlang
+
+    def body():
+        index = load_segments(session.get('username'), item, dstlang)
+        # one more than asked tells whether the range was cut short
+        segments = index.segments_in_range(start, end, limit + 1)
+        return json.dumps({"lang": dstlang, "count": len(index), "truncated": len(segments) > limit,
+                           "segments": segments[:limit]})
+    return subtitles_response(item, dstlang, "range/{}/{}/{}".format(start, end, limit), body,
+                              "application/json")
+
+
+@webapp.route('/view/<filename>/subtitles/<lang>/<side>.<fmt>', methods=['GET'])
+@login_required
+def view_subtitles(filename, lang, side, fmt):
+    """Returns source or destination side of the subtitles as WebVTT or SRT,
+    used by the player as a text track, with caching headers made by
+    subtitles_response"""
+    if side not in ("src", "dst") or fmt not in SUBTITLE_FORMATS:
+        return "Unknown subtitles", 404
+    usr = session.get('username')
+
+    item = get_file_item(usr, filename)
+    if item is None or choose_language(item, lang) != lang:
+        return "Subtitles not found", 404
+
+    return subtitles_response(item, lang, "{}/{}".format(side, fmt),
+                              lambda: generate_subtitles(load_segments(usr, item, lang), side, fmt),
+                              SUBTITLE_FORMATS[fmt])
 
-    src_text = get_text_from_s3_file(BUCKET_TRANSLATE, src_object_name)
-    dst_text = get_text_from_s3_file(BUCKET_TRANSLATE, dst_object_name)
-    timings_text = get_text_from_s3_file(BUCKET_TRANSLATE, timings_object_name)
-    
-    #print(src_text, dst_text, timings_text, file=sys.stderr)
-    
-    # create json thing needed for javascript
-    #data = generate_json(src_text, dst_text, timings_text)
-    data = generate_json_updated(src_text, dst_text, timings_text)
-    
-    
-    return render_template('view.html', data=data, mp3_url=mp3_url, item=item)
 
 @webapp.route('/logout', methods=['GET', 'POST'])
 def logout():
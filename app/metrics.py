@@ -0,0 +1,196 @@
+'''In-process metrics of the web app rendered in the Prometheus text format.
+Request timings are recorded by Flask hooks and AWS calls by botocore event
+hooks registered on every client created by app.aws. Every worker process
+keeps its own metrics'''
+
+import bisect
+import json
+import logging
+import random
+import threading
+import time
+
+from flask import g, request
+
+# seconds, cover everything from a cached page to a slow long poll
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# bytes
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+request_log = logging.getLogger("app.requests")
+
+
+def _labels_text(names, values):
+    if not names:
+        return ""
+    pairs = ['{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+             for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.help_text), "# TYPE {} counter".format(self.name)]
+        with self._lock:
+            for values, count in sorted(self._values.items()):
+                lines.append("{}{} {}".format(self.name, _labels_text(self.labels, values), count))
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * len(self.buckets), 0, 0.0]
+            idx = bisect.bisect_left(self.buckets, value)
+            if idx < len(self.buckets):
+                entry[0][idx] += 1
+            entry[1] += 1
+            entry[2] += value
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.help_text), "# TYPE {} histogram".format(self.name)]
+        names = self.labels + ("le",)
+        with self._lock:
+            for values, (counts, total, value_sum) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    lines.append("{}_bucket{} {}".format(self.name, _labels_text(names, values + (bound,)),
+                                                         cumulative))
+                lines.append("{}_bucket{} {}".format(self.name, _labels_text(names, values + ("+Inf",)), total))
+                lines.append("{}_sum{} {}".format(self.name, _labels_text(self.labels, values), value_sum))
+                lines.append("{}_count{} {}".format(self.name, _labels_text(self.labels, values), total))
+        return lines
+
+
+class Gauges:
+    '''Values read from a callback when metrics are rendered, callback
+    returns a dictionary from gauge name suffix to value'''
+
+    def __init__(self, prefix, help_text, callback):
+        self.prefix = prefix
+        self.help_text = help_text
+        self.callback = callback
+
+    def render(self):
+        lines = []
+        for suffix, value in sorted(self.callback().items()):
+            name = "{}_{}".format(self.prefix, suffix)
+            lines.append("# HELP {} {} {}".format(name, self.help_text, suffix))
+            lines.append("# TYPE {} gauge".format(name))
+            lines.append("{} {}".format(name, float(value)))
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+http_requests = registry.register(Histogram(
+    "a3_http_request_seconds", "Time to handle a request", ("endpoint", "method", "status")))
+http_response_bytes = registry.register(Histogram(
+    "a3_http_response_bytes", "Size of response bodies", ("endpoint",), SIZE_BUCKETS))
+aws_calls = registry.register(Histogram(
+    "a3_aws_call_seconds", "Latency of AWS API calls including retries", ("service", "operation", "status")))
+aws_response_bytes = registry.register(Counter(
+    "a3_aws_response_bytes_total", "Content length of AWS responses", ("service", "operation")))
+
+
+def _before_call(model, context, **kwargs):
+    context["a3_call_start"] = time.perf_counter()
+
+
+def _after_call(model, context, http_response=None, parsed=None, **kwargs):
+    start = context.get("a3_call_start")
+    if start is None:
+        return
+    service = model.service_model.service_name
+    status = str(getattr(http_response, "status_code", 0))
+    aws_calls.observe(time.perf_counter() - start, service, model.name, status)
+    length = http_response.headers.get("content-length") if http_response is not None else None
+    if length:
+        aws_response_bytes.inc(service, model.name, amount=int(length))
+
+
+def _after_call_error(model, context, exception=None, **kwargs):
+    start = context.get("a3_call_start")
+    if start is not None:
+        aws_calls.observe(time.perf_counter() - start, model.service_model.service_name, model.name,
+                          type(exception).__name__)
+
+
+def instrument_client(client):
+    '''Registers botocore event hooks recording latency and response size
+    of every call made by the client'''
+    events = client.meta.events
+    events.register("before-call.*.*", _before_call, unique_id="a3-metrics-before")
+    events.register("after-call.*.*", _after_call, unique_id="a3-metrics-after")
+    events.register("after-call-error.*.*", _after_call_error, unique_id="a3-metrics-error")
+    return client
+
+
+def init_app(app):
+    '''Times every request and logs a sample of them as json lines. Requests
+    slower than SLOW_REQUEST_SECONDS and errors are always logged'''
+    if not request_log.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        request_log.addHandler(handler)
+        request_log.setLevel(logging.INFO)
+        request_log.propagate = False
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = getattr(g, "metrics_start", None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        endpoint = request.endpoint or "unknown"
+        http_requests.observe(elapsed, endpoint, request.method, response.status_code)
+        size = response.calculate_content_length()
+        if size is not None:
+            http_response_bytes.observe(size, endpoint)
+        if (elapsed >= app.config['SLOW_REQUEST_SECONDS'] or response.status_code >= 500
+                or random.random() < app.config['REQUEST_LOG_SAMPLE_RATE']):
+            request_log.info(json.dumps({
+                "endpoint": endpoint, "method": request.method, "path": request.path,
+                "status": response.status_code, "seconds": round(elapsed, 6), "bytes": size,
+            }))
+        return response
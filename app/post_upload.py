@@ -0,0 +1,172 @@
+'''Background stage for the writes that follow an upload. Tasks are
+journaled in a local SQLite database before the request returns, worker
+threads apply them with retries and remove them once they succeeded, so
+a task survives errors of AWS calls and restarts of the server. One task
+is kept per key, enqueueing the same key again replaces the pending task'''
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class PostUploadQueue:
+    '''Durable work queue with retries and exponential backoff. handler is
+    called with the task payload and must be idempotent: a task is retried
+    when it fails and may run again if the process stops before the task
+    is removed. Several processes may share the journal, a task is leased
+    to one worker at a time'''
+
+    def __init__(self, path, handler, workers=4, max_attempts=8, retry_delay=0.5,
+                 max_retry_delay=30, lease=60, poll_interval=1.0):
+        self.handler = handler
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.enqueued = 0
+        self.completed = 0
+        self.failed_attempts = 0
+        self.dead = 0
+        self.latencies = deque(maxlen=1000)
+        self._threads = []
+        self._stopping = False
+        self._wakeup = threading.Condition()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS tasks (key TEXT PRIMARY KEY, task_id TEXT, payload TEXT,"
+                " enqueued REAL, attempts INTEGER, next_attempt REAL, lease_until REAL)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS dead_tasks (task_id TEXT PRIMARY KEY, key TEXT, payload TEXT,"
+                " enqueued REAL, attempts INTEGER, error TEXT)")
+
+    def start(self):
+        '''Starts the worker threads, pending tasks left in the journal are
+        picked up as well'''
+        with self._lock:
+            if self._threads:
+                return
+            self._stopping = False
+            for num in range(self.workers):
+                thread = threading.Thread(target=self._run, name="post-upload-{}".format(num), daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        with self._wakeup:
+            self._stopping = True
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def enqueue(self, key, payload):
+        '''Journals the task and wakes up a worker. Returns the task id,
+        which the handler gets as payload["task_id"]'''
+        task_id = uuid.uuid4().hex
+        payload = dict(payload, task_id=task_id)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tasks (key, task_id, payload, enqueued, attempts, next_attempt, lease_until)"
+                " VALUES (?, ?, ?, ?, 0, ?, 0)", (key, task_id, json.dumps(payload), now, now))
+            self.enqueued += 1
+        self.start()
+        with self._wakeup:
+            self._wakeup.notify()
+        return task_id
+
+    def _claim(self):
+        '''Leases the next due task, returns (key, task_id, payload, enqueued,
+        attempts) or None'''
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT key, task_id, payload, enqueued, attempts FROM tasks"
+                " WHERE next_attempt <= ? AND lease_until <= ? ORDER BY next_attempt LIMIT 1",
+                (now, now)).fetchone()
+            if row is None:
+                return None
+            claimed = self._conn.execute(
+                "UPDATE tasks SET lease_until = ? WHERE key = ? AND task_id = ? AND lease_until <= ?",
+                (now + self.lease, row[0], row[1], now)).rowcount
+        return row if claimed else None
+
+    def _idle_time(self):
+        '''Time until the next retry is due, at most poll_interval'''
+        with self._lock:
+            due, = self._conn.execute("SELECT MIN(MAX(next_attempt, lease_until)) FROM tasks").fetchone()
+        if due is None:
+            return self.poll_interval
+        return min(self.poll_interval, max(due - time.time(), 0.01))
+
+    def _run(self):
+        while True:
+            with self._wakeup:
+                if self._stopping:
+                    return
+            task = self._claim()
+            if task is None:
+                with self._wakeup:
+                    if not self._stopping:
+                        self._wakeup.wait(self._idle_time())
+                continue
+            self._process(*task)
+
+    def _process(self, key, task_id, payload, enqueued, attempts):
+        try:
+            self.handler(json.loads(payload))
+        except Exception as e:
+            self._failed(key, task_id, payload, enqueued, attempts + 1, e)
+            return
+        with self._lock, self._conn:
+            # a newer task for the same key stays in the queue
+            self._conn.execute("DELETE FROM tasks WHERE key = ? AND task_id = ?", (key, task_id))
+            self.completed += 1
+            self.latencies.append(time.time() - enqueued)
+
+    def _failed(self, key, task_id, payload, enqueued, attempts, error):
+        with self._lock, self._conn:
+            self.failed_attempts += 1
+            if attempts >= self.max_attempts:
+                logger.error("Post upload task %s gave up after %d attempts: %s", key, attempts, error)
+                self.dead += 1
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO dead_tasks (task_id, key, payload, enqueued, attempts, error)"
+                    " VALUES (?, ?, ?, ?, ?, ?)", (task_id, key, payload, enqueued, attempts, str(error)))
+                self._conn.execute("DELETE FROM tasks WHERE key = ? AND task_id = ?", (key, task_id))
+                return
+            delay = min(self.retry_delay * 2 ** (attempts - 1), self.max_retry_delay)
+            logger.warning("Post upload task %s failed (attempt %d), retry in %.1f s: %s",
+                           key, attempts, delay, error)
+            self._conn.execute(
+                "UPDATE tasks SET attempts = ?, next_attempt = ?, lease_until = 0 WHERE key = ? AND task_id = ?",
+                (attempts, time.time() + delay, key, task_id))
+
+    def stats(self):
+        '''Returns queue depth, counters and latency from enqueueing to
+        completion of recently completed tasks'''
+        with self._lock:
+            depth, oldest = self._conn.execute("SELECT COUNT(*), MIN(enqueued) FROM tasks").fetchone()
+            latencies = sorted(self.latencies)
+            stats = {
+                "depth": depth,
+                "oldest_age": time.time() - oldest if oldest else 0.0,
+                "enqueued": self.enqueued,
+                "completed": self.completed,
+                "failed_attempts": self.failed_attempts,
+                "dead": self.dead,
+            }
+        for name, pct in (("latency_p50", 50), ("latency_p95", 95)):
+            stats[name] = latencies[min(len(latencies) - 1, len(latencies) * pct // 100)] if latencies else 0.0
+        stats["latency_max"] = latencies[-1] if latencies else 0.0
+        return stats
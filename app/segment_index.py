@@ -0,0 +1,76 @@
+'''Compact index of aligned subtitle segments. Start and end times are kept
+in float arrays and the texts in a single string with offsets, which takes
+a fraction of the memory of a list of dictionaries and allows binary search
+by playback time'''
+
+from array import array
+from bisect import bisect_left, bisect_right
+
+
+class SegmentIndex:
+    '''Segments sorted by start time. Iterating yields the segments as
+    {"start", "end", "text_src", "text_dst"} dictionaries, the same form
+    generate_json_updated and decode_subtitle_doc return'''
+
+    def __init__(self, segments):
+        segments = sorted(segments, key=lambda elem: float(elem["start"]))
+        self.starts = array('d', (float(elem["start"]) for elem in segments))
+        self.ends = array('d', (float(elem["end"]) for elem in segments))
+        # segments may overlap, lookups by end time use the running maximum
+        self._max_ends = array('d')
+        max_end = float("-inf")
+        for end in self.ends:
+            max_end = max(max_end, end)
+            self._max_ends.append(max_end)
+        texts = [elem["text_src"] for elem in segments] + [elem["text_dst"] for elem in segments]
+        self._offsets = array('L', [0])
+        for text in texts:
+            self._offsets.append(self._offsets[-1] + len(text))
+        self._text = "".join(texts)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        return (self.segment(idx) for idx in range(len(self)))
+
+    def _text_at(self, pos):
+        return self._text[self._offsets[pos]:self._offsets[pos + 1]]
+
+    def segment(self, idx):
+        return {
+            "start": self.starts[idx],
+            "end": self.ends[idx],
+            "text_src": self._text_at(idx),
+            "text_dst": self._text_at(len(self) + idx),
+        }
+
+    def index_at(self, seconds):
+        '''Returns index of the segment playing at the given time (the one
+        that started last if several are), None between segments'''
+        idx = bisect_right(self.starts, seconds) - 1
+        while idx >= 0 and self._max_ends[idx] >= seconds:
+            if self.ends[idx] >= seconds:
+                return idx
+            idx -= 1
+        return None
+
+    def index_range(self, start, end):
+        '''Returns (first, last) bounds of the segments overlapping the time
+        range from start to end, last is exclusive. When segments overlap each
+        other, the bounds may include segments that end before start'''
+        first = bisect_left(self._max_ends, start)
+        last = bisect_right(self.starts, end)
+        return first, max(first, last)
+
+    def segments_in_range(self, start, end, limit=None):
+        '''Returns segments overlapping the time range from start to end,
+        at most limit of them'''
+        first, last = self.index_range(start, end)
+        found = []
+        for idx in range(first, last):
+            if limit is not None and len(found) >= limit:
+                break
+            if self.ends[idx] >= start:
+                found.append(self.segment(idx))
+        return found
@@ -0,0 +1,153 @@
+'''Alignment of transcripts with their translations and the precomputed
+subtitle document written by the translate lambda'''
+
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# the document layout, bump when the format of segments changes
+SUBTITLE_DOC_VERSION = 1
+
+# sentences are marked with [n] anchors after them before translating
+ANCHOR_PATTERN = re.compile(r"\[(\d+)\]")
+
+
+def subtitle_doc_key(user, filename_noext, dstlang):
+    '''Returns S3 key of the subtitle document for one destination language'''
+    return "{}/{}.{}.subs.json".format(user, filename_noext, dstlang)
+
+
+def subtitle_part_key(user, filename_noext, dstlang, part):
+    '''Returns S3 key of one part of the subtitle document, written by the
+    translate lambda before the whole document is done'''
+    return "{}/{}.{}.part-{:05d}.subs.json".format(user, filename_noext, dstlang, part)
+
+
+def legacy_object_keys(user, filename_noext, srclang, dstlang):
+    '''Returns S3 keys of source text, destination text and timings file
+    written by the translate lambda before subtitle documents existed'''
+    src_object_name = "{}/{}.{}".format(user, filename_noext, srclang)
+    dst_object_name = "{}/{}.{}".format(user, filename_noext, dstlang)
+    timings_object_name = "{}/{}.time".format(user, filename_noext)
+    return src_object_name, dst_object_name, timings_object_name
+
+
+def encode_subtitle_doc(data, srclang, dstlang):
+    '''Serializes aligned segments into a compact json document.
+    Every segment is stored as a [start, end, text_src, text_dst] list'''
+    doc = {
+        "v": SUBTITLE_DOC_VERSION,
+        "src": srclang,
+        "dst": dstlang,
+        "segments": [[float(elem["start"]), float(elem["end"]), elem["text_src"], elem["text_dst"]]
+                     for elem in data],
+    }
+    return json.dumps(doc, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def decode_subtitle_doc(raw):
+    '''Parses subtitle document and returns the list of segments in the same
+    form as generate_json_updated. Raises ValueError for unknown versions'''
+    doc = json.loads(raw)
+    if doc.get("v") != SUBTITLE_DOC_VERSION:
+        raise ValueError("Unsupported subtitle document version {}".format(doc.get("v")))
+    return [{"start": start, "end": end, "text_src": src, "text_dst": dst}
+            for start, end, src, dst in doc["segments"]]
+
+
+# subtitle files served as text tracks of the player
+SUBTITLE_FORMATS = {
+    "vtt": "text/vtt",
+    "srt": "application/x-subrip",
+}
+
+
+def format_timestamp(seconds, decimal_sep="."):
+    '''Formats seconds as HH:MM:SS.mmm (SRT uses a comma before milliseconds)'''
+    millis = int(round(float(seconds) * 1000))
+    hours, millis = divmod(millis, 3600000)
+    minutes, millis = divmod(millis, 60000)
+    secs, millis = divmod(millis, 1000)
+    return "{:02d}:{:02d}:{:02d}{}{:03d}".format(hours, minutes, secs, decimal_sep, millis)
+
+
+def cue_text(text):
+    '''Removes [n] anchors left in segment texts and collapses whitespace'''
+    return " ".join(ANCHOR_PATTERN.sub(" ", text).split())
+
+
+def generate_subtitles(data, side, fmt):
+    '''Renders one side ("src" or "dst") of aligned segments as WebVTT or
+    SRT text. Segments without text are skipped'''
+    field = "text_" + side
+    lines = ["WEBVTT", ""] if fmt == "vtt" else []
+    sep = "." if fmt == "vtt" else ","
+    number = 0
+    for elem in data:
+        text = cue_text(elem[field])
+        if not text:
+            continue
+        number += 1
+        if fmt == "vtt":
+            # cue text must not contain markup characters or the arrow
+            text = text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+        lines.append(str(number))
+        lines.append("{} --> {}".format(format_timestamp(elem["start"], sep), format_timestamp(elem["end"], sep)))
+        lines.append(text)
+        lines.append("")
+    return "\n".join(lines)
+
+
+def find_anchors(text):
+    '''Returns a dictionary from anchor number (as string) to position of
+    its first occurrence in the text, same position text.find would return.
+    The whole text is scanned only once'''
+    positions = {}
+    for match in ANCHOR_PATTERN.finditer(text):
+        positions.setdefault(match.group(1), match.start())
+    return positions
+
+
+def generate_json_updated(text_src, text_dst, text_timings):
+    '''Splits anchored source text and its translation into segments using
+    the timings file. Sentences whose anchor was dropped by Translate are
+    merged with the following sentence. All anchors are located in a single
+    pass, so alignment is linear in the length of the texts'''
+    timings = text_timings.split(",")
+    anchors_src = find_anchors(text_src)
+    anchors_dst = find_anchors(text_dst)
+    last_sentence_src_pos = 0
+    last_sentence_dst_pos = 0
+    sentence_start_time = 0
+    new_sentence = True
+    merged = 0
+    data = []
+    for i, timing in enumerate(timings):
+        if timing == "":
+            continue
+
+        anchor = str(i)
+        anchor_pos_src = anchors_src.get(anchor, -1)
+        anchor_pos_dst = anchors_dst.get(anchor, -1)
+        start_time, end_time = timing.split("-")
+        if anchor_pos_src == -1 or anchor_pos_dst == -1:
+            merged += 1
+            if new_sentence:
+                sentence_start_time = start_time
+                new_sentence = False
+        else:
+            sentence_src = text_src[last_sentence_src_pos: anchor_pos_src]
+            sentence_dst = text_dst[last_sentence_dst_pos: anchor_pos_dst]
+            last_sentence_src_pos = anchor_pos_src
+            last_sentence_dst_pos = anchor_pos_dst
+            if new_sentence:
+                sentence_start_time = start_time
+
+            new_sentence = True
+            elem = {"start": sentence_start_time, "end": end_time, "text_src": sentence_src, "text_dst": sentence_dst}
+            data.append(elem)
+    if merged:
+        logger.debug("%d sentences lost their anchor and were merged", merged)
+    return data
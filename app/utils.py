@@ -3,7 +3,8 @@
 import hashlib
 import random
 import re
-import boto3
+
+from . import aws
 
 ALLOWED_EXTENSIONS = ["jpeg", "png", "bmp", "jpg"]
 
@@ -68,10 +69,8 @@ def valid_file_ext(f):
 
 
 def upload_file_s3(filepath, bucket, key):
-    s3 = boto3.client('s3')
-    s3.upload_file(filepath, bucket, key)
+    aws.client('s3').upload_file(filepath, bucket, key)
 
 def set_file_public_read_s3(bucket, key):
-    s3 = boto3.resource('s3')
-    s3.ObjectAcl(bucket, key).put(ACL='public-read')
+    aws.client('s3').put_object_acl(Bucket=bucket, Key=key, ACL='public-read')
 
@@ -0,0 +1,115 @@
+'''Benchmark of subtitle alignment on synthetic transcripts.
+Compares generate_json_updated against the previous implementation that
+searched every anchor from the start of the text, and checks that both
+produce the same segments.
+
+Usage: python benchmarks/bench_alignment.py [--sizes 100,1000,10000,50000] [--legacy-max 10000]
+'''
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+from subtitles import generate_json_updated
+
+WORDS = ["the", "lecture", "today", "covers", "cloud", "computing", "and", "how",
+         "serverless", "functions", "scale", "with", "load", "we", "will", "see"]
+
+
+def legacy_generate_json(text_src, text_dst, text_timings):
+    '''Alignment as it was before the single pass anchor scan'''
+    timings = text_timings.split(",")
+    last_sentence_src_pos = 0
+    last_sentence_dst_pos = 0
+    sentence_start_time = 0
+    new_sentence = True
+    data = []
+    for i in range(len(timings)):
+        if timings[i] == "":
+            continue
+        anchor = "[{}]".format(i)
+        anchor_pos_src = text_src.find(anchor)
+        anchor_pos_dst = text_dst.find(anchor)
+        start_time, end_time = timings[i].split("-")
+        if anchor_pos_src == -1 or anchor_pos_dst == -1:
+            if new_sentence:
+                sentence_start_time = start_time
+                new_sentence = False
+        else:
+            sentence_src = text_src[last_sentence_src_pos: anchor_pos_src]
+            sentence_dst = text_dst[last_sentence_dst_pos: anchor_pos_dst]
+            last_sentence_src_pos = anchor_pos_src
+            last_sentence_dst_pos = anchor_pos_dst
+            if new_sentence:
+                sentence_start_time = start_time
+            new_sentence = True
+            data.append({"start": sentence_start_time, "end": end_time,
+                         "text_src": sentence_src, "text_dst": sentence_dst})
+    return data
+
+
+def synthetic_transcript(num_sentences, drop_rate=0.02, swap_rate=0.01, seed=0):
+    '''Returns anchored source text, translated text and timings file.
+    Some anchors are dropped or swapped in the translation, like Translate does'''
+    rnd = random.Random(seed)
+    src_parts = []
+    dst_parts = []
+    timing_parts = []
+    clock = 0.0
+    for i in range(num_sentences):
+        sentence = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(4, 16))) + "."
+        src_parts.append("{} [{}] ".format(sentence, i))
+        if rnd.random() < drop_rate:
+            dst_parts.append("{} ".format(sentence.upper()))
+        else:
+            dst_parts.append("{} [{}] ".format(sentence.upper(), i))
+        duration = rnd.uniform(1.0, 6.0)
+        timing_parts.append("{:.2f}-{:.2f},".format(clock, clock + duration))
+        clock += duration + rnd.uniform(0.0, 0.5)
+    for i in range(len(dst_parts) - 1):
+        if rnd.random() < swap_rate:
+            dst_parts[i], dst_parts[i + 1] = dst_parts[i + 1], dst_parts[i]
+    return "".join(src_parts), "".join(dst_parts), "".join(timing_parts)
+
+
+def best_time(func, args, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        # alignment logs missing anchors, keep it out of the measurement output
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            start = time.perf_counter()
+            result = func(*args)
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="100,1000,5000,10000,50000")
+    parser.add_argument("--legacy-max", type=int, default=10000,
+                        help="largest transcript the quadratic implementation is run on")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print("{:>10} {:>12} {:>12} {:>9}".format("sentences", "single pass", "legacy", "speedup"))
+    for size in [int(s) for s in args.sizes.split(",")]:
+        texts = synthetic_transcript(size)
+        fast, fast_result = best_time(generate_json_updated, texts, args.repeat)
+        if size <= args.legacy_max:
+            slow, slow_result = best_time(legacy_generate_json, texts, args.repeat)
+            if slow_result != fast_result:
+                raise SystemExit("Alignment mismatch for {} sentences".format(size))
+            print("{:>10} {:>11.4f}s {:>11.4f}s {:>8.1f}x".format(size, fast, slow, slow / fast))
+        else:
+            print("{:>10} {:>11.4f}s {:>12} {:>9}".format(size, fast, "skipped", "-"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+'''Benchmark of compressed subtitle payloads on synthetic transcripts.
+Measures the subtitle document as stored by the translate lambda and the
+WebVTT track and segment range json served by the web app, uncompressed, with
+gzip at several levels and with brotli when the package is installed.
+Reports compressed size, ratio and time to compress and decompress.
+
+Usage: python benchmarks/bench_compression.py [--sizes 100,1000,10000] [--repeat 5]
+'''
+
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "app"))
+
+import local_aws
+from segment_index import SegmentIndex
+from subtitles import decode_subtitle_doc, generate_subtitles
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def codecs():
+    '''Returns (name, compress, decompress) of the measured settings'''
+    result = [("gzip-{}".format(level), lambda data, level=level: gzip.compress(data, level, mtime=0),
+               gzip.decompress) for level in (1, 6, 9)]
+    if brotli is not None:
+        result += [("br-{}".format(quality), lambda data, quality=quality: brotli.compress(data, quality=quality),
+                    brotli.decompress) for quality in (5, 11)]
+    return result
+
+
+def best_time(func, data, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(data)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="100,1000,10000", help="comma separated segment counts")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measurement, the best is reported")
+    args = parser.parse_args()
+
+    print("{:>8} {:<9} {:<8} {:>10} {:>10} {:>6} {:>10} {:>10}".format(
+        "segments", "payload", "codec", "raw KB", "sent KB", "ratio", "comp ms", "decomp ms"))
+    for size in [int(value) for value in args.sizes.split(",")]:
+        doc = local_aws.subtitle_doc(size, "en", "es", seed=size)
+        index = SegmentIndex(decode_subtitle_doc(doc.decode("utf-8")))
+        payloads = [
+            ("doc", doc),
+            ("vtt", generate_subtitles(index, "dst", "vtt").encode("utf-8")),
+            ("range", json.dumps({"lang": "es", "count": len(index), "truncated": False,
+                                  "segments": list(index)}).encode("utf-8")),
+        ]
+        for payload, data in payloads:
+            for name, compress, decompress in codecs():
+                compress_time, compressed = best_time(compress, data, args.repeat)
+                decompress_time, restored = best_time(decompress, compressed, args.repeat)
+                assert restored == data
+                print("{:>8} {:<9} {:<8} {:>10.1f} {:>10.1f} {:>6.2f} {:>10.2f} {:>10.2f}".format(
+                    size, payload, name, len(data) / 1024, len(compressed) / 1024, len(compressed) / len(data),
+                    compress_time * 1000, decompress_time * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+'''Benchmark of the vectorized cost model. Times a full sweep over user
+counts, minutes of audio per user, views per file, cache hit rates and
+translation memory savings, and a Monte Carlo run of usage distributions.
+A sample of the sweep is computed with the previous scalar model (tiers
+priced in a while loop) to check the results and estimate how long the
+whole sweep would take with it.
+
+Usage: python benchmarks/bench_costs.py [--users 200] [--minutes 50] [--views 20]
+       [--cache 20] [--saved 10] [--samples 1000000] [--scalar 20000]
+'''
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import costs_calculator as costs
+
+
+def scalar_total(num_users, minutes_per_user, views_per_file, cache_hit_rate, saved_characters_ratio):
+    '''Total of one scenario computed like the scalar model did'''
+    scale = num_users * minutes_per_user / costs.BASE_MINUTES
+    viewed = scale * views_per_file
+    storage_cost = 0.023 * 200.0 / 1024 * scale
+    request_cost = 20 * scale / 1000.0 * 0.005 + 164 * viewed * (1.0 - cache_hit_rate) / 1000 * 0.0004
+    data_transfer_cost = 0
+    tier = 0
+    tier_cost = [0.0, 0.09, 0.085, 0.07, 0.05]
+    tier_limit = [1.0, 10.0 * 1024, 40.0 * 1024, 100.0 * 1024, float("inf")]
+    remaining_gb_transfered = 2 * viewed
+    while remaining_gb_transfered > 0.0001:
+        used_gb = min(tier_limit[tier], remaining_gb_transfered)
+        data_transfer_cost += used_gb * tier_cost[tier]
+        remaining_gb_transfered -= used_gb
+        tier += 1
+    dynamodb_cost = 80 * viewed / 1000000.0 * 0.25 + 8 * scale / 1000000.0 * 1.25
+    transcribe_cost = 180 * 60 * scale * 0.0004
+    translate_cost = 119340 * scale * (1.0 - saved_characters_ratio) * 0.000015
+    lambda_gateway_cost = (max(0, 7.5 * scale - 400000) * 0.00001667
+                           + max(0, 440.0 / 1000000 * viewed - 1) * 0.2 + 440.0 * viewed / 1000000)
+    return (storage_cost + request_cost + data_transfer_cost + dynamodb_cost + transcribe_cost
+            + translate_cost + lambda_gateway_cost)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200, help="user counts, log spaced from 100 to 10M")
+    parser.add_argument("--minutes", type=int, default=50, help="minutes of audio per user, 10 to 600")
+    parser.add_argument("--views", type=int, default=20, help="views per file, 0.5 to 20")
+    parser.add_argument("--cache", type=int, default=20, help="cache hit rates, 0 to 0.95")
+    parser.add_argument("--saved", type=int, default=10, help="translation memory savings, 0 to 0.9")
+    parser.add_argument("--samples", type=int, default=1000000, help="Monte Carlo samples")
+    parser.add_argument("--scalar", type=int, default=20000, help="scenarios computed with the scalar model")
+    args = parser.parse_args()
+
+    axes = [np.logspace(2, 7, args.users), np.linspace(10, 600, args.minutes),
+            np.linspace(0.5, 20, args.views), np.linspace(0, 0.95, args.cache),
+            np.linspace(0, 0.9, args.saved)]
+    scenarios = int(np.prod([len(axis) for axis in axes]))
+
+    # one slice of user counts at a time keeps memory of the tiers bounded
+    start = time.perf_counter()
+    totals = np.empty([len(axis) for axis in axes])
+    chunk = max(1, 2000000 // (scenarios // len(axes[0])))
+    for first in range(0, len(axes[0]), chunk):
+        totals[first:first + chunk] = costs.sweep(axes[0][first:first + chunk], *axes[1:])
+    sweep_time = time.perf_counter() - start
+    print("sweep: {:,} scenarios in {:.2f} s ({:.0f} ns per scenario)".format(
+        scenarios, sweep_time, sweep_time / scenarios * 1e9))
+
+    rng = np.random.default_rng(0)
+    sample = np.stack([rng.integers(0, len(axis), args.scalar) for axis in axes])
+    start = time.perf_counter()
+    scalar = [scalar_total(*(axis[idx] for axis, idx in zip(axes, column))) for column in sample.T]
+    scalar_time = time.perf_counter() - start
+    error = np.max(np.abs(np.array(scalar) - totals[tuple(sample)]) / np.maximum(1.0, np.array(scalar)))
+    print("scalar: {:,} scenarios in {:.2f} s, full sweep would take {:.0f} s ({:.0f}x), "
+          "max relative difference {:.1e}".format(
+              args.scalar, scalar_time, scalar_time / args.scalar * scenarios,
+              scalar_time / args.scalar * scenarios / sweep_time, error))
+
+    users = np.array([1000, 100000, 1000000])
+    start = time.perf_counter()
+    result = costs.monte_carlo(users, args.samples, rng=1)
+    monte_carlo_time = time.perf_counter() - start
+    print("monte carlo: {:,} samples for {} user counts in {:.2f} s".format(
+        args.samples, len(users), monte_carlo_time))
+    print("{:>10} {:>14} {:>14} {:>14}".format("users", "p5 $", "median $", "p95 $"))
+    for num_users, total in zip(users, result["total"]):
+        p5, p50, p95 = np.percentile(total, [5, 50, 95])
+        print("{:>10} {:>14,.0f} {:>14,.0f} {:>14,.0f}".format(num_users, p5, p50, p95))
+
+
+if __name__ == "__main__":
+    main()
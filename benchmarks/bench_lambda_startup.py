@@ -0,0 +1,135 @@
+'''Startup benchmark of the lambda handlers. Every handler runs in a fresh
+python process, like a new container: reports module import time, latency
+of the first (cold) invocation and of the following warm invocations
+against the local AWS stand-ins. When boto3 can be imported, time to create
+the real clients the handler uses is reported too, the stand-ins skip it.
+
+Usage: python benchmarks/bench_lambda_startup.py [--warm 20] [--sentences 300] [--latency 0.0]
+'''
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+LAMBDA_DIR = os.path.join(BENCH_DIR, "..", "lambda_funcs")
+
+# module, services whose clients the handler creates
+HANDLERS = {
+    "translate": ("translate", ["s3", "dynamodb", "translate"]),
+    "a3_transcribe": ("a3_transcribe", ["transcribe"]),
+}
+
+
+def translate_events(local_aws, module, s3, dynamodb, args):
+    '''Seeds a transcript and its files record, returns event factory'''
+    key = "{}-talk-0123456789ab.json".format(local_aws.DEMO_USER)
+    s3.put_object(Bucket=module.transcribe_output_bucket, Key=key,
+                  Body=local_aws.transcribe_output(args.sentences, job_name=key[:-5]))
+    dynamodb.Table("files").put_item(Item={"user": local_aws.DEMO_USER, "filename": "talk.mp3",
+                                           "srclang": "en", "dstlang": "es", "dstlangs": ["es", "fr"]})
+    return lambda num: {"Records": [{"s3": {"bucket": {"name": module.transcribe_output_bucket},
+                                            "object": {"key": key, "eTag": "etag"}}}]}
+
+
+def transcribe_events(local_aws, module, s3, dynamodb, args):
+    '''Returns factory of stream batches with 10 new files each'''
+    def event(num):
+        return {"Records": [{
+            "eventName": "INSERT",
+            "eventID": "{}-{}".format(num, idx),
+            "dynamodb": {
+                "SequenceNumber": "{:06d}{:02d}".format(num, idx),
+                "NewImage": {"user": {"S": local_aws.DEMO_USER},
+                             "filename": {"S": "talk-{}-{}.mp3".format(num, idx)},
+                             "srclang": {"S": "en"}},
+            },
+        } for idx in range(10)]}
+    return event
+
+
+def run_child(name, args):
+    module_name, services = HANDLERS[name]
+    sys.path.insert(0, BENCH_DIR)
+    sys.path.insert(0, LAMBDA_DIR)
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+    start = time.perf_counter()
+    module = __import__(module_name)
+    import_time = time.perf_counter() - start
+
+    import local_aws
+    stats = local_aws.CallStats()
+    s3 = local_aws.FakeS3Client(args.latency, stats)
+    dynamodb = local_aws.FakeDynamoResource(args.latency, stats)
+    module.clients.update({
+        "s3": s3,
+        "dynamodb": dynamodb.meta.client,
+        "translate": local_aws.FakeTranslateClient(args.latency, stats),
+        "transcribe": local_aws.FakeTranscribeClient(args.latency, stats),
+    })
+    make_event = (translate_events if name == "translate" else transcribe_events)(
+        local_aws, module, s3, dynamodb, args)
+
+    timings = []
+    for num in range(args.warm + 1):
+        event = make_event(num)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            module.lambda_handler(event, None)
+        timings.append(time.perf_counter() - start)
+
+    result = {"handler": name, "import": import_time, "first": timings[0],
+              "warm_median": statistics.median(timings[1:]) if args.warm else None,
+              "warm_max": max(timings[1:]) if args.warm else None,
+              "client_init": None}
+    try:
+        import boto3
+    except ImportError:
+        pass
+    else:
+        session = boto3.session.Session()
+        start = time.perf_counter()
+        for service in services:
+            session.client(service)
+        result["client_init"] = time.perf_counter() - start
+    print(json.dumps(result))
+
+
+def ms(value):
+    return "{:>10.1f}".format(value * 1000) if value is not None else "{:>10}".format("n/a")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--warm", type=int, default=20, help="warm invocations after the first one")
+    parser.add_argument("--sentences", type=int, default=300, help="sentences in the transcript")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per stand-in AWS call")
+    parser.add_argument("--child", choices=sorted(HANDLERS), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args)
+        return
+
+    print("{:>14} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+        "handler", "import ms", "first ms", "warm p50", "warm max", "clients ms"))
+    for name in sorted(HANDLERS):
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", name,
+                              "--warm", str(args.warm), "--sentences", str(args.sentences),
+                              "--latency", str(args.latency)],
+                             check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        print("{:>14} {} {} {} {} {}".format(name, ms(result["import"]), ms(result["first"]),
+                                             ms(result["warm_median"]), ms(result["warm_max"]),
+                                             ms(result["client_init"])))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+'''End-to-end benchmark of the upload pipeline against the local AWS
+stand-ins. Runs the real code of every stage for synthetic transcripts:
+
+    upload     test_redirect request of the web app
+    register   post upload queue writes the files record and the ACL
+    transcribe a3_transcribe.lambda_handler for the INSERT stream record
+    translate  translate.lambda_handler for the Transcribe output
+    view       view page and the WebVTT tracks it loads
+    dedupe     upload of a copy of the same mp3 under another name until it
+               is available, reusing the subtitles without Transcribe
+    reupload   upload of the mp3 again under its name, the MODIFY stream
+               record must make it available again, a MODIFY record
+               written by a lambda must be skipped
+
+Reports latency, allocated memory (tracemalloc) and AWS calls per stage.
+Results are saved as json with --save and compared with an earlier run with
+--compare, stages slower by more than --threshold make the exit code 1.
+
+Usage: python benchmarks/bench_pipeline.py [--sentences 100,1000,5000] [--repeat 3]
+       [--latency 0.005] [--save results.json] [--compare baseline.json]
+'''
+
+import argparse
+import copy
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCH_DIR, "..")
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(ROOT, "lambda_funcs"))
+sys.path.insert(0, ROOT)
+
+# the app must not reach AWS or replay uploads journaled by other runs
+os.environ["AWS_PREWARM"] = "0"
+os.environ["POST_UPLOAD_JOURNAL"] = ":memory:"
+
+import local_aws
+
+STAGES = ["upload", "register", "transcribe", "translate", "view", "dedupe", "reupload"]
+
+
+class StageMeter:
+    '''Measures wall time, allocations and AWS calls of one stage'''
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.results = defaultdict(list)
+
+    def measure(self, stage, func, *args, **kwargs):
+        calls_before = dict(self.stats.calls)
+        tracemalloc.reset_peak()
+        allocated_before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        current, peak = tracemalloc.get_traced_memory()
+        calls = {op: count - calls_before.get(op, 0) for op, count in self.stats.calls.items()
+                 if count != calls_before.get(op, 0)}
+        self.results[stage].append({
+            "seconds": elapsed,
+            "peak_bytes": peak - allocated_before,
+            "retained_bytes": current - allocated_before,
+            "aws_calls": calls,
+        })
+        return result
+
+
+def wait_for_queue(queue, timeout=30):
+    deadline = time.time() + timeout
+    while queue.stats()["depth"]:
+        if time.time() > deadline:
+            raise RuntimeError("post upload queue did not drain")
+        time.sleep(0.001)
+
+
+def stream_image(item):
+    '''Item in the attribute value format of stream records'''
+    image = {}
+    for name, value in item.items():
+        if isinstance(value, bool):
+            image[name] = {"BOOL": value}
+        elif isinstance(value, str):
+            image[name] = {"S": value}
+        elif isinstance(value, (int, float)):
+            image[name] = {"N": str(value)}
+        elif isinstance(value, list):
+            image[name] = {"L": [{"S": element} for element in value]}
+        elif isinstance(value, set):
+            image[name] = {"SS": sorted(value)}
+    return image
+
+
+def stream_record(item, sequence_number, old_item=None):
+    '''INSERT record of the files stream for the item, MODIFY when the item
+    replaced old_item (the stream carries new and old images)'''
+    record = {"eventName": "INSERT", "eventID": sequence_number,
+              "dynamodb": {"SequenceNumber": sequence_number, "NewImage": stream_image(item)}}
+    if old_item is not None:
+        record["eventName"] = "MODIFY"
+        record["dynamodb"]["OldImage"] = stream_image(old_item)
+    return record
+
+
+def run_pipeline(num, sentences, ctx):
+    '''Pushes one upload with a transcript of the given length through all stages'''
+    client, meter, s3, dynamodb = ctx["client"], ctx["meter"], ctx["s3"], ctx["dynamodb"]
+    filename = "upload-{:05d}.mp3".format(num)
+    key = "{}/{}".format(local_aws.DEMO_USER, filename)
+
+    resp = meter.measure("upload", client.get, "/test_redirect",
+                         query_string={"src": "en", "dst": "es,fr", "key": key})
+    assert resp.status_code == 302, resp.status_code
+    meter.measure("register", wait_for_queue, ctx["queue"])
+
+    item = dynamodb.Table("files").items[(local_aws.DEMO_USER, filename)]
+    sequence_number = "{:021d}".format(num * 4)
+    event = {"Records": [stream_record(item, sequence_number)]}
+    result = meter.measure("transcribe", ctx["a3_transcribe"].lambda_handler, event, None)
+    assert not result["batchItemFailures"], result
+
+    # Transcribe itself is not measured, its output appears right away
+    job_name = ctx["a3_transcribe"].transcription_job_name(item["user"], filename, sequence_number)
+    assert job_name in ctx["transcribe"].jobs, job_name
+    output_key = job_name + ".json"
+    etag = s3.put_object(Bucket=ctx["translate"].transcribe_output_bucket, Key=output_key,
+                         Body=local_aws.transcribe_output(sentences, seed=num, job_name=job_name))["ETag"]
+    event = {"Records": [{"s3": {"bucket": {"name": ctx["translate"].transcribe_output_bucket},
+                                 "object": {"key": output_key, "eTag": etag.strip('"')}}}]}
+    meter.measure("translate", ctx["translate"].lambda_handler, event, None)
+
+    def view():
+        page = client.get("/view/{}".format(filename), query_string={"lang": "es"})
+        assert page.status_code == 200, page.status_code
+        for side in ("src", "dst"):
+            track = client.get("/view/{}/subtitles/es/{}.vtt".format(filename, side))
+            assert track.status_code == 200, track.status_code
+    meter.measure("view", view)
+
+    copy_name = "copy-{:05d}.mp3".format(num)
+    s3.copy_object(Bucket=local_aws.BUCKET_MP3, Key="{}/{}".format(local_aws.DEMO_USER, copy_name),
+                   CopySource={"Bucket": local_aws.BUCKET_MP3, "Key": key})
+
+    def dedupe():
+        resp = client.get("/test_redirect", query_string={
+            "src": "en", "dst": "es,fr", "key": "{}/{}".format(local_aws.DEMO_USER, copy_name)})
+        assert resp.status_code == 302, resp.status_code
+        wait_for_queue(ctx["queue"])
+        copy_item = dynamodb.Table("files").items[(local_aws.DEMO_USER, copy_name)]
+        result = ctx["a3_transcribe"].lambda_handler(
+            {"Records": [stream_record(copy_item, "{:021d}".format(num * 4 + 1))]}, None)
+        assert not result["batchItemFailures"], result
+    jobs = len(ctx["transcribe"].jobs)
+    meter.measure("dedupe", dedupe)
+    copy_item = dynamodb.Table("files").items[(local_aws.DEMO_USER, copy_name)]
+    assert copy_item.get("available") and len(ctx["transcribe"].jobs) == jobs, copy_item
+
+    old_item = copy.deepcopy(dynamodb.Table("files").items[(local_aws.DEMO_USER, filename)])
+
+    def reupload():
+        resp = client.get("/test_redirect", query_string={"src": "en", "dst": "es,fr", "key": key})
+        assert resp.status_code == 302, resp.status_code
+        wait_for_queue(ctx["queue"])
+        new_item = dynamodb.Table("files").items[(local_aws.DEMO_USER, filename)]
+        assert new_item["upload_id"] != old_item["upload_id"] and "available" not in new_item, new_item
+        # the first record is an update by a lambda, only the second is an upload
+        result = ctx["a3_transcribe"].lambda_handler({"Records": [
+            stream_record(dict(old_item, modified=old_item.get("modified", 0) + 1),
+                          "{:021d}".format(num * 4 + 2), old_item),
+            stream_record(new_item, "{:021d}".format(num * 4 + 3), old_item),
+        ]}, None)
+        assert not result["batchItemFailures"], result
+    meter.measure("reupload", reupload)
+    item = dynamodb.Table("files").items[(local_aws.DEMO_USER, filename)]
+    assert item.get("available") and len(ctx["transcribe"].jobs) == jobs, item
+
+
+def summarize(results):
+    summary = {}
+    for stage in STAGES:
+        runs = results.get(stage, [])
+        if not runs:
+            continue
+        calls = defaultdict(int)
+        for run in runs:
+            for op, count in run["aws_calls"].items():
+                calls[op] += count
+        summary[stage] = {
+            "median_s": statistics.median(run["seconds"] for run in runs),
+            "max_s": max(run["seconds"] for run in runs),
+            "peak_bytes": max(run["peak_bytes"] for run in runs),
+            "aws_calls": {op: count / len(runs) for op, count in sorted(calls.items())},
+        }
+    return summary
+
+
+def print_summary(sentences, summary, baseline=None):
+    print("\n{} sentences".format(sentences))
+    print("{:>11} {:>10} {:>10} {:>10} {:>9}  {}".format(
+        "stage", "median ms", "max ms", "peak KiB", "vs base", "AWS calls per run"))
+    for stage, values in summary.items():
+        change = ""
+        if baseline and stage in baseline:
+            change = "{:+.0%}".format(values["median_s"] / baseline[stage]["median_s"] - 1)
+        calls = ", ".join("{} {:g}".format(op, count) for op, count in values["aws_calls"].items())
+        print("{:>11} {:>10.1f} {:>10.1f} {:>10.0f} {:>9}  {}".format(
+            stage, values["median_s"] * 1000, values["max_s"] * 1000, values["peak_bytes"] / 1024,
+            change, calls))
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, check=True,
+                              stdout=subprocess.PIPE, universal_newlines=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sentences", default="100,1000,5000", help="comma separated transcript lengths")
+    parser.add_argument("--repeat", type=int, default=3, help="uploads per transcript length")
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds per stand-in AWS call")
+    parser.add_argument("--save", help="write results to this json file")
+    parser.add_argument("--compare", help="json file of an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative slowdown of a stage median counted as regression")
+    args = parser.parse_args()
+    lengths = [int(value) for value in args.sentences.split(",")]
+
+    from app import webapp, main as app_main, start_background_tasks
+    import a3_transcribe
+    import translate
+
+    s3, dynamodb, stats = local_aws.install(args.latency, files=0,
+                                            uploads=len(lengths) * args.repeat)
+    transcribe_client = local_aws.FakeTranscribeClient(args.latency, stats)
+    translate_client = local_aws.FakeTranslateClient(args.latency, stats)
+    a3_transcribe.clients.update({"s3": s3, "dynamodb": dynamodb.meta.client, "transcribe": transcribe_client})
+    translate.clients.update({"s3": s3, "dynamodb": dynamodb.meta.client, "translate": translate_client})
+
+    start_background_tasks()
+    client = webapp.test_client()
+    client.post("/login_submit", data={"username": local_aws.DEMO_USER, "password": local_aws.DEMO_PASSWORD})
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    tracemalloc.start()
+    report = {
+        "benchmark": "pipeline",
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "latency": args.latency,
+        "repeat": args.repeat,
+        "results": {},
+    }
+    regressions = []
+    num = 0
+    for sentences in lengths:
+        meter = StageMeter(stats)
+        ctx = {"client": client, "meter": meter, "s3": s3, "dynamodb": dynamodb,
+               "transcribe": transcribe_client, "queue": app_main.post_upload_queue,
+               "a3_transcribe": a3_transcribe, "translate": translate}
+        for _ in range(args.repeat):
+            run_pipeline(num, sentences, ctx)
+            num += 1
+        summary = summarize(meter.results)
+        report["results"][str(sentences)] = summary
+        base = baseline["results"].get(str(sentences)) if baseline else None
+        print_summary(sentences, summary, base)
+        for stage, values in summary.items():
+            if base and stage in base and values["median_s"] > base[stage]["median_s"] * (1 + args.threshold):
+                regressions.append("{} sentences, {}".format(sentences, stage))
+    tracemalloc.stop()
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if regressions:
+        print("\nSlower than {} by more than {:.0%}: {}".format(
+            args.compare, args.threshold, "; ".join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
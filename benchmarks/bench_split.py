@@ -0,0 +1,133 @@
+'''Benchmark of splitting long recordings into parallel Transcribe jobs.
+Builds a synthetic mp3 with pauses between phrases and measures:
+
+    split      frame parsing and cutting throughput, duration of the chunks
+               and whether every cut fell into a pause
+    pipeline   a3_transcribe.lambda_handler starting the chunk jobs and
+               translate.lambda_handler for every chunk output (in random
+               order) against the local stand-ins, the merged subtitles
+               must cover the whole recording in order and the chunks must
+               be deleted after the merge
+    wall clock time until the transcript is ready for one job and for
+               parallel chunks, modelled with a Transcribe real-time factor
+
+Usage: python benchmarks/bench_split.py [--minutes 120] [--chunk 600] [--search 30]
+       [--rtf 0.5] [--overhead 30] [--latency 0.005]
+'''
+
+import argparse
+import gzip
+import io
+import json
+import os
+import random
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "lambda_funcs"))
+
+import local_aws
+import mp3_frames
+
+USER = "bench"
+
+
+def measure_split(data, chunk_seconds, search_seconds):
+    '''Splits the mp3 and checks the cuts. Returns the chunks and the time'''
+    start = time.perf_counter()
+    chunks = list(mp3_frames.split_mp3(io.BytesIO(data), chunk_seconds, search_seconds))
+    elapsed = time.perf_counter() - start
+    frames = [list(mp3_frames.iter_frames(io.BytesIO(chunk))) for _, chunk in chunks]
+    # a cut is silent when the frames on both sides of it carry no spectrum
+    silent = sum(1 for before, after in zip(frames, frames[1:]) if before[-1].gain == 0 and after[0].gain == 0)
+    lengths = [sum(frame.seconds for frame in chunk) for chunk in frames]
+    print("split: {:.1f} MB in {:.2f} s ({:.0f} MB/s), {} chunks of {:.0f} to {:.0f} s, "
+          "{} of {} cuts in pauses".format(len(data) / 1e6, elapsed, len(data) / 1e6 / elapsed, len(chunks),
+                                           min(lengths), max(lengths), silent, len(chunks) - 1))
+    return chunks, lengths, elapsed
+
+
+def run_pipeline(data, duration, chunk_seconds, search_seconds, latency):
+    '''Pushes the mp3 through both lambdas with splitting enabled'''
+    import a3_transcribe
+    import translate
+
+    stats = local_aws.CallStats()
+    s3 = local_aws.FakeS3Client(latency, stats)
+    dynamodb = local_aws.FakeDynamoResource(latency, stats)
+    transcribe_client = local_aws.FakeTranscribeClient(latency, stats, s3=s3)
+    a3_transcribe.clients.update({"s3": s3, "dynamodb": dynamodb.meta.client, "transcribe": transcribe_client})
+    translate.clients.update({"s3": s3, "dynamodb": dynamodb.meta.client,
+                              "translate": local_aws.FakeTranslateClient(latency, stats)})
+    a3_transcribe.split_min_bytes = 1
+    a3_transcribe.chunk_seconds = chunk_seconds
+    a3_transcribe.silence_search_seconds = search_seconds
+
+    filename = "long-lecture.mp3"
+    etag = s3.put_object(Bucket=a3_transcribe.mp3_bucket_name, Key="{}/{}".format(USER, filename),
+                         Body=data)["ETag"].strip('"')
+    item = {"user": USER, "filename": filename, "srclang": "en", "dstlang": "es", "dstlangs": ["es"],
+            "content_hash": etag, "size": len(data)}
+    dynamodb.Table("files").items[(USER, filename)] = dict(item)
+    image = {name: {"N": str(value)} if isinstance(value, int) else
+             {"L": [{"S": element} for element in value]} if isinstance(value, list) else {"S": value}
+             for name, value in item.items()}
+    sequence_number = "{:021d}".format(1)
+    event = {"Records": [{"eventName": "INSERT", "eventID": sequence_number,
+                          "dynamodb": {"SequenceNumber": sequence_number, "NewImage": image}}]}
+
+    start = time.perf_counter()
+    result = a3_transcribe.lambda_handler(event, None)
+    transcribe_time = time.perf_counter() - start
+    assert not result["batchItemFailures"], result
+
+    outputs = transcribe_client.complete_jobs()
+    random.Random(0).shuffle(outputs)
+    start = time.perf_counter()
+    for bucket, key, output_etag in outputs:
+        translate.lambda_handler({"Records": [{"s3": {"bucket": {"name": bucket},
+                                                      "object": {"key": key, "eTag": output_etag}}}]}, None)
+    translate_time = time.perf_counter() - start
+
+    stored = dynamodb.Table("files").items[(USER, filename)]
+    assert stored.get("available"), "subtitles were not marked available"
+    stored_doc = s3.objects[(translate.translate_bucket, "{}/long-lecture.es.subs.json".format(USER))]
+    doc = json.loads(gzip.decompress(stored_doc["Body"]) if stored_doc["ContentEncoding"] == "gzip"
+                     else stored_doc["Body"])
+    starts = [segment[0] for segment in doc["segments"]]
+    assert starts == sorted(starts), "segments of chunks are out of order"
+    left = [key for bucket, key in s3.objects if key.startswith("chunks/")]
+    assert not left, "chunks were not deleted after the merge: {}".format(left[:3])
+    print("pipeline: {} jobs started in {:.2f} s, {} chunk outputs translated in {:.2f} s, "
+          "{} segments up to {:.0f} s of {:.0f} s".format(
+              len(transcribe_client.jobs), transcribe_time, len(outputs), translate_time,
+              len(doc["segments"]), doc["segments"][-1][1], duration))
+    print("AWS calls: {}".format(", ".join("{} {}".format(op, value["calls"])
+                                           for op, value in sorted(stats.snapshot().items()))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--minutes", type=float, default=120, help="length of the recording")
+    parser.add_argument("--chunk", type=float, default=600, help="seconds per chunk")
+    parser.add_argument("--search", type=float, default=30, help="seconds searched for a pause around a cut")
+    parser.add_argument("--rtf", type=float, default=0.5, help="Transcribe processing time per second of audio")
+    parser.add_argument("--overhead", type=float, default=30, help="seconds of queueing and setup per job")
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds per stand-in AWS call")
+    args = parser.parse_args()
+
+    duration = args.minutes * 60
+    data = local_aws.synthetic_mp3(duration)
+    chunks, lengths, split_time = measure_split(data, args.chunk, args.search)
+    run_pipeline(data, duration, args.chunk, args.search, args.latency)
+
+    single = args.overhead + args.rtf * duration
+    parallel = split_time + args.overhead + args.rtf * max(lengths)
+    print("wall clock: one job {:.0f} s, {} parallel jobs {:.0f} s ({:.1f}x)".format(
+        single, len(chunks), parallel, single / parallel))
+
+
+if __name__ == "__main__":
+    main()
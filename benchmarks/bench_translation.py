@@ -0,0 +1,54 @@
+'''Benchmark of batched translation with the local fake translator.
+Reports number of requests and wall time for different worker counts and
+checks that every anchor survives splitting and reassembly.
+
+Usage: python benchmarks/bench_translation.py [--sentences 5000] [--latency 0.05] [--workers 1,2,4,8]
+'''
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda_funcs"))
+from translation_engine import FakeTranslator, translate_sentences
+
+WORDS = ["the", "lecture", "today", "covers", "cloud", "computing", "and", "how",
+         "serverless", "functions", "scale", "with", "load", "we", "will", "see"]
+
+
+def synthetic_sentences(num_sentences, seed=0):
+    rnd = random.Random(seed)
+    return [" " + " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(4, 16))) + "."
+            for _ in range(num_sentences)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sentences", type=int, default=5000)
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="simulated seconds per TranslateText request")
+    parser.add_argument("--max-bytes", type=int, default=5000)
+    parser.add_argument("--workers", default="1,2,4,8")
+    args = parser.parse_args()
+
+    sentences = synthetic_sentences(args.sentences)
+    print("{:>8} {:>9} {:>10} {:>9}".format("workers", "requests", "wall time", "speedup"))
+    baseline = None
+    for workers in [int(w) for w in args.workers.split(",")]:
+        translator = FakeTranslator(latency=args.latency)
+        start = time.perf_counter()
+        marked_text, dst_text = translate_sentences(sentences, translator, "en", "fr",
+                                                    max_bytes=args.max_bytes, max_workers=workers)
+        elapsed = time.perf_counter() - start
+        anchors = [int(a) for a in re.findall(r"\[(\d+)\]", dst_text)]
+        if anchors != list(range(len(sentences))):
+            raise SystemExit("Anchors were lost or reordered with {} workers".format(workers))
+        baseline = baseline or elapsed
+        print("{:>8} {:>9} {:>9.3f}s {:>8.1f}x".format(workers, translator.requests, elapsed, baseline / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,609 @@
+'''In-memory stand-ins for the parts of S3 and DynamoDB used by the web app
+and the lambdas. Every call sleeps for a configurable latency, so they can
+be used to measure how the code behaves when AWS calls block, and every call
+is counted per operation. Stand-ins are thread safe'''
+
+import copy
+import datetime
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from botocore.exceptions import ClientError
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda_funcs")
+
+# attribute names DynamoDB rejects in expressions unless given as #aliases
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "dynamodb_reserved_words.txt")) as f:
+    DYNAMODB_RESERVED_WORDS = frozenset(f.read().split())
+# words of the expression syntax itself
+EXPRESSION_KEYWORDS = frozenset(["SET", "ADD", "REMOVE", "DELETE", "AND", "OR", "NOT", "IN", "BETWEEN"])
+
+
+def client_error(code, operation, message=""):
+    return ClientError({"Error": {"Code": code, "Message": message or code}}, operation)
+
+
+class CallStats:
+    '''Counts calls and accumulates latency per service operation'''
+
+    def __init__(self):
+        self.calls = Counter()
+        self.seconds = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, operation, seconds):
+        with self._lock:
+            self.calls[operation] += 1
+            self.seconds[operation] += seconds
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.seconds.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {op: {"calls": self.calls[op], "seconds": self.seconds[op]} for op in self.calls}
+
+
+class StandIn:
+    '''Base of all stand-ins, simulates the network round trip of a call'''
+
+    service = ""
+
+    def __init__(self, latency=0.0, stats=None):
+        self.latency = latency
+        self.stats = stats if stats is not None else CallStats()
+        self._lock = threading.RLock()
+
+    def _call(self, operation):
+        start = time.perf_counter()
+        if self.latency:
+            time.sleep(self.latency)
+        self.stats.record("{}.{}".format(self.service, operation), time.perf_counter() - start)
+
+
+class FakeBody:
+    '''Streaming body of get_object'''
+
+    def __init__(self, data):
+        self._stream = io.BytesIO(data)
+
+    def read(self, amt=None):
+        return self._stream.read(amt)
+
+    def close(self):
+        pass
+
+
+class FakeS3Client(StandIn):
+    service = "s3"
+
+    def __init__(self, latency=0.0, stats=None):
+        super().__init__(latency, stats)
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body=b"", **kwargs):
+        self._call("PutObject")
+        if isinstance(Body, str):
+            Body = Body.encode("utf-8")
+        elif hasattr(Body, "read"):
+            Body = Body.read()
+        etag = '"{}"'.format(hashlib.md5(Body).hexdigest())
+        with self._lock:
+            self.objects[(Bucket, Key)] = {
+                "Body": bytes(Body),
+                "ETag": etag,
+                "ContentType": kwargs.get("ContentType", "binary/octet-stream"),
+                "ContentEncoding": kwargs.get("ContentEncoding"),
+                "Metadata": kwargs.get("Metadata", {}),
+                "LastModified": datetime.datetime.now(datetime.timezone.utc),
+            }
+        return {"ETag": etag}
+
+    def _get(self, bucket, key, operation):
+        with self._lock:
+            obj = self.objects.get((bucket, key))
+        if obj is None:
+            raise client_error("NoSuchKey", operation)
+        return obj
+
+    def _head(self, obj):
+        head = {k: v for k, v in obj.items() if k != "Body" and v is not None}
+        head["ContentLength"] = len(obj["Body"])
+        return head
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self._call("GetObject")
+        obj = self._get(Bucket, Key, "GetObject")
+        resp = self._head(obj)
+        resp["Body"] = FakeBody(obj["Body"])
+        return resp
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._call("HeadObject")
+        return self._head(self._get(Bucket, Key, "HeadObject"))
+
+    def copy_object(self, Bucket, Key, CopySource, **kwargs):
+        self._call("CopyObject")
+        obj = self._get(CopySource["Bucket"], CopySource["Key"], "CopyObject")
+        with self._lock:
+            self.objects[(Bucket, Key)] = dict(obj, LastModified=datetime.datetime.now(datetime.timezone.utc))
+        return {"CopyObjectResult": {"ETag": obj["ETag"]}}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._call("DeleteObject")
+        with self._lock:
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        self._call("DeleteObjects")
+        with self._lock:
+            for obj in Delete["Objects"]:
+                self.objects.pop((Bucket, obj["Key"]), None)
+        return {}
+
+    def put_object_acl(self, Bucket, Key, ACL, **kwargs):
+        self._call("PutObjectAcl")
+        self._get(Bucket, Key, "PutObjectAcl")
+        return {}
+
+    def upload_file(self, Filename, Bucket, Key, **kwargs):
+        with open(Filename, "rb") as f:
+            self.put_object(Bucket=Bucket, Key=Key, Body=f.read())
+
+    def download_file(self, Bucket, Key, Filename, **kwargs):
+        data = self.get_object(Bucket=Bucket, Key=Key)["Body"].read()
+        with open(Filename, "wb") as f:
+            f.write(data)
+
+    def generate_presigned_post(self, Bucket, Key, Fields=None, Conditions=None, ExpiresIn=3600):
+        fields = dict(Fields or {})
+        fields.update({"key": Key, "AWSAccessKeyId": "LOCAL", "policy": "local", "signature": "local"})
+        return {"url": "http://localhost/{}".format(Bucket), "fields": fields}
+
+
+class FakeS3Resource:
+    '''Only meta.client of the resource is used by the code'''
+
+    def __init__(self, client):
+        self.meta = type("Meta", (), {"client": client})()
+
+
+class FakeTable(StandIn):
+    '''DynamoDB table keyed by partition key and optional sort key.
+    Understands the expressions used in this project'''
+
+    service = "dynamodb"
+
+    def __init__(self, name, partition_key, sort_key=None, latency=0.0, stats=None):
+        super().__init__(latency, stats)
+        self.name = name
+        self.partition_key = partition_key
+        self.sort_key = sort_key
+        self.items = {}
+
+    def _key(self, key):
+        if self.sort_key is None:
+            return (key[self.partition_key],)
+        return (key[self.partition_key], key[self.sort_key])
+
+    @staticmethod
+    def _names(expression, names):
+        for alias, name in (names or {}).items():
+            expression = re.sub(re.escape(alias) + r"\b", name, expression)
+        return expression
+
+    @staticmethod
+    def _check_reserved(expression, operation):
+        '''Raises ValidationException like DynamoDB when the expression uses
+        a reserved word as an attribute name without an alias'''
+        if not expression:
+            return
+        for word in re.findall(r"(?<![#:\w])([A-Za-z_]\w*)(?!\s*\()", expression):
+            if word.upper() in DYNAMODB_RESERVED_WORDS and word.upper() not in EXPRESSION_KEYWORDS:
+                raise client_error("ValidationException", operation,
+                                   "Attribute name is a reserved keyword; reserved keyword: " + word)
+
+    def _project(self, item, projection, names):
+        if not projection:
+            return copy.deepcopy(item)
+        attrs = [a.strip() for a in self._names(projection, names).split(",")]
+        return {a: copy.deepcopy(item[a]) for a in attrs if a in item}
+
+    def _check_condition(self, item, condition, names, values, operation):
+        '''Evaluates conditions made of attribute_exists, attribute_not_exists,
+        = and <> comparisons joined with OR'''
+        if not condition:
+            return
+        self._check_reserved(condition, operation)
+        item = item or {}
+        for clause in self._names(condition, names).split(" OR "):
+            clause = clause.strip()
+            match = re.match(r"(attribute_not_exists|attribute_exists)\(\s*([\w.]+)\s*\)$", clause)
+            if match:
+                if (match.group(2) in item) == (match.group(1) == "attribute_exists"):
+                    return
+                continue
+            attr, op, value = re.match(r"([\w.]+)\s*(=|<>)\s*(:\w+)$", clause).groups()
+            if (item.get(attr) == values[value]) == (op == "="):
+                return
+        raise client_error("ConditionalCheckFailedException", operation)
+
+    def get_item(self, Key, ProjectionExpression=None, ExpressionAttributeNames=None, **kwargs):
+        self._call("GetItem")
+        self._check_reserved(ProjectionExpression, "GetItem")
+        with self._lock:
+            item = self.items.get(self._key(Key))
+            if item is None:
+                return {}
+            return {"Item": self._project(item, ProjectionExpression, ExpressionAttributeNames)}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+                 ExpressionAttributeValues=None, **kwargs):
+        self._call("PutItem")
+        with self._lock:
+            key = self._key(Item)
+            self._check_condition(self.items.get(key), ConditionExpression, ExpressionAttributeNames,
+                                  ExpressionAttributeValues, "PutItem")
+            self.items[key] = copy.deepcopy(Item)
+        return {}
+
+    def delete_item(self, Key, **kwargs):
+        self._call("DeleteItem")
+        with self._lock:
+            self.items.pop(self._key(Key), None)
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues=None,
+                    ExpressionAttributeNames=None, ConditionExpression=None, ReturnValues=None, **kwargs):
+        self._call("UpdateItem")
+        self._check_reserved(UpdateExpression, "UpdateItem")
+        values = ExpressionAttributeValues or {}
+        expression = self._names(UpdateExpression, ExpressionAttributeNames)
+        with self._lock:
+            key = self._key(Key)
+            self._check_condition(self.items.get(key), ConditionExpression, ExpressionAttributeNames,
+                                  values, "UpdateItem")
+            item = self.items.setdefault(key, copy.deepcopy(dict(Key)))
+            updated = {}
+            clauses = re.split(r"\b(SET|ADD|REMOVE)\b", expression)
+            for action, body in zip(clauses[1::2], clauses[2::2]):
+                for part in [p.strip() for p in body.split(",") if p.strip()]:
+                    if action == "SET":
+                        attr, value = [x.strip() for x in part.split("=", 1)]
+                        item[attr] = copy.deepcopy(values[value])
+                    elif action == "ADD":
+                        attr, value = part.split()
+                        value = values[value]
+                        if isinstance(value, set):
+                            item[attr] = set(item.get(attr, set())) | value
+                        else:
+                            item[attr] = item.get(attr, 0) + value
+                    else:
+                        item.pop(part, None)
+                        continue
+                    updated[attr] = copy.deepcopy(item[attr])
+            if ReturnValues == "UPDATED_NEW":
+                return {"Attributes": updated}
+            if ReturnValues == "ALL_NEW":
+                return {"Attributes": copy.deepcopy(item)}
+        return {}
+
+    def query(self, KeyConditionExpression, Limit=None, ExclusiveStartKey=None, ProjectionExpression=None,
+              ExpressionAttributeNames=None, ScanIndexForward=True, **kwargs):
+        self._call("Query")
+        self._check_reserved(ProjectionExpression, "Query")
+        # only partition_key = value conditions built with boto3 Key are supported
+        _, partition_value = KeyConditionExpression.get_expression()["values"]
+        with self._lock:
+            rows = [item for key, item in self.items.items() if key[0] == partition_value]
+        rows.sort(key=lambda item: item.get(self.sort_key, ""), reverse=not ScanIndexForward)
+        if ExclusiveStartKey is not None:
+            rows = [r for r in rows if r[self.sort_key] > ExclusiveStartKey[self.sort_key]]
+        response = {}
+        if Limit is not None and len(rows) > Limit:
+            rows = rows[:Limit]
+            response["LastEvaluatedKey"] = {k: rows[-1][k] for k in (self.partition_key, self.sort_key)}
+        response["Items"] = [self._project(r, ProjectionExpression, ExpressionAttributeNames) for r in rows]
+        response["Count"] = len(rows)
+        return response
+
+    def scan(self, ExclusiveStartKey=None, **kwargs):
+        self._call("Scan")
+        with self._lock:
+            return {"Items": [copy.deepcopy(item) for item in self.items.values()]}
+
+
+class FakeDynamoClient:
+    '''Client of FakeDynamoResource, accepts python types like the meta.client
+    of a real dynamodb resource'''
+
+    def __init__(self, resource):
+        self.resource = resource
+
+    def update_item(self, TableName, **kwargs):
+        return self.resource.Table(TableName).update_item(**kwargs)
+
+    def put_item(self, TableName, **kwargs):
+        return self.resource.Table(TableName).put_item(**kwargs)
+
+    def get_item(self, TableName, **kwargs):
+        return self.resource.Table(TableName).get_item(**kwargs)
+
+    def batch_get_item(self, RequestItems):
+        return self.resource.batch_get_item(RequestItems)
+
+    def batch_write_item(self, RequestItems):
+        for name, requests in RequestItems.items():
+            table = self.resource.Table(name)
+            table._call("BatchWriteItem")
+            with table._lock:
+                for request in requests:
+                    item = request["PutRequest"]["Item"]
+                    table.items[table._key(item)] = copy.deepcopy(item)
+        return {"UnprocessedItems": {}}
+
+
+class FakeDynamoResource:
+    '''Holds the tables, unknown tables are created on first use with
+    "key" as the partition key'''
+
+    # key schema of the tables of this project
+    KEY_SCHEMA = {
+        "auth": ("login_name", None),
+        "files": ("user", "filename"),
+        "content_index": ("content_hash", None),
+    }
+
+    def __init__(self, latency=0.0, stats=None):
+        self.latency = latency
+        self.stats = stats if stats is not None else CallStats()
+        self.tables = {}
+        self._lock = threading.Lock()
+        self.meta = type("Meta", (), {"client": FakeDynamoClient(self)})()
+
+    def Table(self, name):
+        with self._lock:
+            table = self.tables.get(name)
+            if table is None:
+                partition_key, sort_key = self.KEY_SCHEMA.get(name, ("key", None))
+                table = FakeTable(name, partition_key, sort_key, self.latency, self.stats)
+                self.tables[name] = table
+            return table
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        responses = {}
+        for name, request in RequestItems.items():
+            table = self.Table(name)
+            table._call("BatchGetItem")
+            table._check_reserved(request.get("ProjectionExpression"), "BatchGetItem")
+            found = []
+            for key in request["Keys"]:
+                with table._lock:
+                    item = table.items.get(table._key(key))
+                if item is not None:
+                    found.append(table._project(item, request.get("ProjectionExpression"),
+                                                request.get("ExpressionAttributeNames")))
+            responses[name] = found
+        return {"Responses": responses, "UnprocessedKeys": {}}
+
+
+class FakeTranslateClient(StandIn):
+    '''Amazon Translate stand-in, upper-cases the text so anchors survive'''
+
+    service = "translate"
+    max_bytes = 10000
+
+    def __init__(self, latency=0.0, stats=None):
+        super().__init__(latency, stats)
+        self.characters = 0
+
+    def translate_text(self, Text, SourceLanguageCode, TargetLanguageCode, **kwargs):
+        self._call("TranslateText")
+        if len(Text.encode("utf-8")) > self.max_bytes:
+            raise client_error("TextSizeLimitExceededException", "TranslateText")
+        with self._lock:
+            self.characters += len(Text)
+        return {"TranslatedText": Text.upper().strip(), "SourceLanguageCode": SourceLanguageCode,
+                "TargetLanguageCode": TargetLanguageCode}
+
+
+class FakeTranscribeClient(StandIn):
+    '''Amazon Transcribe stand-in, records the started jobs. With a stand-in
+    S3 client complete_jobs() writes synthetic output of jobs in progress
+    that spans the duration of their mp3'''
+
+    service = "transcribe"
+
+    def __init__(self, latency=0.0, stats=None, s3=None):
+        super().__init__(latency, stats)
+        self.s3 = s3
+        self.jobs = {}
+
+    def start_transcription_job(self, TranscriptionJobName, LanguageCode, Media, OutputBucketName=None,
+                                OutputKey=None, **kwargs):
+        self._call("StartTranscriptionJob")
+        with self._lock:
+            if TranscriptionJobName in self.jobs:
+                raise client_error("ConflictException", "StartTranscriptionJob")
+            job = {"TranscriptionJobName": TranscriptionJobName, "LanguageCode": LanguageCode,
+                   "Media": Media, "OutputBucketName": OutputBucketName, "OutputKey": OutputKey,
+                   "TranscriptionJobStatus": "IN_PROGRESS"}
+            self.jobs[TranscriptionJobName] = job
+        return {"TranscriptionJob": dict(job)}
+
+    def complete_jobs(self):
+        '''Finishes every job in progress. Returns (bucket, key, ETag) of the
+        written outputs in the order the jobs were started'''
+        with self._lock:
+            pending = [job for job in self.jobs.values() if job["TranscriptionJobStatus"] == "IN_PROGRESS"]
+        outputs = []
+        for job in pending:
+            bucket, key = job["Media"]["MediaFileUri"][len("s3://"):].split("/", 1)
+            job["MediaSeconds"] = media_seconds(self.s3.objects[(bucket, key)]["Body"])
+            name = job["TranscriptionJobName"]
+            output_key = job["OutputKey"] or name + ".json"
+            body = transcribe_output(seed=name, job_name=name, duration=job["MediaSeconds"])
+            etag = self.s3.put_object(Bucket=job["OutputBucketName"], Key=output_key, Body=body)["ETag"]
+            job["TranscriptionJobStatus"] = "COMPLETED"
+            outputs.append((job["OutputBucketName"], output_key, etag.strip('"')))
+        return outputs
+
+    def get_transcription_job(self, TranscriptionJobName):
+        self._call("GetTranscriptionJob")
+        with self._lock:
+            job = self.jobs.get(TranscriptionJobName)
+        if job is None:
+            raise client_error("BadRequestException", "GetTranscriptionJob")
+        return {"TranscriptionJob": dict(job)}
+
+
+def media_seconds(data):
+    '''Returns the duration of mp3 bytes'''
+    if LAMBDA_DIR not in sys.path:
+        sys.path.insert(0, LAMBDA_DIR)
+    import mp3_frames
+    return sum(frame.seconds for frame in mp3_frames.iter_frames(io.BytesIO(data)))
+
+
+def transcribe_output(num_sentences=None, seed=0, job_name="job", duration=None):
+    '''Builds Transcribe output json with num_sentences synthetic sentences,
+    or with as many sentences as fit into duration seconds'''
+    rnd = random.Random(seed)
+    items = []
+    words = []
+    time_pos = 0.0
+    sentence = 0
+    # a sentence is at most 14 words of 0.65 s
+    while sentence < num_sentences if duration is None else time_pos < duration - 10.0:
+        sentence += 1
+        for _ in range(rnd.randint(4, 14)):
+            word = rnd.choice(WORDS)
+            end = time_pos + rnd.uniform(0.2, 0.6)
+            items.append({"start_time": "{:.2f}".format(time_pos), "end_time": "{:.2f}".format(end),
+                          "alternatives": [{"confidence": "0.99", "content": word}], "type": "pronunciation"})
+            words.append(word)
+            time_pos = end + 0.05
+        items.append({"alternatives": [{"confidence": "0.0", "content": "."}], "type": "punctuation"})
+        words.append(".")
+    transcript = " ".join(words).replace(" .", ".")
+    return json.dumps({"jobName": job_name, "results": {"transcripts": [{"transcript": transcript}],
+                                                        "items": items}, "status": "COMPLETED"})
+
+
+# demo account and data created by seed()
+DEMO_USER = "demouser"
+DEMO_PASSWORD = "demopass"
+BUCKET_MP3 = "krasniko-a3-mp3"
+BUCKET_TRANSLATE = "krasniko-a3-translate"
+WORDS = ["the", "lecture", "today", "covers", "cloud", "computing", "and", "how",
+         "serverless", "functions", "scale", "with", "load", "we", "will", "see"]
+
+
+def mp3_frame(gain):
+    '''MPEG-1 Layer III frame, 48 kHz, 128 kbps, stereo, of 384 bytes. Only
+    the side information is filled in: every granule gets the global gain,
+    0 leaves the granules without coded spectrum (silence)'''
+    bits = 0
+    if gain:
+        # main_data_begin, private bits and scfsi take the first 20 bits
+        for block in range(4):
+            start = 20 + block * 59
+            bits |= 1000 << (256 - start - 12)
+            bits |= 100 << (256 - start - 21)
+            bits |= gain << (256 - start - 29)
+    return b"\xff\xfb\x94\x00" + bits.to_bytes(32, "big") + bytes(384 - 36)
+
+
+def synthetic_mp3(seconds, seed=0, pause_every=40.0, pause_seconds=1.0):
+    '''Builds an mp3 of the given length behind an ID3v2 tag. Speech frames
+    have a random global gain, pauses of pause_seconds come on average every
+    pause_every seconds'''
+    rnd = random.Random(seed)
+    frame_seconds = 1152 / 48000
+    frames = {gain: mp3_frame(gain) for gain in [0] + list(range(140, 201, 10))}
+    out = [b"ID3\x04\x00\x00\x00\x00\x00\x10" + bytes(16)]
+    next_pause = rnd.uniform(0.5, 1.5) * pause_every
+    pause_end = -1.0
+    for idx in range(int(seconds / frame_seconds)):
+        time_pos = idx * frame_seconds
+        if time_pos >= next_pause:
+            pause_end = time_pos + pause_seconds
+            next_pause = pause_end + rnd.uniform(0.5, 1.5) * pause_every
+        out.append(frames[0] if time_pos < pause_end else frames[rnd.randrange(140, 201, 10)])
+    return b"".join(out)
+
+
+def subtitle_doc(num_segments, srclang, dstlang, seed=0):
+    '''Builds a subtitle document in the format written by the translate lambda'''
+    rnd = random.Random(seed)
+    segments = []
+    start = 0.0
+    for _ in range(num_segments):
+        text = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(4, 12))) + "."
+        end = round(start + rnd.uniform(1.0, 5.0), 2)
+        segments.append([start, end, text, text.upper()])
+        start = end
+    doc = {"v": 1, "src": srclang, "dst": dstlang, "segments": segments}
+    return json.dumps(doc, separators=(",", ":")).encode("utf-8")
+
+
+def seed(s3, dynamodb, files=50, segments=200, uploads=0):
+    '''Creates the demo user, files with subtitles in two destination
+    languages, and mp3 objects upload-<n>.mp3 to be registered by test_redirect'''
+    salt = "0123456789abcdef"
+    dynamodb.Table("auth").items[(DEMO_USER,)] = {
+        "login_name": DEMO_USER,
+        "salt": salt,
+        "hash_pass": hashlib.sha256((DEMO_PASSWORD + salt).encode()).hexdigest(),
+    }
+    files_table = dynamodb.Table("files")
+    for num in range(files):
+        filename = "lecture-{:04d}.mp3".format(num)
+        noext = filename.split(".")[0]
+        s3.objects[(BUCKET_MP3, "{}/{}".format(DEMO_USER, filename))] = {
+            "Body": b"ID3", "ETag": '"mp3"', "ContentType": "audio/mpeg", "Metadata": {},
+            "LastModified": datetime.datetime.now(datetime.timezone.utc)}
+        for dstlang in ("es", "fr"):
+            body = subtitle_doc(segments, "en", dstlang, seed=num)
+            s3.objects[(BUCKET_TRANSLATE, "{}/{}.{}.subs.json".format(DEMO_USER, noext, dstlang))] = {
+                "Body": body, "ETag": '"{}"'.format(hashlib.md5(body).hexdigest()),
+                "ContentType": "application/json", "Metadata": {},
+                "LastModified": datetime.datetime.now(datetime.timezone.utc)}
+        files_table.items[(DEMO_USER, filename)] = {
+            "user": DEMO_USER, "filename": filename, "srclang": "en",
+            "dstlang": "es", "dstlangs": ["es", "fr"],
+            "available": 1, "available_langs": {"es", "fr"},
+            "version": '"v{}"'.format(num), "subtitle_doc": 1,
+        }
+    for num in range(uploads):
+        # every upload has different content, so none of them is deduplicated
+        body = "ID3 upload {}".format(num).encode()
+        s3.objects[(BUCKET_MP3, "{}/upload-{:05d}.mp3".format(DEMO_USER, num))] = {
+            "Body": body, "ETag": '"{}"'.format(hashlib.md5(body).hexdigest()),
+            "ContentType": "audio/mpeg", "Metadata": {},
+            "LastModified": datetime.datetime.now(datetime.timezone.utc)}
+
+
+def install(latency=0.0, files=50, segments=200, uploads=0):
+    '''Points the web app at seeded stand-ins through app.aws.override.
+    Returns the stand-ins and their shared call stats'''
+    from app import aws
+
+    stats = CallStats()
+    s3 = FakeS3Client(latency, stats)
+    dynamodb = FakeDynamoResource(latency, stats)
+    seed(s3, dynamodb, files, segments, uploads)
+    aws.override("s3", client=s3, resource=FakeS3Resource(s3))
+    aws.override("dynamodb", client=dynamodb.meta.client, resource=dynamodb)
+    return s3, dynamodb, stats
@@ -0,0 +1,132 @@
+'''Load test of the web app served by gunicorn against the local AWS
+stand-ins. Starts the server, logs every client in as the demo user and
+requests the dashboard, view pages and upload registrations concurrently.
+Reports throughput and latency percentiles per endpoint.
+
+Usage: python benchmarks/serve_load.py [--clients 32] [--requests 2000]
+       [--workers 2] [--threads 32] [--worker-class gthread] [--latency 0.02]
+'''
+
+import argparse
+import http.cookiejar
+import itertools
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from local_aws import DEMO_USER, DEMO_PASSWORD
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SEEDED_FILES = 50
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args, port):
+    env = dict(os.environ, A3_LOCAL_AWS="1", A3_LOCAL_AWS_LATENCY=str(args.latency),
+               A3_LOCAL_AWS_UPLOADS=str(args.requests), WEB_BIND="127.0.0.1:{}".format(port),
+               WEB_WORKERS=str(args.workers), WEB_THREADS=str(args.threads),
+               WEB_WORKER_CLASS=args.worker_class)
+    proc = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "wsgi:application"],
+                            cwd=ROOT, env=env)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen("http://127.0.0.1:{}/login".format(port), timeout=1).read()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("server did not start")
+
+
+def logged_in_opener(base):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    form = urllib.parse.urlencode({"username": DEMO_USER, "password": DEMO_PASSWORD}).encode()
+    opener.open(base + "/login_submit", data=form).read()
+    return opener
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--worker-class", default="gthread")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds per stand-in AWS call")
+    args = parser.parse_args()
+
+    port = free_port()
+    base = "http://127.0.0.1:{}".format(port)
+    proc = start_server(args, port)
+    try:
+        local = threading.local()
+        uploads = itertools.count()
+        latencies = defaultdict(list)
+        errors = defaultdict(int)
+        lock = threading.Lock()
+
+        def one_request(num):
+            if not hasattr(local, "opener"):
+                local.opener = logged_in_opener(base)
+                local.rnd = random.Random(num)
+            kind = local.rnd.choices(["dashboard", "view", "upload"], weights=[4, 5, 1])[0]
+            if kind == "dashboard":
+                path = "/dashboard"
+            elif kind == "view":
+                path = "/view/lecture-{:04d}.mp3?lang={}".format(local.rnd.randrange(SEEDED_FILES),
+                                                              local.rnd.choice(["es", "fr"]))
+            else:
+                key = "{}/upload-{:05d}.mp3".format(DEMO_USER, next(uploads))
+                path = "/test_redirect?" + urllib.parse.urlencode({"src": "en", "dst": "es,fr", "key": key})
+            start = time.perf_counter()
+            try:
+                local.opener.open(base + path, timeout=60).read()
+            except OSError:
+                with lock:
+                    errors[kind] += 1
+                return
+            with lock:
+                latencies[kind].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.clients) as pool:
+            list(pool.map(one_request, range(args.requests)))
+        elapsed = time.perf_counter() - start
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    done = sum(len(values) for values in latencies.values())
+    print("{} workers x {} threads ({}), {} clients, {:.0f} ms per AWS call".format(
+        args.workers, args.threads, args.worker_class, args.clients, args.latency * 1000))
+    print("{} requests in {:.2f} s, {:.1f} req/s, {} errors".format(
+        done, elapsed, done / elapsed, sum(errors.values())))
+    print("{:>10} {:>8} {:>9} {:>9} {:>9}".format("endpoint", "requests", "p50 ms", "p95 ms", "p99 ms"))
+    for kind, values in sorted(latencies.items()):
+        print("{:>10} {:>8} {:>9.1f} {:>9.1f} {:>9.1f}".format(
+            kind, len(values), percentile(values, 50) * 1000, percentile(values, 95) * 1000,
+            percentile(values, 99) * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+'''Converts files processed before subtitle documents existed. For every
+available item in files table without subtitle_doc attribute, the three
+loose text objects are aligned once and written as a single document'''
+
+import sys
+import boto3
+
+from app.subtitles import generate_json_updated, subtitle_doc_key, legacy_object_keys
+from app.subtitles import encode_subtitle_doc, SUBTITLE_DOC_VERSION
+
+BUCKET_TRANSLATE = 'krasniko-a3-translate'
+
+
+def read_text(s3_client, bucket, key):
+    resp = s3_client.get_object(Bucket=bucket, Key=key)
+    return resp["Body"].read().decode("utf-8")
+
+
+def legacy_items(table):
+    '''Yields finished items that only have the legacy three object layout'''
+    scan_kwargs = {}
+    while True:
+        resp = table.scan(**scan_kwargs)
+        for item in resp.get("Items", []):
+            if "available" in item and "subtitle_doc" not in item:
+                yield item
+        if "LastEvaluatedKey" not in resp:
+            break
+        scan_kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+
+def convert_item(s3_client, table, item):
+    usr = item["user"]
+    filename = item["filename"]
+    filename_noext = filename.split(".")[0]
+    srclang = item["srclang"]
+    dstlang = item["dstlang"]
+
+    src_key, dst_key, timings_key = legacy_object_keys(usr, filename_noext, srclang, dstlang)
+    data = generate_json_updated(read_text(s3_client, BUCKET_TRANSLATE, src_key),
+                                 read_text(s3_client, BUCKET_TRANSLATE, dst_key),
+                                 read_text(s3_client, BUCKET_TRANSLATE, timings_key))
+    s3_client.put_object(Bucket=BUCKET_TRANSLATE,
+                         Key=subtitle_doc_key(usr, filename_noext, dstlang),
+                         Body=encode_subtitle_doc(data, srclang, dstlang),
+                         ContentType="application/json; charset=utf-8")
+
+    # document goes first, so the web app never sees the attribute without it
+    table.update_item(
+        Key={"user": usr, "filename": filename},
+        UpdateExpression="SET subtitle_doc = :d",
+        ExpressionAttributeValues={":d": SUBTITLE_DOC_VERSION}
+    )
+
+
+def main():
+    s3_client = boto3.client('s3')
+    table = boto3.resource('dynamodb').Table("files")
+    converted = 0
+    failed = 0
+    for item in legacy_items(table):
+        try:
+            convert_item(s3_client, table, item)
+            converted += 1
+        except Exception as e:
+            failed += 1
+            print("Could not convert {}/{}: {}".format(item["user"], item["filename"], e), file=sys.stderr)
+    print("Converted {} files, {} failed".format(converted, failed))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,52 +1,131 @@
+'''Monthly cost model of the application. Every function accepts numbers or
+NumPy arrays (broadcast against each other) and returns arrays of costs in
+dollars, so whole sweeps of scenarios are computed at once.
 
+Per-user quantities are those of the original estimate (180 minutes of audio
+per user, every file viewed once, no cache) and scale linearly with minutes
+of audio and views per file. Cache hits save the S3 reads of subtitles'''
 
-def s3_costs_per_month(num_users):
-    # all of these costs are per month
-    storage_cost = 0.023 * 200.0/1024 * num_users
-    
-    request_cost = (20*num_users)/1000.0 * 0.005 + (164 * num_users)/1000*0.0004
-    
-    total_gb_transfered = 2 * num_users;
-    data_transfer_cost = 0
-    tier = 0
-    tier_cost = [0.0, 0.09,0.085,0.07,0.05]
-    tier_limit = [1.0, 10.0*1024, 40.0*1024, 100.0*1024, 9999.0*1024]
-    remaining_gb_transfered = total_gb_transfered
-    while (remaining_gb_transfered > 0.0001):
-        used_gb = min(tier_limit[tier], remaining_gb_transfered)
-        data_transfer_cost += used_gb * tier_cost[tier]
-        remaining_gb_transfered -= used_gb 
-        tier += 1
-    
-    total_costs = storage_cost + request_cost + data_transfer_cost
-    print("S3 costs for {} users, storage {}, request {}, data {}".format(num_users, storage_cost, request_cost, data_transfer_cost))
-    print("S3 total cost {}".format(total_costs))
-
-
-def dynamodb_costs_per_month(num_users):
-    read_req_cost = (80*num_users)/1000000.0 * 0.25
-    write_req_cost = (8*num_users)/1000000.0 * 1.25
-
-    total_cost = read_req_cost + write_req_cost
-    print("dynamodb read cost {}, write cost {}, total cost {} ".format(read_req_cost, write_req_cost, total_cost))
-
-def transcribe_costs_per_month(num_users):
-    cost = 180*60*num_users*0.0004
-    print("Transcribe cost {} ".format(cost))
-
-def translate_costs_per_month(num_users):
-    cost = 119340*num_users*0.000015
-    print("Translate cost {} ".format(cost))
-
-def lambda_gateway_costs_per_month(num_users):
-    lambda_compute_cost = max(0, 7.5*num_users-400000)*0.00001667
-    lambda_requests_cost = max(0, 440.0/1000000 * num_users -1) * 0.2
-    gateway_requests_cost = 440.0 * num_users / 1000000
-    total_cost =  lambda_compute_cost + lambda_requests_cost + gateway_requests_cost
-    print("lambda compute cost {}, request cost {}, gateway cost {}, total {}". format(lambda_compute_cost, lambda_requests_cost, gateway_requests_cost, total_cost))
-
-s3_costs_per_month(1000000)
-dynamodb_costs_per_month(1000000)
-transcribe_costs_per_month(1000)
-translate_costs_per_month(1000)
-lambda_gateway_costs_per_month(1000000)
+import numpy as np
+
+# baseline usage of one user per month
+BASE_MINUTES = 180.0
+STORAGE_GB_PER_MINUTE = 200.0 / 1024 / BASE_MINUTES
+PUT_REQUESTS_PER_MINUTE = 20.0 / BASE_MINUTES
+GET_REQUESTS_PER_VIEWED_MINUTE = 164.0 / BASE_MINUTES
+TRANSFER_GB_PER_VIEWED_MINUTE = 2.0 / BASE_MINUTES
+DYNAMO_READS_PER_VIEWED_MINUTE = 80.0 / BASE_MINUTES
+DYNAMO_WRITES_PER_MINUTE = 8.0 / BASE_MINUTES
+TRANSLATE_CHARACTERS_PER_MINUTE = 119340.0 / BASE_MINUTES
+LAMBDA_GB_SECONDS_PER_MINUTE = 7.5 / BASE_MINUTES
+REQUESTS_PER_VIEWED_MINUTE = 440.0 / BASE_MINUTES
+
+# S3 data transfer out, size of every tier in GB and its price per GB
+TRANSFER_TIER_GB = np.array([1.0, 10.0 * 1024, 40.0 * 1024, 100.0 * 1024, np.inf])
+TRANSFER_TIER_PRICE = np.array([0.0, 0.09, 0.085, 0.07, 0.05])
+TRANSFER_TIER_START = np.concatenate(([0.0], np.cumsum(TRANSFER_TIER_GB)[:-1]))
+
+
+def tiered_cost(amount, tier_start=TRANSFER_TIER_START, tier_size=TRANSFER_TIER_GB,
+                tier_price=TRANSFER_TIER_PRICE):
+    '''Applies tiered pricing to an array of amounts. The part of every
+    amount that falls into each tier is computed for all tiers at once'''
+    amount = np.asarray(amount, dtype=float)
+    in_tier = np.clip(amount[..., np.newaxis] - tier_start, 0.0, tier_size)
+    return in_tier @ tier_price
+
+
+def s3_costs_per_month(num_users, minutes_per_user=BASE_MINUTES, views_per_file=1.0, cache_hit_rate=0.0):
+    '''Returns storage, request and data transfer costs'''
+    num_users = np.asarray(num_users, dtype=float)
+    minutes = num_users * minutes_per_user
+    viewed_minutes = minutes * views_per_file
+    storage_cost = 0.023 * STORAGE_GB_PER_MINUTE * minutes
+    put_cost = PUT_REQUESTS_PER_MINUTE * minutes / 1000.0 * 0.005
+    get_cost = GET_REQUESTS_PER_VIEWED_MINUTE * viewed_minutes * (1.0 - cache_hit_rate) / 1000.0 * 0.0004
+    transfer_cost = tiered_cost(TRANSFER_GB_PER_VIEWED_MINUTE * viewed_minutes)
+    return {"storage": storage_cost, "request": put_cost + get_cost, "data": transfer_cost}
+
+
+def dynamodb_costs_per_month(num_users, minutes_per_user=BASE_MINUTES, views_per_file=1.0):
+    minutes = np.asarray(num_users, dtype=float) * minutes_per_user
+    read_req_cost = DYNAMO_READS_PER_VIEWED_MINUTE * minutes * views_per_file / 1000000.0 * 0.25
+    write_req_cost = DYNAMO_WRITES_PER_MINUTE * minutes / 1000000.0 * 1.25
+    return read_req_cost + write_req_cost
+
+
+def transcribe_costs_per_month(num_users, minutes_per_user=BASE_MINUTES, duplicate_ratio=0.0):
+    # duplicate_ratio is the share of uploads whose content was transcribed
+    # before, they reuse the transcript from the content index
+    return np.asarray(num_users, dtype=float) * minutes_per_user * (1.0 - duplicate_ratio) * 60 * 0.0004
+
+
+def translate_costs_per_month(num_users, saved_characters_ratio=0.0, minutes_per_user=BASE_MINUTES,
+                              duplicate_ratio=0.0):
+    # saved_characters_ratio is the share of characters served from translation
+    # memory (saved_characters / characters) reported by the translate lambda
+    characters = np.asarray(num_users, dtype=float) * minutes_per_user * TRANSLATE_CHARACTERS_PER_MINUTE
+    return characters * (1.0 - duplicate_ratio) * (1.0 - saved_characters_ratio) * 0.000015
+
+
+def lambda_gateway_costs_per_month(num_users, minutes_per_user=BASE_MINUTES, views_per_file=1.0):
+    minutes = np.asarray(num_users, dtype=float) * minutes_per_user
+    requests = REQUESTS_PER_VIEWED_MINUTE * minutes * views_per_file
+    lambda_compute_cost = np.maximum(0.0, LAMBDA_GB_SECONDS_PER_MINUTE * minutes - 400000) * 0.00001667
+    lambda_requests_cost = np.maximum(0.0, requests / 1000000 - 1) * 0.2
+    gateway_requests_cost = requests / 1000000
+    return lambda_compute_cost + lambda_requests_cost + gateway_requests_cost
+
+
+def monthly_costs(num_users, minutes_per_user=BASE_MINUTES, views_per_file=1.0, cache_hit_rate=0.0,
+                  saved_characters_ratio=0.0, duplicate_ratio=0.0):
+    '''Returns dictionary from service to array of costs, "total" is their
+    sum. Arguments are broadcast against each other'''
+    s3 = s3_costs_per_month(num_users, minutes_per_user, views_per_file, cache_hit_rate)
+    costs = {
+        "s3": s3["storage"] + s3["request"] + s3["data"],
+        "dynamodb": dynamodb_costs_per_month(num_users, minutes_per_user, views_per_file),
+        "transcribe": transcribe_costs_per_month(num_users, minutes_per_user, duplicate_ratio),
+        "translate": translate_costs_per_month(num_users, saved_characters_ratio, minutes_per_user,
+                                               duplicate_ratio),
+        "lambda_gateway": lambda_gateway_costs_per_month(num_users, minutes_per_user, views_per_file),
+    }
+    shape = np.broadcast(*[np.asarray(value) for value in costs.values()]).shape
+    costs = {service: np.broadcast_to(value, shape) for service, value in costs.items()}
+    costs["total"] = sum(costs.values())
+    return costs
+
+
+def sweep(num_users, minutes_per_user, views_per_file, cache_hit_rate, saved_characters_ratio):
+    '''Computes total costs for every combination of the given 1-d arrays.
+    Returns an array with one axis per argument'''
+    grids = np.ix_(np.atleast_1d(num_users), np.atleast_1d(minutes_per_user), np.atleast_1d(views_per_file),
+                   np.atleast_1d(cache_hit_rate), np.atleast_1d(saved_characters_ratio))
+    return monthly_costs(*grids)["total"]
+
+
+def monte_carlo(num_users, samples, rng=None, minutes_sigma=0.5, views_mean=1.0,
+                cache_hit_alpha=8.0, cache_hit_beta=2.0, saved_alpha=2.0, saved_beta=5.0):
+    '''Draws average usage of a month: lognormal minutes of audio per user
+    (median BASE_MINUTES), gamma distributed views per file and beta
+    distributed cache hit and translation memory rates. Returns costs of
+    every sample like monthly_costs, num_users may be an array broadcast
+    against the samples'''
+    rng = np.random.default_rng(rng)
+    minutes = BASE_MINUTES * rng.lognormal(0.0, minutes_sigma, samples)
+    views = rng.gamma(4.0, views_mean / 4.0, samples)
+    cache_hit_rate = rng.beta(cache_hit_alpha, cache_hit_beta, samples)
+    saved_ratio = rng.beta(saved_alpha, saved_beta, samples)
+    return monthly_costs(np.asarray(num_users, dtype=float)[..., np.newaxis], minutes, views,
+                         cache_hit_rate, saved_ratio)
+
+
+if __name__ == "__main__":
+    s3 = s3_costs_per_month(1000000)
+    print("S3 costs for {} users, storage {}, request {}, data {}".format(
+        1000000, s3["storage"], s3["request"], s3["data"]))
+    print("S3 total cost {}".format(s3["storage"] + s3["request"] + s3["data"]))
+    print("dynamodb total cost {} ".format(dynamodb_costs_per_month(1000000)))
+    print("Transcribe cost {} ".format(transcribe_costs_per_month(1000)))
+    print("Translate cost {} ".format(translate_costs_per_month(1000)))
+    print("lambda and gateway cost {} ".format(lambda_gateway_costs_per_month(1000000)))
@@ -0,0 +1,52 @@
+'''Production serving config: gunicorn -c gunicorn.conf.py wsgi:application
+
+Requests mostly wait on DynamoDB and S3, so every worker process runs a pool
+of threads (gthread). Size it from the expected load:
+
+    threads per worker ~= requests per second * average latency in seconds
+                          + clients holding a /status/wait long poll
+
+e.g. 40 req/s at 150 ms plus 20 open dashboards is 26 threads in one worker.
+Long polls hold a thread for up to STATUS_LONG_POLL_TIMEOUT seconds. With
+many open dashboards WEB_WORKER_CLASS=gevent serves them without a thread
+each (needs gevent installed).
+
+Threads of a worker share the AWS clients (app/aws.py), so
+AWS_MAX_POOL_CONNECTIONS must be at least WEB_THREADS + S3_FETCH_WORKERS,
+otherwise requests queue for a connection. Add workers for CPU bound load
+(subtitle alignment of legacy files, template rendering), up to one per core.
+
+A3_LOCAL_AWS=1 runs the app against the in-memory stand-ins of
+benchmarks/local_aws.py instead of AWS (every worker gets its own copy)'''
+
+import multiprocessing
+import os
+
+bind = os.environ.get('WEB_BIND', '0.0.0.0:5001')
+worker_class = os.environ.get('WEB_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('WEB_WORKERS', min(multiprocessing.cpu_count(), 4)))
+threads = int(os.environ.get('WEB_THREADS', 32))
+if worker_class == 'gevent':
+    worker_connections = int(os.environ.get('WEB_WORKER_CONNECTIONS', 1000))
+# long polls must finish before gunicorn considers the worker stuck
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+accesslog = os.environ.get('WEB_ACCESS_LOG')
+
+local_aws = os.environ.get('A3_LOCAL_AWS') == '1'
+if local_aws:
+    # there are no credentials to resolve, stand-ins are installed per worker
+    os.environ['AWS_PREWARM'] = '0'
+    # uploads registered against stand-ins must not be replayed against AWS
+    os.environ.setdefault('POST_UPLOAD_JOURNAL', ':memory:')
+
+
+def post_worker_init(worker):
+    if not local_aws:
+        return
+    import sys
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks'))
+    import local_aws as stand_ins
+    stand_ins.install(latency=float(os.environ.get('A3_LOCAL_AWS_LATENCY', 0.02)),
+                      uploads=int(os.environ.get('A3_LOCAL_AWS_UPLOADS', 0)))
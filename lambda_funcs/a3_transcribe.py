@@ -1,5 +1,14 @@
-import json
-import boto3
+import hashlib
+import itertools
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+
+from instrumentation import InvocationMetrics
+from content_index import ContentIndex, content_index_table, mark_available
+from mp3_frames import split_mp3
+from common import ClientCache, subtitle_doc_version
 
 transcribe_output_bucket = 'krasniko-a3-transcribe'
 mp3_bucket_name = "krasniko-a3-mp3"
@@ -10,44 +19,212 @@ lang_code_mapping = {"en":'en-US',
     "fr":'fr-CA'
 }
 
-def lambda_handler(event, context):
-    '''This function needs to handle only insert events in dynamodb,
-    which happen when new file gets added'''
-    
-    print(event)
-    for record in event['Records']:
-        if record["eventName"] != "INSERT":
-            continue
-    
-        new_image = record['dynamodb']['NewImage']
-        
-        # extract information necessary for transcribing
-        user = new_image['user']['S']
-        filename = new_image['filename']['S']
-        language = new_image['srclang']['S']
-        
-        # extract bucket name and key
-        object_name = "{}/{}".format(user, filename)
-        file_uri = 's3://{}/{}'.format(mp3_bucket_name, object_name)
-        print(file_uri)
-        print(language)
-        language_code = lang_code_mapping[language]
-        print(language_code)
-        client = boto3.client('transcribe')
-        job_name ="{}-{}".format(user, filename.split(".")[0])
-        print(job_name)
-        
-        response = client.start_transcription_job(
+# jobs of one stream batch are started concurrently with a single client
+max_start_workers = int(os.environ.get('TRANSCRIBE_START_WORKERS', 10))
+
+# uploads of at least this many bytes are cut into chunks transcribed in
+# parallel, 0 disables splitting. Cuts are moved to the quietest moment
+# within the search window around every multiple of the chunk length
+split_min_bytes = int(os.environ.get('TRANSCRIBE_SPLIT_MIN_BYTES', 0))
+chunk_seconds = float(os.environ.get('TRANSCRIBE_CHUNK_SECONDS', 600))
+silence_search_seconds = float(os.environ.get('TRANSCRIBE_SILENCE_SEARCH_SECONDS', 30))
+chunk_upload_workers = 4
+
+metrics = InvocationMetrics('a3_transcribe')
+logger = logging.getLogger(__name__)
+# stand-ins for local runs can be put here before the first invocation
+clients = ClientCache(metrics, max_pool_connections=max_start_workers)
+get_client = clients.get_client
+
+
+def transcription_job_name(user, filename, sequence_number):
+    '''Job name is user-<filename without extension>-<digest>. The digest
+    covers the stream sequence number, so a retried record gets the same
+    name while uploading a file with the same name again (a MODIFY record,
+    see is_new_upload) gets a new one.
+    translate lambda parses the user and file name back from it'''
+    digest = hashlib.sha256("{}/{}/{}".format(user, filename, sequence_number).encode()).hexdigest()[:12]
+    return "{}-{}-{}".format(user, filename.split(".")[0], digest)
+
+
+def chunk_media_key(job_name, idx):
+    return "chunks/{}/{:04d}.mp3".format(job_name, idx)
+
+
+def chunk_output_key(job_name, idx):
+    '''Transcribe output of a chunk, translate lambda parses it back'''
+    return "chunks/{}/{:04d}.json".format(job_name, idx)
+
+
+def start_chunk_jobs(user, filename, language_code, job_name):
+    '''Cuts the mp3 at frame boundaries into chunks of about chunk_seconds,
+    stores their offsets (milliseconds) in the files item and starts a job
+    for every chunk. Translate lambda merges the outputs once all of them
+    are done. Returns the number of chunks, 0 when the file did not give at
+    least two chunks (shorter than a chunk or not MPEG audio), then nothing
+    is written and the file is transcribed by a single job'''
+    s3 = get_client('s3')
+    body = s3.get_object(Bucket=mp3_bucket_name, Key="{}/{}".format(user, filename))['Body']
+    chunks = split_mp3(body, chunk_seconds, silence_search_seconds)
+    with metrics.stage("split"):
+        head = list(itertools.islice(chunks, 2))
+    if len(head) < 2:
+        return 0
+    offsets = []
+    # chunks are uploaded while the rest of the file is read and split
+    with metrics.stage("split"), ThreadPoolExecutor(max_workers=chunk_upload_workers) as pool:
+        uploads = []
+        for idx, (start, data) in enumerate(itertools.chain(head, chunks)):
+            uploads.append(pool.submit(s3.put_object, Bucket=mp3_bucket_name, Key=chunk_media_key(job_name, idx),
+                                       Body=data, ContentType="audio/mpeg"))
+            offsets.append(int(round(start * 1000)))
+        for upload in uploads:
+            upload.result()
+
+    get_client('dynamodb').update_item(
+        TableName="files",
+        Key={"user": user, 'filename': filename},
+        UpdateExpression="SET chunk_job = :j, chunk_offsets = :o",
+        ExpressionAttributeValues={":j": job_name, ":o": offsets},
+    )
+
+    def start_job(idx):
+        try:
+            get_client('transcribe').start_transcription_job(
+                TranscriptionJobName="{}-{:04d}".format(job_name, idx),
+                LanguageCode=language_code,
+                Media={'MediaFileUri': 's3://{}/{}'.format(mp3_bucket_name, chunk_media_key(job_name, idx))},
+                OutputBucketName=transcribe_output_bucket,
+                OutputKey=chunk_output_key(job_name, idx),
+                )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConflictException':
+                raise
+
+    with ThreadPoolExecutor(max_workers=min(max_start_workers, len(offsets))) as pool:
+        list(pool.map(start_job, range(len(offsets))))
+    return len(offsets)
+
+
+def reuse_content(user, filename, language, dst_langs, content_hash, job_name):
+    '''Uses artifacts of an earlier upload of the same mp3 instead of a new
+    Transcribe job. When subtitles of every language exist they are copied
+    and the file is available right away, otherwise the transcript is copied
+    to the output bucket, which starts the translate lambda like a finished
+    job would. Returns None when the content was not transcribed before'''
+    index = ContentIndex(get_client('dynamodb'))
+    entry = index.lookup(content_hash, language)
+    if entry is None:
+        return None
+    filename_noext = filename.split(".")[0]
+    if set(dst_langs) <= index.languages(entry) and all(
+            index.copy_doc(get_client('s3'), entry, lang, user, filename_noext) for lang in dst_langs):
+        mark_available(get_client('dynamodb'), user, filename_noext, dst_langs,
+                       entry.get("version", content_hash), subtitle_doc_version)
+        return "reused"
+    if "transcript_key" not in entry:
+        # split recordings have no single transcript to translate again
+        return None
+    try:
+        get_client('s3').copy_object(
+            Bucket=transcribe_output_bucket, Key=job_name + ".json",
+            CopySource={"Bucket": entry["transcript_bucket"], "Key": entry["transcript_key"]})
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+            raise
+        return None
+    return "transcript_reused"
+
+
+def is_new_upload(record):
+    '''True for records of an uploaded file: INSERT of its files item, or
+    MODIFY when a file uploaded again under the same name replaced the item
+    with a new upload_id. Other MODIFY records come from the lambdas updating
+    the item. Needs the NEW_AND_OLD_IMAGES stream view type'''
+    if record["eventName"] == "INSERT":
+        return True
+    if record["eventName"] != "MODIFY":
+        return False
+    upload_id = record['dynamodb'].get('NewImage', {}).get('upload_id')
+    return upload_id is not None and upload_id != record['dynamodb'].get('OldImage', {}).get('upload_id')
+
+
+def start_transcription(record):
+    '''Starts transcription job for one upload record unless the content of
+    the mp3 was transcribed before. Returns what was done: "started",
+    "already_started" if the job of a retried record exists, "split" when
+    chunks of a large file were started, "reused" or "transcript_reused"
+    (see reuse_content)'''
+    new_image = record['dynamodb']['NewImage']
+
+    # extract information necessary for transcribing
+    user = new_image['user']['S']
+    filename = new_image['filename']['S']
+    language = new_image['srclang']['S']
+    content_hash = new_image.get('content_hash', {}).get('S')
+    if 'dstlangs' in new_image:
+        dst_langs = [value['S'] for value in new_image['dstlangs']['L']]
+    else:
+        dst_langs = [new_image['dstlang']['S']] if 'dstlang' in new_image else []
+
+    # extract bucket name and key
+    object_name = "{}/{}".format(user, filename)
+    file_uri = 's3://{}/{}'.format(mp3_bucket_name, object_name)
+    language_code = lang_code_mapping[language]
+    job_name = transcription_job_name(user, filename, record['dynamodb']['SequenceNumber'])
+
+    if content_hash and dst_langs and content_index_table:
+        try:
+            outcome = reuse_content(user, filename, language, dst_langs, content_hash, job_name)
+        except ClientError as e:
+            # the index only saves work, the file is transcribed without it
+            logger.warning("Content index lookup for %s failed: %s", object_name, e)
+            metrics.set("content_index_error", str(e))
+            outcome = None
+        if outcome is not None:
+            return outcome
+
+    if (split_min_bytes and filename.lower().endswith(".mp3")
+            and int(new_image.get('size', {}).get('N', 0)) >= split_min_bytes
+            and start_chunk_jobs(user, filename, language_code, job_name)):
+        return "split"
+
+    try:
+        get_client('transcribe').start_transcription_job(
             TranscriptionJobName=job_name,
             LanguageCode=language_code,
             Media={'MediaFileUri': file_uri},
             OutputBucketName=transcribe_output_bucket,
             )
-        
-        print(response)
-        print(event)
-    
-    return {
-        'statusCode': 200,
-        'body': json.dumps('Done processing DB events')
-    }
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConflictException':
+            raise
+        # record was retried, the job is already running
+        return "already_started"
+    return "started"
+
+
+def lambda_handler(event, context):
+    '''This function needs to handle only records of uploads (see
+    is_new_upload), other changes of the files table are skipped.
+    Records that failed are reported back, so only they are retried
+    (ReportBatchItemFailures must be enabled on the event source mapping)'''
+    metrics.start(context)
+    records = [record for record in event['Records'] if is_new_upload(record)]
+    failures = []
+    errors = []
+    outcomes = {"started": 0, "already_started": 0, "split": 0, "reused": 0, "transcript_reused": 0}
+    if records:
+        with metrics.stage("start_jobs"), \
+                ThreadPoolExecutor(max_workers=min(max_start_workers, len(records))) as pool:
+            futures = [(record, pool.submit(start_transcription, record)) for record in records]
+        for record, future in futures:
+            try:
+                outcomes[future.result()] += 1
+            except Exception as e:
+                errors.append({"event_id": record.get('eventID'), "error": str(e)})
+                failures.append({"itemIdentifier": record['dynamodb']['SequenceNumber']})
+
+    metrics.flush(records=len(event['Records']), uploads=len(records), failed=len(failures),
+                  errors=errors, force=bool(failures), **outcomes)
+    return {"batchItemFailures": failures}
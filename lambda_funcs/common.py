@@ -0,0 +1,111 @@
+'''Helpers shared by the lambdas: AWS clients kept for the life of the
+container, keys of subtitle documents in the translate bucket and alignment
+of anchored texts into subtitle segments. Keys and alignment must give the
+same results as app/subtitles.py, which is deployed with the web app'''
+
+import json
+import threading
+
+import boto3
+from botocore.config import Config
+
+from translation_engine import ANCHOR_PATTERN
+
+# must match SUBTITLE_DOC_VERSION in the web app
+subtitle_doc_version = 1
+
+
+class ClientCache(dict):
+    '''Clients by service name, created on first use and kept for the life
+    of the container. Stand-ins for local runs can be put into it before the
+    first invocation. DynamoDB client is the one of a resource, so it works
+    with python types'''
+
+    def __init__(self, metrics, max_pool_connections=10):
+        super().__init__()
+        self.metrics = metrics
+        self.max_pool_connections = max_pool_connections
+        self._lock = threading.Lock()
+
+    def get_client(self, service):
+        '''Returns the client of the service shared by all invocations and threads'''
+        client = self.get(service)
+        if client is None:
+            with self._lock:
+                client = self.get(service)
+                if client is None:
+                    config = Config(max_pool_connections=self.max_pool_connections)
+                    if service == 'dynamodb':
+                        client = boto3.resource(service, config=config).meta.client
+                    else:
+                        client = boto3.client(service, config=config)
+                    client = self.metrics.instrument(client)
+                    self[service] = client
+        return client
+
+
+def subtitle_doc_key(user, filename_noext, lang):
+    '''Returns S3 key of the subtitle document for one destination language'''
+    return "{}/{}.{}.subs.json".format(user, filename_noext, lang)
+
+
+def subtitle_part_key(user, filename_noext, lang, part):
+    '''Returns S3 key of one part of the subtitle document, written before
+    the whole document is done'''
+    return "{}/{}.{}.part-{:05d}.subs.json".format(user, filename_noext, lang, part)
+
+
+def find_anchors(text):
+    '''Returns a dictionary from anchor number (as string) to position of
+    its first occurrence in the text. Scans the text only once'''
+    positions = {}
+    for match in ANCHOR_PATTERN.finditer(text):
+        positions.setdefault(match.group(1), match.start())
+    return positions
+
+
+def align_segments(text_src, text_dst, timings):
+    '''Splits anchored source text and its translation into aligned segments.
+    Sentences whose anchor was dropped by Translate are merged with the
+    following one, like generate_json_updated in the web app does'''
+    return align_part(text_src, text_dst, timings)[0]
+
+
+def align_part(text_src, text_dst, timings, pending=None):
+    '''Aligns one part of a transcript translated in parts. Sentences after
+    the last anchor Translate kept cannot be aligned yet, they are returned
+    as pending (start time, source text, translation) and passed with the
+    next part, whose first segment they are merged into. Returns segments
+    and pending, None when the part ends with an anchored sentence'''
+    anchors_src = find_anchors(text_src)
+    anchors_dst = find_anchors(text_dst)
+    last_src_pos = 0
+    last_dst_pos = 0
+    segment_start, prefix_src, prefix_dst = pending or (None, "", "")
+    segments = []
+    for i, timing in enumerate(timings.split(",")):
+        if timing == "":
+            continue
+        start_time, end_time = timing.split("-")
+        if segment_start is None:
+            segment_start = start_time
+        anchor_src = anchors_src.get(str(i))
+        anchor_dst = anchors_dst.get(str(i))
+        if anchor_src is None or anchor_dst is None:
+            continue
+        segments.append([float(segment_start), float(end_time),
+                         prefix_src + text_src[last_src_pos:anchor_src],
+                         prefix_dst + text_dst[last_dst_pos:anchor_dst]])
+        last_src_pos = anchor_src
+        last_dst_pos = anchor_dst
+        segment_start = None
+        prefix_src = prefix_dst = ""
+    if segment_start is None:
+        return segments, None
+    return segments, (segment_start, prefix_src + text_src[last_src_pos:], prefix_dst + text_dst[last_dst_pos:])
+
+
+def build_subtitle_doc(segments, src_lang, dst_lang):
+    '''Serializes aligned segments into the compact document read by the web app'''
+    doc = {"v": subtitle_doc_version, "src": src_lang, "dst": dst_lang, "segments": segments}
+    return json.dumps(doc, ensure_ascii=False, separators=(",", ":"))
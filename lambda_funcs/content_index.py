@@ -0,0 +1,120 @@
+'''Index from the content of uploaded mp3 files to the transcript and
+subtitle documents made for them, shared by all users. Items of the table
+are keyed by "<content hash>/<source language>" and hold the location and
+version of the Transcribe output and, for every translated language,
+doc_<lang> with the key of its subtitle document. Indexed documents are
+copies under content/, the documents of a user are replaced when the user
+uploads another mp3 with the same name. A file uploaded again,
+by the same user after a failure or by another one, gets copies of these
+artifacts under its own name instead of being transcribed and translated
+once more'''
+
+import os
+import time
+
+from botocore.exceptions import ClientError
+
+from common import subtitle_doc_key
+
+# empty disables dedupe of uploads
+content_index_table = os.environ.get('CONTENT_INDEX_TABLE', 'content_index')
+
+translate_bucket = 'krasniko-a3-translate'
+# indexed documents belong to the content, not to the file of one user
+content_doc_prefix = "content/"
+
+
+def index_key(content_hash, src_lang):
+    # the same audio transcribed in another language is a different transcript
+    return "{}/{}".format(content_hash, src_lang)
+
+
+def content_doc_key(content_hash, src_lang, lang):
+    return "{}{}/{}.{}.subs.json".format(content_doc_prefix, content_hash, src_lang, lang)
+
+
+def mark_available(dynamodb, user, filename_noext, langs, version, subtitle_doc_version):
+    '''Marks languages of a file as available, the file becomes available
+    with its first language. modified is the time of the change, served by
+    the web app as Last-Modified'''
+    dynamodb.update_item(
+        TableName="files",
+        Key={"user": user, 'filename': filename_noext + ".mp3"},
+        UpdateExpression="SET available = :b, version = :v, subtitle_doc = :d, modified = :t "
+                         "ADD available_langs :l",
+        ExpressionAttributeValues={":b": True, ":v": version, ":d": subtitle_doc_version, ":l": set(langs),
+                                   ":t": int(time.time())}
+    )
+
+
+class ContentIndex:
+    '''DynamoDB table of artifacts by content hash. dynamodb is a client
+    working with python types (the client of a boto3 resource)'''
+
+    def __init__(self, dynamodb, table_name=content_index_table):
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+
+    def lookup(self, content_hash, src_lang):
+        '''Returns the entry of the content, None if it was not transcribed yet.
+        Entries of split recordings only have subtitle documents'''
+        resp = self.dynamodb.get_item(TableName=self.table_name,
+                                      Key={"content_hash": index_key(content_hash, src_lang)},
+                                      ConsistentRead=True)
+        item = resp.get("Item")
+        if item is None or ("transcript_key" not in item and not self.languages(item)):
+            return None
+        return item
+
+    def add_transcript(self, content_hash, src_lang, bucket, key, version):
+        '''Records the Transcribe output of the content. The first transcript
+        is kept, documents of languages refer to its version'''
+        try:
+            self.dynamodb.update_item(
+                TableName=self.table_name,
+                Key={"content_hash": index_key(content_hash, src_lang)},
+                UpdateExpression="SET transcript_bucket = :b, transcript_key = :k, version = :v",
+                ConditionExpression="attribute_not_exists(transcript_key)",
+                ExpressionAttributeValues={":b": bucket, ":k": key, ":v": version},
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+    def add_doc(self, s3, content_hash, src_lang, lang, key):
+        '''Copies the subtitle document of a file to the key of its content
+        and records it in the entry'''
+        indexed_key = content_doc_key(content_hash, src_lang, lang)
+        s3.copy_object(Bucket=translate_bucket, Key=indexed_key,
+                       CopySource={"Bucket": translate_bucket, "Key": key})
+        self.dynamodb.update_item(
+            TableName=self.table_name,
+            Key={"content_hash": index_key(content_hash, src_lang)},
+            UpdateExpression="SET #d = :k",
+            ExpressionAttributeNames={"#d": "doc_" + lang},
+            ExpressionAttributeValues={":k": indexed_key},
+        )
+
+    @staticmethod
+    def languages(entry):
+        '''Returns languages with an indexed document. Entries written before
+        documents were copied under content/ point to documents of a user,
+        which may belong to another mp3 by now, they are not used'''
+        return {name[len("doc_"):] for name, value in entry.items()
+                if name.startswith("doc_") and value.startswith(content_doc_prefix)}
+
+    @staticmethod
+    def copy_doc(s3, entry, lang, user, filename_noext):
+        '''Copies the subtitle document of the language to the key of the
+        file. Returns False if the document no longer exists'''
+        key = subtitle_doc_key(user, filename_noext, lang)
+        source = entry["doc_" + lang]
+        if source != key:
+            try:
+                s3.copy_object(Bucket=translate_bucket, Key=key,
+                               CopySource={"Bucket": translate_bucket, "Key": source})
+            except ClientError as e:
+                if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+                    raise
+                return False
+        return True
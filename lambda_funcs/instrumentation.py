@@ -0,0 +1,97 @@
+'''Structured timing of lambda invocations. Stages are timed with
+metrics.stage(), AWS calls are recorded by botocore event hooks on the
+clients and everything is written as one json log line per invocation.
+A fraction METRICS_SAMPLE_RATE of invocations is logged, slow and failed
+ones always'''
+
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+sample_rate = float(os.environ.get('METRICS_SAMPLE_RATE', 1.0))
+slow_invocation_seconds = float(os.environ.get('METRICS_SLOW_SECONDS', 10.0))
+
+
+class InvocationMetrics:
+    '''Collects stage timings, AWS calls and payload sizes of the current
+    invocation. Safe to use from the threads of one invocation'''
+
+    def __init__(self, handler):
+        self.handler = handler
+        self._lock = threading.Lock()
+        self.start()
+
+    def start(self, context=None):
+        with self._lock:
+            self.request_id = getattr(context, "aws_request_id", None)
+            self.started = time.perf_counter()
+            self.stages = {}
+            self.calls = {}
+            self.values = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.stages[name] = self.stages.get(name, 0.0) + elapsed
+
+    def elapsed(self):
+        '''Seconds since the invocation started'''
+        return time.perf_counter() - self.started
+
+    def set(self, name, value):
+        '''Records a value of the invocation, e.g. size of a payload'''
+        with self._lock:
+            self.values[name] = value
+
+    def record_call(self, operation, seconds, size=0, error=None):
+        with self._lock:
+            entry = self.calls.setdefault(operation, {"calls": 0, "seconds": 0.0, "bytes": 0, "errors": 0})
+            entry["calls"] += 1
+            entry["seconds"] += seconds
+            entry["bytes"] += size
+            if error is not None:
+                entry["errors"] += 1
+
+    def instrument(self, client):
+        '''Registers botocore event hooks timing every call of the client'''
+        def before_call(model, context, **kwargs):
+            context["metrics_start"] = time.perf_counter()
+
+        def after_call(model, context, http_response=None, **kwargs):
+            start = context.get("metrics_start")
+            if start is not None:
+                length = http_response.headers.get("content-length") if http_response is not None else None
+                self.record_call("{}.{}".format(model.service_model.service_name, model.name),
+                                 time.perf_counter() - start, int(length or 0))
+
+        def after_call_error(model, context, exception=None, **kwargs):
+            start = context.get("metrics_start")
+            if start is not None:
+                self.record_call("{}.{}".format(model.service_model.service_name, model.name),
+                                 time.perf_counter() - start, error=exception)
+
+        events = client.meta.events
+        events.register("before-call.*.*", before_call, unique_id="metrics-before")
+        events.register("after-call.*.*", after_call, unique_id="metrics-after")
+        events.register("after-call-error.*.*", after_call_error, unique_id="metrics-error")
+        return client
+
+    def flush(self, force=False, **fields):
+        '''Writes the log line of the invocation if it is sampled, slow or
+        forced (e.g. because something failed), returns the record'''
+        with self._lock:
+            record = dict(fields, handler=self.handler, request_id=self.request_id,
+                          seconds=round(time.perf_counter() - self.started, 6),
+                          stages={name: round(value, 6) for name, value in self.stages.items()},
+                          aws=self.calls, values=self.values)
+        if force or record["seconds"] >= slow_invocation_seconds or random.random() < sample_rate:
+            print(json.dumps(record, default=str))
+        return record
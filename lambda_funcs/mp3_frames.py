@@ -0,0 +1,213 @@
+'''Pure python reader of MPEG audio (mp3) frames. Finds frame boundaries
+without decoding the audio, so a long recording can be cut into chunks that
+are valid mp3 files on their own. Loudness of Layer III frames is estimated
+from the global gain in their side information, frames without coded
+spectrum count as silent, which is enough to put cuts between words.
+
+Layer III frames may take bits from earlier frames (bit reservoir), the
+first frame of a chunk can lose a few milliseconds of audio. Cuts are made
+in quiet moments, where this is not audible and no words are lost'''
+
+from collections import namedtuple
+
+# kbps by (MPEG-1, layer), index 0 is free format which is not supported
+BITRATES = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+# Hz by version bits of the header (0 MPEG-2.5, 2 MPEG-2, 3 MPEG-1)
+SAMPLE_RATES = {0: (11025, 12000, 8000), 2: (22050, 24000, 16000), 3: (44100, 48000, 32000)}
+
+HEADER_SIZE = 4
+
+# offset is the position in the stream, seconds the duration of the frame
+# and gain the loudness estimate (None for layers I and II)
+Frame = namedtuple("Frame", "offset data seconds gain")
+FrameHeader = namedtuple("FrameHeader", "mpeg1 layer length samples sample_rate channels crc")
+
+
+def parse_header(buf, pos=0):
+    '''Parses the 4 byte frame header at pos. Returns FrameHeader or None if
+    there is no valid header'''
+    if len(buf) < pos + HEADER_SIZE or buf[pos] != 0xFF or buf[pos + 1] & 0xE0 != 0xE0:
+        return None
+    b1, b2, b3 = buf[pos + 1], buf[pos + 2], buf[pos + 3]
+    version = (b1 >> 3) & 3
+    layer = 4 - ((b1 >> 1) & 3)
+    bitrate_idx = b2 >> 4
+    rate_idx = (b2 >> 2) & 3
+    if version == 1 or layer == 4 or bitrate_idx in (0, 15) or rate_idx == 3:
+        return None
+    mpeg1 = version == 3
+    bitrate = BITRATES[(mpeg1, layer)][bitrate_idx] * 1000
+    sample_rate = SAMPLE_RATES[version][rate_idx]
+    padding = (b2 >> 1) & 1
+    if layer == 1:
+        length = (12 * bitrate // sample_rate + padding) * 4
+        samples = 384
+    else:
+        samples = 1152 if layer == 2 or mpeg1 else 576
+        length = samples // 8 * bitrate // sample_rate + padding
+    channels = 1 if b3 >> 6 == 3 else 2
+    return FrameHeader(mpeg1, layer, length, samples, sample_rate, channels, not b1 & 1)
+
+
+def side_info_size(header):
+    '''Returns the size in bytes of Layer III side information'''
+    if header.mpeg1:
+        return 17 if header.channels == 1 else 32
+    return 9 if header.channels == 1 else 17
+
+
+def layer3_gain(frame, header):
+    '''Returns the largest global gain of the granules of a Layer III frame
+    that carry coded spectrum, 0 when none does (digital silence)'''
+    pos = HEADER_SIZE + (2 if header.crc else 0)
+    side_info = side_info_size(header)
+    if header.mpeg1:
+        skip = 9 + (5 if header.channels == 1 else 3) + 4 * header.channels
+        granules, granule_bits = 2, 59
+    else:
+        skip = 8 + (1 if header.channels == 1 else 2)
+        granules, granule_bits = 1, 63
+    bits = int.from_bytes(frame[pos:pos + side_info], "big")
+    total = side_info * 8
+    gain = 0
+    for block in range(granules * header.channels):
+        start = skip + block * granule_bits
+        part2_3_length = (bits >> (total - start - 12)) & 0xFFF
+        if part2_3_length:
+            gain = max(gain, (bits >> (total - start - 29)) & 0xFF)
+    return gain
+
+
+def id3v2_size(buf):
+    '''Returns the size of an ID3v2 tag at the start of buf, 0 without a tag'''
+    if len(buf) < 10 or buf[:3] != b"ID3":
+        return 0
+    size = (buf[6] & 0x7F) << 21 | (buf[7] & 0x7F) << 14 | (buf[8] & 0x7F) << 7 | (buf[9] & 0x7F)
+    return size + (20 if buf[5] & 0x10 else 10)
+
+
+def iter_frames(stream, chunk_size=1 << 16):
+    '''Yields audio frames of an mp3 read from a file-like object. Tags and
+    bytes between frames are skipped, after losing sync a frame is only
+    accepted when the next header follows it. The Xing/Info header frame
+    of VBR files is dropped, it describes the whole file'''
+    buf = b""
+    base = 0
+    pos = 0
+    eof = False
+    synced = False
+    first = True
+
+    def fill(needed):
+        nonlocal buf, base, pos, eof
+        while not eof and len(buf) - pos < needed:
+            data = stream.read(chunk_size)
+            if not data:
+                eof = True
+                break
+            buf = buf[pos:] + data
+            base += pos
+            pos = 0
+
+    fill(10)
+    skip = id3v2_size(buf[pos:pos + 10])
+    while skip:
+        fill(skip)
+        step = min(skip, len(buf) - pos)
+        if not step:
+            return
+        pos += step
+        skip -= step
+
+    while True:
+        fill(HEADER_SIZE)
+        header = parse_header(buf, pos)
+        if header is not None:
+            # the next header is part of the check while looking for sync
+            fill(header.length + (0 if synced else HEADER_SIZE))
+            complete = len(buf) - pos >= header.length
+            follows = synced or parse_header(buf, pos + header.length) is not None or (
+                eof and len(buf) - pos == header.length)
+            if complete and follows:
+                data = buf[pos:pos + header.length]
+                # VBR tag follows the side information of the first frame
+                tag = data[:HEADER_SIZE + 2 + side_info_size(header) + 4] if first else b""
+                if not (b"Xing" in tag or b"Info" in tag):
+                    gain = layer3_gain(data, header) if header.layer == 3 else None
+                    yield Frame(base + pos, data, header.samples / header.sample_rate, gain)
+                first = False
+                synced = True
+                pos += header.length
+                continue
+        if eof and len(buf) - pos < HEADER_SIZE:
+            return
+        synced = False
+        pos += 1
+
+
+def split_frames(frames, chunk_seconds, search_seconds=0.0, quiet_frames=10):
+    '''Groups frames into chunks of about chunk_seconds. Every cut is moved
+    by at most search_seconds to the middle of the quietest run of
+    quiet_frames frames. Yields (start seconds, list of frames) pairs, the
+    last chunk can be up to chunk_seconds + search_seconds long'''
+    buffered = []
+    # duration of the buffered frames
+    seconds = 0.0
+    start = 0.0
+    for frame in frames:
+        buffered.append(frame)
+        seconds += frame.seconds
+        if seconds < chunk_seconds + search_seconds:
+            continue
+        cut = choose_cut(buffered, chunk_seconds, search_seconds, quiet_frames)
+        chunk = buffered[:cut]
+        yield start, chunk
+        chunk_length = sum(frame.seconds for frame in chunk)
+        start += chunk_length
+        seconds -= chunk_length
+        buffered = buffered[cut:]
+    if buffered:
+        yield start, buffered
+
+
+def choose_cut(frames, chunk_seconds, search_seconds, quiet_frames):
+    '''Returns the index of the frame starting the next chunk'''
+    if len(frames) < 2:
+        return len(frames)
+    times = []
+    elapsed = 0.0
+    for frame in frames:
+        times.append(elapsed)
+        elapsed += frame.seconds
+    candidates = [idx for idx, time in enumerate(times)
+                  if idx and abs(time - chunk_seconds) <= search_seconds]
+    if not candidates:
+        return min(range(1, len(frames)), key=lambda idx: abs(times[idx] - chunk_seconds))
+    if any(frame.gain is None for frame in frames):
+        return min(candidates, key=lambda idx: abs(times[idx] - chunk_seconds))
+    # loudness of the run of frames centered on every candidate, from prefix sums
+    prefix = [0]
+    for frame in frames:
+        prefix.append(prefix[-1] + frame.gain)
+    half = quiet_frames // 2
+
+    def loudness(idx):
+        low = max(0, idx - half)
+        high = min(len(frames), idx + quiet_frames - half)
+        return (prefix[high] - prefix[low]) / (high - low)
+    # among equally quiet cuts the one closest to the target wins
+    return min(candidates, key=lambda idx: (loudness(idx), abs(times[idx] - chunk_seconds)))
+
+
+def split_mp3(stream, chunk_seconds, search_seconds=0.0):
+    '''Cuts an mp3 read from a file-like object into chunks at frame
+    boundaries. Yields (start seconds, mp3 bytes) for every chunk'''
+    for start, frames in split_frames(iter_frames(stream), chunk_seconds, search_seconds):
+        yield start, b"".join(frame.data for frame in frames)
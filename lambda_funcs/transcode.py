@@ -1,15 +1,19 @@
 import json
 import boto3
 
+from instrumentation import InvocationMetrics
+
+metrics = InvocationMetrics('transcode')
+
 def lambda_handler(event, context):
+    metrics.start(context)
     # extract bucket name and key
     s3_obj = event['Records'][0]['s3']
     bucket_name = s3_obj['bucket']['name']
     object_name = s3_obj['object']['key']
     file_uri = 's3://{}/{}'.format(bucket_name, object_name)
-    print(file_uri)
     
-    client = boto3.client('transcribe')
+    client = metrics.instrument(boto3.client('transcribe'))
     
     response = client.start_transcription_job(
         TranscriptionJobName='test',
@@ -19,8 +23,8 @@ def lambda_handler(event, context):
         #JobExecutionSettings={'DataAccessRoleArn':'arn:aws:iam::158238500440:role/s3read_transcribe'}
         )
     
-    print(response)
-    print(event)
+    metrics.flush(object=file_uri, job=response['TranscriptionJob']['TranscriptionJobName'],
+                  status=response['TranscriptionJob']['TranscriptionJobStatus'])
     
     return {
         'statusCode': 200,
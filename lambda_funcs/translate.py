@@ -1,148 +1,426 @@
+import codecs
+import gzip
 import json
-import boto3
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+
+from translation_engine import AwsTranslator, translate_sentences
+from translation_memory import DynamoTranslationMemory
+from content_index import ContentIndex, content_index_table, mark_available
+from instrumentation import InvocationMetrics
+from common import ClientCache, subtitle_doc_version, subtitle_doc_key, subtitle_part_key
+from common import align_part, build_subtitle_doc
 
-dynamodb = boto3.resource('dynamodb')
-s3 = boto3.resource('s3')
-translate = boto3.client('translate')
 transcribe_output_bucket = 'krasniko-a3-transcribe'
 translate_bucket = 'krasniko-a3-translate'
-temp_file_path = '/tmp/hello.txt'
+# chunks of split recordings are uploaded here, see a3_transcribe.chunk_media_key
+mp3_bucket_name = "krasniko-a3-mp3"
 
-def extract_timing_info(items):
-    '''Input must be the dictionary structure stored in items'''
-    timings = ''
-    text = ''
-    sentences = []
+# long transcripts are translated in batches of sentences, several at a time
+max_batch_bytes = int(os.environ.get('TRANSLATE_MAX_BATCH_BYTES', 5000))
+max_translate_workers = int(os.environ.get('TRANSLATE_MAX_WORKERS', 4))
+# languages of a file are translated in parallel, each with its own workers
+max_languages = 4
+# sentences are translated in parts published as soon as they are done, the
+# first part is small and every next one twice as large, 0 disables parts
+first_part_sentences = int(os.environ.get('TRANSLATE_FIRST_PART_SENTENCES', 40))
+max_part_sentences = int(os.environ.get('TRANSLATE_MAX_PART_SENTENCES', 1000))
+# subtitle documents are stored gzip compressed with Content-Encoding set,
+# 0 stores plain json
+doc_gzip_level = int(os.environ.get('SUBTITLE_DOC_GZIP_LEVEL', 6))
+
+metrics = InvocationMetrics('translate')
+logger = logging.getLogger(__name__)
+# stand-ins for local runs can be put here before the first invocation
+clients = ClientCache(metrics, max_pool_connections=max_languages * max_translate_workers)
+get_client = clients.get_client
+
+# sentences translated before are taken from this table, empty disables it
+translation_memory_table = os.environ.get('TRANSLATION_MEMORY_TABLE', 'translation_memory')
+# transcription job names end with a digest, see a3_transcribe.transcription_job_name
+job_digest_pattern = re.compile(r"[0-9a-f]{12}")
+# outputs of chunks of split recordings, see a3_transcribe.chunk_output_key
+chunk_output_pattern = re.compile(r"chunks/([^/]+)/(\d+)\.json")
+
+
+def iter_transcribe_items(body, chunk_size=64 * 1024):
+    '''Yields elements of results.items from Transcribe output one by one.
+    body is a file-like object (e.g. S3 StreamingBody), it is read in chunks
+    so memory use does not depend on the length of the recording.
+    The transcript text before the items list is skipped without decoding'''
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    key = '"items"'
+    buf = ""
+    pos = 0
+    eof = False
+
+    def read_more():
+        chunk = body.read(chunk_size)
+        if not chunk:
+            return utf8.decode(b"", final=True), True
+        return utf8.decode(chunk), False
+
+    # skip everything up to the opening bracket of the items list
+    while True:
+        idx = buf.find(key)
+        if idx == -1:
+            # keep only the tail which might contain the beginning of the key
+            buf = buf[-(len(key) - 1):]
+        else:
+            rest = buf[idx + len(key):].lstrip()
+            after_colon = rest[1:].lstrip()
+            if rest.startswith(":") and after_colon.startswith("["):
+                buf = after_colon[1:]
+                break
+            if (rest and not rest.startswith(":")) or after_colon:
+                # "items" appeared somewhere else than as the key of a list
+                buf = buf[idx + len(key):]
+                continue
+            buf = buf[idx:]
+        if eof:
+            raise ValueError("Transcribe output has no items list")
+        text, eof = read_more()
+        buf += text
+
+    # decode one item at a time, dropping consumed text from the buffer
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            pos += 1
+        if pos < len(buf) and buf[pos] == "]":
+            return
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            text, eof = read_more()
+            buf = buf[pos:] + text
+            pos = 0
+            continue
+        yield item
+        pos = end
+
+
+def iter_sentences(items):
+    '''Groups transcribed words into sentences. Yields (sentence, start, end)
+    tuples as soon as a sentence ending punctuation is seen'''
+    words = []
     sentence_start = True
     sentence_start_time = ''
-    sentence_end_time = ''
+    end = ''
     for item in items:
         if 'start_time' in item:
-            start = item["start_time"]
             end = item["end_time"]
-            word = item["alternatives"][0]["content"]
             if sentence_start:
-                sentence_start_time = start
+                sentence_start_time = item["start_time"]
                 sentence_start = False
-            text += " " + word
+            words.append(" ")
+            words.append(item["alternatives"][0]["content"])
         else:
             punctuation = item["alternatives"][0]["content"]
-            #print(type(punctuation))
+            words.append(punctuation)
             if punctuation == '.' or punctuation == '?' or punctuation == '!':
-                sentence_end_time = end
-                timings += "{}-{},".format(sentence_start_time, sentence_end_time)
+                yield "".join(words), sentence_start_time, end
                 sentence_start = True
-                sentences.append(text + punctuation)
-                text = ""
-            else:
-                text += punctuation
-            
-    return sentences, timings
-        
+                words = []
+
+
+def shift_items(items, offset):
+    '''Moves times of Transcribe items of a chunk by the offset (seconds)
+    of the chunk in the whole recording'''
+    for item in items:
+        if 'start_time' in item:
+            item = dict(item, start_time="{:.3f}".format(float(item["start_time"]) + offset),
+                        end_time="{:.3f}".format(float(item["end_time"]) + offset))
+        yield item
+
+
+def iter_chunk_items(bucket, job_name, offsets):
+    '''Yields items of all chunks of a split recording in order with times
+    relative to the whole recording. offsets are the starts of the chunks in
+    milliseconds. Outputs are requested concurrently and parsed one by one,
+    a sentence cut by a chunk boundary continues in the next chunk'''
+    def open_output(idx):
+        key = "chunks/{}/{:04d}.json".format(job_name, idx)
+        return get_client('s3').get_object(Bucket=bucket, Key=key)['Body']
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_languages * max_translate_workers, len(offsets)))) as pool:
+        bodies = list(pool.map(open_output, range(len(offsets))))
+    for body, offset in zip(bodies, offsets):
+        yield from shift_items(iter_transcribe_items(body), int(offset) / 1000.0)
+
+
+def delete_chunks(output_bucket, job_name, count):
+    '''Deletes the chunk mp3s and their Transcribe outputs once the merged
+    subtitles are written. Failures are only logged, what is left behind is
+    garbage and is not read again'''
+    s3 = get_client('s3')
+    for bucket, ext in ((mp3_bucket_name, "mp3"), (output_bucket, "json")):
+        keys = [{"Key": "chunks/{}/{:04d}.{}".format(job_name, idx, ext)} for idx in range(count)]
+        # DeleteObjects takes up to 1000 keys
+        for start in range(0, len(keys), 1000):
+            try:
+                resp = s3.delete_objects(Bucket=bucket, Delete={"Objects": keys[start:start + 1000], "Quiet": True})
+            except ClientError as e:
+                logger.warning("Deleting chunks of %s from %s failed: %s", job_name, bucket, e)
+                continue
+            for error in resp.get("Errors", []):
+                logger.warning("Deleting s3://%s/%s failed: %s", bucket, error["Key"], error.get("Message"))
+
+
+def extract_timing_info(items):
+    '''Input must be an iterable of items from Transcribe output. Returns the
+    list of sentences and the comma separated timings of every sentence'''
+    sentences = []
+    timings = []
+    for sentence, start, end in iter_sentences(items):
+        sentences.append(sentence)
+        timings.append("{}-{},".format(start, end))
+    return sentences, "".join(timings)
+
+
+def upload_text_to_bucket(text, bucket, key, content_type="text/plain; charset=utf-8", gzip_level=0):
+    '''Uploads text from memory, languages are processed by several threads
+    at once. Returns the number of bytes stored'''
+    body = text.encode("utf-8")
+    extra = {}
+    if gzip_level:
+        # mtime 0 keeps the ETag of the same document the same
+        body = gzip.compress(body, compresslevel=gzip_level, mtime=0)
+        extra["ContentEncoding"] = "gzip"
+    get_client('s3').put_object(Bucket=bucket, Key=key, Body=body, ContentType=content_type, **extra)
+    return len(body)
 
-def upload_text_to_bucket(text, bucket, key):
-    with open(temp_file_path, 'w') as f:
-        f.write(text)
 
-    #upload the text file to proper bucket
-    s3.meta.client.upload_file(temp_file_path, bucket, key)
+def parse_output_key(object_name):
+    '''Returns user and file name without extension from the key of Transcribe
+    output, which is the job name (user-<name>-<digest>) followed by .json.
+    Jobs started before names had a digest are user-<name>.json'''
+    user, job = object_name.rsplit(".", 1)[0].split("-", 1)
+    filename_noext, _, digest = job.rpartition("-")
+    if not filename_noext or not job_digest_pattern.fullmatch(digest):
+        filename_noext = job
+    return user, filename_noext
+
+
+def part_bounds(num_sentences, first=None, largest=None):
+    '''Splits sentences into the ordered parts they are translated in.
+    Returns list of (start, end) sentence index pairs'''
+    first = first_part_sentences if first is None else first
+    largest = max_part_sentences if largest is None else largest
+    if first <= 0:
+        return [(0, num_sentences)]
+    bounds = []
+    start = 0
+    size = first
+    while start < num_sentences:
+        end = min(num_sentences, start + size)
+        bounds.append((start, end))
+        start = end
+        size = max(size, min(largest, size * 2))
+    return bounds or [(0, 0)]
+
+
+def publish_part(user, filename_noext, lang, parts, version):
+    '''Records that the first parts of the language can be shown'''
+    get_client('dynamodb').update_item(
+        TableName="files",
+        Key={"user": user, 'filename': filename_noext + ".mp3"},
+        UpdateExpression="SET #p = :n, version = :v, modified = :t",
+        ExpressionAttributeNames={"#p": "parts_" + lang},
+        ExpressionAttributeValues={":n": parts, ":v": version, ":t": int(time.time())}
+    )
+
+
+def translate_language(sentences, timings, src_lang, dst_lang, user, filename_noext, version, content_hash=None):
+    '''Translates extracted sentences into one language part by part. Every
+    part but the last is written as a part document and counted in
+    parts_<lang> of the files item, so the web app shows subtitles before the
+    whole file is done. The subtitle document of all parts marks the language
+    as available and is added to the content index when the content hash of
+    the mp3 is known'''
+    memory = None
+    if translation_memory_table:
+        memory = DynamoTranslationMemory(get_client('dynamodb'), translation_memory_table)
+
+    timing_list = timings.split(",")
+    bounds = part_bounds(len(sentences))
+    segments = []
+    # sentences at the end of a part whose anchor Translate dropped
+    pending = None
+    for part, (start, end) in enumerate(bounds):
+        # translate batches of whole sentences in parallel, anchors stay in place
+        with metrics.stage("translate." + dst_lang):
+            marked_text, dst_text = translate_sentences(
+                sentences[start:end], AwsTranslator(get_client('translate')), src_lang, dst_lang,
+                max_bytes=max_batch_bytes, max_workers=max_translate_workers, memory=memory)
+
+        # align sentences once here, web app only needs to read the document
+        with metrics.stage("align." + dst_lang):
+            part_segments, pending = align_part(marked_text, dst_text, ",".join(timing_list[start:end]), pending)
+        segments.extend(part_segments)
+        if part < len(bounds) - 1:
+            with metrics.stage("store." + dst_lang):
+                upload_text_to_bucket(build_subtitle_doc(part_segments, src_lang, dst_lang), translate_bucket,
+                                      subtitle_part_key(user, filename_noext, dst_lang, part),
+                                      content_type="application/json; charset=utf-8", gzip_level=doc_gzip_level)
+                publish_part(user, filename_noext, dst_lang, part + 1, version)
+        if part == 0:
+            # time to first subtitles should not depend on the length of the file
+            metrics.set("first_part_seconds." + dst_lang, round(metrics.elapsed(), 6))
+    metrics.set("parts." + dst_lang, len(bounds))
+    if memory is not None:
+        # hit rate and saved characters feed translate_costs_per_month
+        metrics.set("memory." + dst_lang, memory.stats())
+
+    doc = build_subtitle_doc(segments, src_lang, dst_lang)
+    metrics.set("doc_chars." + dst_lang, len(doc))
+    subtitle_doc_object = subtitle_doc_key(user, filename_noext, dst_lang)
+    with metrics.stage("store." + dst_lang):
+        doc_bytes = upload_text_to_bucket(doc, translate_bucket, subtitle_doc_object,
+                                          content_type="application/json; charset=utf-8",
+                                          gzip_level=doc_gzip_level)
+        metrics.set("doc_bytes." + dst_lang, doc_bytes)
+
+        mark_available(get_client('dynamodb'), user, filename_noext, [dst_lang], version, subtitle_doc_version)
+        if content_hash and content_index_table:
+            try:
+                ContentIndex(get_client('dynamodb')).add_doc(get_client('s3'), content_hash, src_lang, dst_lang,
+                                                             subtitle_doc_object)
+            except ClientError as e:
+                # the language is available already, only later duplicates miss it
+                logger.warning("Adding %s to the content index failed: %s", subtitle_doc_object, e)
+                metrics.set("content_index_error", str(e))
+
+
+def reuse_languages(content_hash, src_lang, dst_langs, bucket, key, user, filename_noext, version):
+    '''Copies subtitle documents of languages found in the content index and
+    marks them available, records the transcript if the content is new (key
+    is None for merged chunks). Returns the languages that still have to be
+    translated'''
+    index = ContentIndex(get_client('dynamodb'))
+    entry = index.lookup(content_hash, src_lang)
+    if entry is None:
+        if key is not None:
+            index.add_transcript(content_hash, src_lang, bucket, key, version)
+        return dst_langs
+    reused = [lang for lang in dst_langs if lang in index.languages(entry)
+              and index.copy_doc(get_client('s3'), entry, lang, user, filename_noext)]
+    if reused:
+        mark_available(get_client('dynamodb'), user, filename_noext, reused, version, subtitle_doc_version)
+    metrics.set("reused_langs", reused)
+    return [lang for lang in dst_langs if lang not in reused]
+
+
+def record_chunk(user, filename_noext, job_name, idx):
+    '''Adds the chunk to the finished chunks of the files item. Returns the
+    item after the update, None if the chunk belongs to an earlier upload
+    of a file with the same name'''
+    try:
+        return get_client('dynamodb').update_item(
+            TableName="files",
+            Key={"user": user, 'filename': filename_noext + ".mp3"},
+            UpdateExpression="ADD chunks_done :c",
+            ConditionExpression="chunk_job = :j",
+            ExpressionAttributeValues={":c": {idx}, ":j": job_name},
+            ReturnValues="ALL_NEW",
+        )["Attributes"]
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return None
+
 
 def lambda_handler(event, context):
+    metrics.start(context)
     # extract bucket name and key
     s3_obj = event['Records'][0]['s3']
     bucket_name = s3_obj['bucket']['name']
     object_name = s3_obj['object']['key']
+    # etag of transcribe output identifies this version of the transcript
+    version = s3_obj['object'].get('eTag', '')
     file_uri = 's3://{}/{}'.format(bucket_name, object_name)
-    print(file_uri)
-    
-    #extract the user name and file name from the object name
-    user, filename = object_name.split("-", 1)
-    filename_noext = filename.rsplit(".")[0]
-    print(user, filename_noext)
-    
-    # access the database to get the source language and destination languages
-    table = dynamodb.Table("files")
-    resp = table.get_item(
-        Key={"user": user, 'filename': filename_noext+".mp3"}
-    )
-    print (resp)
-    
+
+    chunk = chunk_output_pattern.fullmatch(object_name)
+    if chunk is not None:
+        # chunk of a split recording, the last one to finish merges all of them
+        job_name, idx = chunk.group(1), int(chunk.group(2))
+        user, filename_noext = parse_output_key(job_name + ".json")
+        item = record_chunk(user, filename_noext, job_name, idx)
+        if item is None or len(item["chunks_done"]) < len(item["chunk_offsets"]):
+            metrics.flush(object=file_uri, chunk=idx, waiting=item is not None)
+            return {'statusCode': 200, 'body': json.dumps('Waiting for other chunks')}
+        dst_langs = item.get('dstlangs') or [item['dstlang']]
+        if item.get("version") == job_name and set(dst_langs) <= set(item.get("available_langs", ())):
+            # repeated event of a chunk, the outputs were merged and deleted
+            metrics.flush(object=file_uri, chunk=idx, merged=True)
+            return {'statusCode': 200, 'body': json.dumps('Chunks already merged')}
+        # merged transcript has no single ETag, the job name is unique per upload
+        version = job_name
+        transcript_key = None
+        with metrics.stage("read"):
+            sentences, timings = extract_timing_info(
+                iter_chunk_items(bucket_name, job_name, item["chunk_offsets"]))
+        metrics.set("chunks", len(item["chunk_offsets"]))
+    else:
+        #extract the user name and file name from the object name
+        user, filename_noext = parse_output_key(object_name)
+        transcript_key = object_name
+
+        # the files record is read while the transcript is streamed and parsed
+        with metrics.stage("read"), ThreadPoolExecutor(max_workers=1) as pool:
+            item_future = pool.submit(
+                get_client('dynamodb').get_item,
+                TableName="files",
+                Key={"user": user, 'filename': filename_noext+".mp3"}
+            )
+            body = get_client('s3').get_object(Bucket=bucket_name, Key=object_name)['Body']
+            # items are parsed while they are streamed, whole json is never in memory
+            sentences, timings = extract_timing_info(iter_transcribe_items(body))
+            item = item_future.result()["Item"]
+
     #extract source and destination languages
-    src_lang = resp["Item"]['srclang']
-    dst_lang = resp["Item"]['dstlang']
-    
-    #this should be the uri for json file from transcribe
-    #read it and extract the text
-    
-    s3 = boto3.resource('s3')
-    s3.meta.client.download_file(bucket_name, object_name, temp_file_path)
-    
-    with open(temp_file_path, 'r') as f:
-        json_resp = json.load(f)
-        text = json_resp['results']['transcripts'][0]['transcript']
-        items = json_resp['results']['items']
-        print("ITEMS", items)
-        #also need to extract the timings
-        sentences, timings = extract_timing_info(items)
-        print(timings)
-        print( sentences)
-    
-
-    #text_bucket = "krasniko-ece1779-a3-text"
-    src_text_object = "{}/{}.{}".format(user, filename_noext, src_lang) #'test_en.txt'
-    timings_object = "{}/{}.time".format(user, filename_noext)
-    #upload the text file to proper bucket
-    #s3.meta.client.upload_file(temp_file_path, translate_bucket, src_text_object)
-    
-    ###### return to this code if things stop working
-    #marked_text = " [1] ".join(sentences)
-    
-    #####[1] [2]
-    marked_text = ""
-    anchor_idx = 0
-    for sent in sentences:
-        marked_text += sent + " [{}] ".format(anchor_idx)
-        anchor_idx += 1
-    
-    
-    upload_text_to_bucket(marked_text, translate_bucket, src_text_object)
-    upload_text_to_bucket(timings, translate_bucket, timings_object)
-    
-    
-    print(marked_text)
-    response = translate.translate_text(
-        Text=marked_text,
-        SourceLanguageCode=src_lang, #see here https://docs.aws.amazon.com/translate/latest/dg/what-is.html#what-is-languages
-        TargetLanguageCode=dst_lang,
-        #ClientToken='string'
-    )
-    
-    
-    print(response["TranslatedText"])
-    
-    # get the translated text, save to temp file and then upload to s3
-    dst_text = response["TranslatedText"]
-    #with open(temp_file_path, 'w') as f:
-    #    f.write(dst_text)
-    
-    dst_text_object = "{}/{}.{}".format(user, filename_noext, dst_lang)
-    #s3.meta.client.upload_file(temp_file_path, translate_bucket, dst_text_object)
-    upload_text_to_bucket(dst_text, translate_bucket, dst_text_object)
-    
-    # update add available attribute, for web app to know processing is done
-    table = dynamodb.Table("files")
-    resp = table.update_item(
-        Key={"user": user, 'filename': filename_noext+".mp3"},
-        UpdateExpression = "SET available = :b",
-        ExpressionAttributeValues = {":b": True}
-    )
-    print(resp)
-    
+    src_lang = item['srclang']
+    dst_langs = item.get('dstlangs') or [item['dstlang']]
+    metrics.set("sentences", len(sentences))
+    metrics.set("source_chars", sum(len(sentence) for sentence in sentences))
+
+    # languages translated for an earlier upload of the same mp3 are copied
+    content_hash = item.get('content_hash')
+    if content_hash and content_index_table:
+        with metrics.stage("reuse"):
+            try:
+                dst_langs = reuse_languages(content_hash, src_lang, dst_langs, bucket_name, transcript_key,
+                                            user, filename_noext, version)
+            except ClientError as e:
+                # the index only saves work, every language is translated without it
+                logger.warning("Content index lookup for %s failed: %s", file_uri, e)
+                metrics.set("content_index_error", str(e))
+
+    # sentences and timings are shared, every language is translated in parallel
+    with ThreadPoolExecutor(max_workers=max(1, len(dst_langs))) as pool:
+        futures = [pool.submit(translate_language, sentences, timings, src_lang, dst_lang,
+                               user, filename_noext, version, content_hash)
+                   for dst_lang in dst_langs]
+    try:
+        for future in futures:
+            future.result()
+    except Exception as e:
+        metrics.flush(object=file_uri, languages=dst_langs, error=str(e), force=True)
+        raise
+    if chunk is not None:
+        with metrics.stage("cleanup"):
+            delete_chunks(bucket_name, job_name, len(item["chunk_offsets"]))
+    metrics.flush(object=file_uri, languages=dst_langs)
+
     #TODO: maybe also delete the transcription job
-    
-    #print(event)
+
     return {
         'statusCode': 200,
         'body': json.dumps('Hello from Lambda!')
     }
-
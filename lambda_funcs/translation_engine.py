@@ -0,0 +1,176 @@
+'''Translation of long anchored transcripts. Text is split into batches of
+whole sentences that fit into one TranslateText request, batches are
+translated concurrently and put back together in the original order.
+Module does not depend on boto3, so it can be used with FakeTranslator
+for local runs and benchmarks'''
+
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# TranslateText accepts at most 10,000 bytes of UTF-8 text per request
+DEFAULT_MAX_BATCH_BYTES = 5000
+DEFAULT_MAX_WORKERS = 4
+
+ANCHOR_PATTERN = re.compile(r"\[(\d+)\]")
+
+
+class AwsTranslator:
+    '''Translator backed by Amazon Translate client'''
+
+    def __init__(self, client):
+        self.client = client
+
+    def translate(self, text, src_lang, dst_lang):
+        response = self.client.translate_text(
+            Text=text,
+            SourceLanguageCode=src_lang,
+            TargetLanguageCode=dst_lang,
+        )
+        return response["TranslatedText"]
+
+
+class FakeTranslator:
+    '''Local stand in for Amazon Translate. Upper-cases the text, so anchors
+    are kept intact, and optionally sleeps to simulate service latency.
+    Keeps count of the requests and characters it was asked to translate'''
+
+    def __init__(self, latency=0.0, max_bytes=10000):
+        self.latency = latency
+        self.max_bytes = max_bytes
+        self.requests = 0
+        self.characters = 0
+        self._lock = threading.Lock()
+
+    def translate(self, text, src_lang, dst_lang):
+        if len(text.encode("utf-8")) > self.max_bytes:
+            raise ValueError("Text size exceeds {} bytes".format(self.max_bytes))
+        with self._lock:
+            self.requests += 1
+            self.characters += len(text)
+        if self.latency:
+            time.sleep(self.latency)
+        return text.upper().strip()
+
+
+def anchored_pieces(sentences, first_anchor=0):
+    '''Returns sentences followed by their [n] anchors, the way they are
+    concatenated into the marked text'''
+    return ["{} [{}] ".format(sent, idx) for idx, sent in enumerate(sentences, first_anchor)]
+
+
+def _split_oversized(piece, max_bytes):
+    '''Splits a single sentence that does not fit into a batch at word
+    boundaries. Only the last part keeps the anchor'''
+    parts = []
+    current = []
+    size = 0
+    for word in piece.split(" "):
+        word_size = len(word.encode("utf-8")) + 1
+        if current and size + word_size > max_bytes:
+            parts.append(" ".join(current) + " ")
+            current = []
+            size = 0
+        current.append(word)
+        size += word_size
+    if current:
+        parts.append(" ".join(current))
+    return parts
+
+
+def split_into_batches(pieces, max_bytes=DEFAULT_MAX_BATCH_BYTES):
+    '''Groups consecutive anchored sentences into batches of at most
+    max_bytes of UTF-8 text. Returns list of batch strings'''
+    batches = []
+    current = []
+    size = 0
+    for piece in pieces:
+        piece_size = len(piece.encode("utf-8"))
+        if piece_size > max_bytes:
+            if current:
+                batches.append("".join(current))
+                current = []
+                size = 0
+            batches.extend(_split_oversized(piece, max_bytes))
+            continue
+        if current and size + piece_size > max_bytes:
+            batches.append("".join(current))
+            current = []
+            size = 0
+        current.append(piece)
+        size += piece_size
+    if current:
+        batches.append("".join(current))
+    return batches
+
+
+def translate_batches(batches, translator, src_lang, dst_lang, max_workers=DEFAULT_MAX_WORKERS):
+    '''Translates batches concurrently. Returns translations in the order
+    of the batches'''
+    if len(batches) <= 1 or max_workers <= 1:
+        return [translator.translate(batch, src_lang, dst_lang) for batch in batches]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(batches))) as pool:
+        return list(pool.map(lambda batch: translator.translate(batch, src_lang, dst_lang), batches))
+
+
+def split_translations(translated, anchors):
+    '''Cuts translated text of consecutive sentences back into sentences.
+    anchors are the anchor numbers in the order they were sent. Returns
+    dictionary from anchor number to translation, only for the leading
+    anchors that came back in the same order'''
+    result = {}
+    prev_end = 0
+    expected = iter(anchors)
+    for match in ANCHOR_PATTERN.finditer(translated):
+        if int(match.group(1)) != next(expected, None):
+            break
+        result[int(match.group(1))] = translated[prev_end:match.start()].strip()
+        prev_end = match.end()
+    return result
+
+
+def _runs(indices):
+    '''Groups sorted indices into runs of consecutive numbers'''
+    runs = []
+    for idx in indices:
+        if runs and runs[-1][-1] == idx - 1:
+            runs[-1].append(idx)
+        else:
+            runs.append([idx])
+    return runs
+
+
+def translate_sentences(sentences, translator, src_lang, dst_lang,
+                        max_bytes=DEFAULT_MAX_BATCH_BYTES, max_workers=DEFAULT_MAX_WORKERS,
+                        memory=None):
+    '''Translates list of sentences. Returns the anchored source text and
+    the anchored translation in which [n] follows the translation of n-th
+    sentence (unless Translate dropped it). When translation memory is given,
+    only sentences missing from it are sent to the translator'''
+    pieces = anchored_pieces(sentences)
+    known = memory.lookup(src_lang, dst_lang, sentences) if memory is not None else {}
+
+    # runs of consecutive unknown sentences are batched separately, so
+    # translations can be put back between the known ones
+    runs = _runs([idx for idx in range(len(sentences)) if idx not in known])
+    run_batches = [split_into_batches([pieces[idx] for idx in run], max_bytes) for run in runs]
+    flat = [batch for batches in run_batches for batch in batches]
+    translations = iter(translate_batches(flat, translator, src_lang, dst_lang, max_workers))
+    run_texts = {}
+    for run, batches in zip(runs, run_batches):
+        run_texts[run[0]] = " ".join(next(translations) for _ in batches)
+
+    parts = []
+    learned = []
+    for idx in range(len(sentences)):
+        if idx in known:
+            parts.append("{} [{}]".format(known[idx], idx))
+        elif idx in run_texts:
+            parts.append(run_texts[idx])
+    if memory is not None:
+        for run in runs:
+            for idx, translation in split_translations(run_texts[run[0]], run).items():
+                learned.append((sentences[idx], translation))
+        memory.store(src_lang, dst_lang, learned)
+    return "".join(pieces), " ".join(parts)
@@ -0,0 +1,204 @@
+'''Sentence level translation memory. Translations are stored under
+(source language, destination language, hash of normalized sentence), so
+repeated sentences are translated only once. DynamoTranslationMemory is
+used by the lambda, SqliteTranslationMemory is a stand in for local runs.
+The memory only saves work: when it fails, lookups count as misses and
+new translations are not stored, translation goes on without it'''
+
+import hashlib
+import logging
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from botocore.exceptions import ClientError
+    DYNAMO_ERRORS = (ClientError,)
+except ImportError:
+    DYNAMO_ERRORS = ()
+
+logger = logging.getLogger(__name__)
+
+# BatchGetItem and BatchWriteItem limits
+DYNAMO_BATCH_GET = 100
+DYNAMO_BATCH_WRITE = 25
+# unprocessed keys of a throttled table are sent again after exponential
+# backoff, those left after the last attempt are given up
+DYNAMO_MAX_ATTEMPTS = 6
+DYNAMO_BACKOFF_BASE = 0.05
+DYNAMO_BACKOFF_MAX = 2.0
+
+
+def backoff_delay(attempt, base=DYNAMO_BACKOFF_BASE, cap=DYNAMO_BACKOFF_MAX):
+    '''Returns seconds to sleep before a retry (attempt 1 is the first one),
+    with full jitter, so parallel batches do not retry in step'''
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def normalize_sentence(sentence):
+    '''Collapses whitespace, so the same sentence always gets the same key'''
+    return " ".join(sentence.split())
+
+
+def memory_key(src_lang, dst_lang, sentence):
+    digest = hashlib.sha256(normalize_sentence(sentence).encode("utf-8")).hexdigest()
+    return "{}:{}:{}".format(src_lang, dst_lang, digest)
+
+
+class TranslationMemory:
+    '''Common part of translation memories. Subclasses implement _get_many
+    and _put_many working with lists of keys. Keeps hit/miss counters and
+    the number of characters that did not have to be translated. Exceptions
+    listed in errors are logged and counted as failures instead of raised'''
+
+    errors = ()
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        self.characters = 0
+        self.saved_characters = 0
+        self._stats_lock = threading.Lock()
+
+    def lookup(self, src_lang, dst_lang, sentences):
+        '''Returns dictionary from sentence index to stored translation'''
+        keys = [memory_key(src_lang, dst_lang, sent) for sent in sentences]
+        try:
+            found = self._get_many(list(set(keys)))
+        except self.errors as e:
+            logger.warning("Translation memory lookup failed: %s", e)
+            found = {}
+            with self._stats_lock:
+                self.failures += 1
+        result = {idx: found[key] for idx, key in enumerate(keys) if key in found}
+        with self._stats_lock:
+            self.hits += len(result)
+            self.misses += len(sentences) - len(result)
+            self.characters += sum(len(sent) for sent in sentences)
+            self.saved_characters += sum(len(sentences[idx]) for idx in result)
+        return result
+
+    def store(self, src_lang, dst_lang, translations):
+        '''Stores list of (sentence, translation) pairs'''
+        entries = {memory_key(src_lang, dst_lang, sent): translation
+                   for sent, translation in translations if translation}
+        if entries:
+            try:
+                self._put_many(entries)
+            except self.errors as e:
+                logger.warning("Translation memory store failed: %s", e)
+                with self._stats_lock:
+                    self.failures += 1
+
+    def stats(self):
+        with self._stats_lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "failures": self.failures,
+                "hit_rate": self.hits / total if total else 0.0,
+                "characters": self.characters,
+                "saved_characters": self.saved_characters,
+                "saved_characters_ratio": self.saved_characters / self.characters if self.characters else 0.0,
+            }
+
+
+class DynamoTranslationMemory(TranslationMemory):
+    '''Translation memory in a DynamoDB table with string partition key "key"
+    and "translation" attribute. client must accept python types, e.g. the
+    meta.client of a dynamodb resource. Batches of one lookup or store are
+    sent concurrently by up to max_workers threads'''
+
+    errors = DYNAMO_ERRORS
+
+    def __init__(self, client, table_name, max_workers=4):
+        super().__init__()
+        self.client = client
+        self.table_name = table_name
+        self.max_workers = max_workers
+
+    def _map(self, func, chunks):
+        if len(chunks) <= 1 or self.max_workers <= 1:
+            return [func(chunk) for chunk in chunks]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(chunks))) as pool:
+            return list(pool.map(func, chunks))
+
+    def _get_batch(self, keys):
+        found = {}
+        request = {self.table_name: {
+            "Keys": [{"key": key} for key in keys],
+            "ProjectionExpression": "#k, #t",
+            "ExpressionAttributeNames": {"#k": "key", "#t": "translation"},
+        }}
+        for attempt in range(DYNAMO_MAX_ATTEMPTS):
+            if attempt:
+                time.sleep(backoff_delay(attempt))
+            resp = self.client.batch_get_item(RequestItems=request)
+            for item in resp["Responses"].get(self.table_name, []):
+                found[item["key"]] = item["translation"]
+            request = resp.get("UnprocessedKeys")
+            if not request:
+                break
+        else:
+            logger.warning("Translation memory lookup gave up %d unprocessed keys",
+                           len(request[self.table_name]["Keys"]))
+        return found
+
+    def _get_many(self, keys):
+        found = {}
+        chunks = [keys[start:start + DYNAMO_BATCH_GET] for start in range(0, len(keys), DYNAMO_BATCH_GET)]
+        for batch_found in self._map(self._get_batch, chunks):
+            found.update(batch_found)
+        return found
+
+    def _put_batch(self, items):
+        request = {self.table_name: [
+            {"PutRequest": {"Item": {"key": key, "translation": translation}}}
+            for key, translation in items
+        ]}
+        for attempt in range(DYNAMO_MAX_ATTEMPTS):
+            if attempt:
+                time.sleep(backoff_delay(attempt))
+            resp = self.client.batch_write_item(RequestItems=request)
+            request = resp.get("UnprocessedItems")
+            if not request:
+                return
+        logger.warning("Translation memory store gave up %d unprocessed items", len(request[self.table_name]))
+
+    def _put_many(self, entries):
+        items = list(entries.items())
+        self._map(self._put_batch, [items[start:start + DYNAMO_BATCH_WRITE]
+                                    for start in range(0, len(items), DYNAMO_BATCH_WRITE)])
+
+
+class SqliteTranslationMemory(TranslationMemory):
+    '''Translation memory in a SQLite database, used for local runs'''
+
+    def __init__(self, path=":memory:"):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS translation_memory (key TEXT PRIMARY KEY, translation TEXT)")
+
+    def _get_many(self, keys):
+        found = {}
+        with self._lock:
+            # stay below the default limit of variables in one statement
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._conn.execute(
+                    "SELECT key, translation FROM translation_memory WHERE key IN ({})".format(
+                        ",".join("?" * len(chunk))), chunk)
+                found.update(rows)
+        return found
+
+    def _put_many(self, entries):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO translation_memory (key, translation) VALUES (?, ?)",
+                list(entries.items()))
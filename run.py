@@ -4,6 +4,9 @@
 import sys
 #import manager_app
 import app
+# development server only, production runs under gunicorn:
+#   gunicorn -c gunicorn.conf.py wsgi:application
 if __name__ == "__main__":
+    app.start_background_tasks()
     app.webapp.run(host='0.0.0.0', port='5001')#debug=True)
 
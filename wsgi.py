@@ -0,0 +1,7 @@
+'''WSGI entry point for production servers:
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+'''
+from app import webapp as application, start_background_tasks
+
+start_background_tasks()